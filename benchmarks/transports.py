@@ -0,0 +1,124 @@
+"""
+benchmark `call_agent` requests to a worker across transports
+(TCP, unix domain sockets, each with and without shared memory)
+and event loops (asyncio, and uvloop if it's installed).
+
+reports messages per second (with many requests in flight)
+and latency percentiles (one request at a time).
+
+    python benchmarks/transports.py [n_requests]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import multiprocessing
+import numpy as np
+from cess.agent import Agent
+from cess.cluster import transport
+from cess.cluster.client import Client
+from cess.cluster.arbiter import Arbiter
+from cess.cluster.worker import Worker
+
+CONCURRENCY = 64
+
+
+class EchoAgent(Agent):
+    def echo(self, x):
+        return x
+
+
+def set_loop(loop):
+    if loop == 'uvloop':
+        transport.use_fast_loop()
+    else:
+        asyncio.set_event_loop_policy(None)
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+
+def serve(loop, arbiter_addr, worker_addr, ready):
+    """run an arbiter and a worker hosting an agent"""
+    set_loop(loop)
+    loop = asyncio.get_event_loop()
+    arbiter, worker = Arbiter(), Worker()
+    loop.run_until_complete(arbiter.start(*arbiter_addr))
+    loop.run_until_complete(worker.start(*arbiter_addr, host=worker_addr[0], port=worker_addr[1]))
+    loop.run_until_complete(worker.populate({'agents': [EchoAgent()]}))
+    ready.put(list(worker.agents)[0])
+    loop.run_forever()
+
+
+def measure(loop, worker_addr, shared, agent_id, n, results):
+    set_loop(loop)
+    loop = asyncio.get_event_loop()
+    client = Client(*worker_addr, shared=shared)
+    req = {'cmd': 'call_agent', 'id': agent_id, 'func': 'echo', 'args': [1]}
+
+    @asyncio.coroutine
+    def run():
+        # warm up the connection pool
+        yield from asyncio.gather(*[client.send_recv(req) for _ in range(CONCURRENCY)])
+
+        latencies = []
+        for _ in range(n):
+            start = time.perf_counter()
+            yield from client.send_recv(req)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(n//CONCURRENCY):
+            yield from asyncio.gather(*[client.send_recv(req) for _ in range(CONCURRENCY)])
+        rate = (n//CONCURRENCY * CONCURRENCY)/(time.perf_counter() - start)
+        return rate, latencies
+
+    rate, latencies = loop.run_until_complete(run())
+    client.close()
+    latencies = np.array(latencies) * 1e6
+    results.put((rate, np.percentile(latencies, 50), np.percentile(latencies, 99)))
+
+
+def bench(loop, kind, shared, n, port):
+    tmp = tempfile.mkdtemp()
+    if kind == 'unix':
+        arbiter_addr = ('unix', os.path.join(tmp, 'arbiter.sock'))
+        worker_addr = ('unix', os.path.join(tmp, 'worker.sock'))
+    else:
+        arbiter_addr = ('127.0.0.1', port)
+        worker_addr = ('127.0.0.1', port + 1)
+
+    ready, results = multiprocessing.Queue(), multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(loop, arbiter_addr, worker_addr, ready))
+    server.start()
+    try:
+        agent_id = ready.get(timeout=10)
+        client = multiprocessing.Process(target=measure,
+                                         args=(loop, worker_addr, shared, agent_id, n, results))
+        client.start()
+        result = results.get(timeout=300)
+        client.join()
+        return result
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    loops = ['asyncio']
+    try:
+        import uvloop
+        loops.append('uvloop')
+    except ImportError:
+        print('uvloop is not installed, only benchmarking asyncio')
+
+    print('{:8} {:5} {:6} {:>10} {:>9} {:>9}'.format('loop', 'via', 'shm', 'msgs/s', 'p50 us', 'p99 us'))
+    port = 9100
+    for loop in loops:
+        for kind in ['tcp', 'unix']:
+            for shared in [False, True]:
+                rate, p50, p99 = bench(loop, kind, shared, n, port)
+                port += 2
+                print('{:8} {:5} {:6} {:10.0f} {:9.1f} {:9.1f}'.format(
+                    loop, kind, str(shared), rate, p50, p99))
@@ -1,3 +1,3 @@
-from .sim import Simulation
+from .sim import Simulation, BSPSimulation
 from .cluster import Cluster
 from .agent import Agent, Action, Goal, Prereq, PlanningAgent
\ No newline at end of file
@@ -1,4 +1,5 @@
 from .prereq import Prereq
 from .action import Action, Goal
 from .base import Agent, AgentProxy
+from .store import AgentStore
 from .plan import PlanningAgent
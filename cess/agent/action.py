@@ -1,10 +1,21 @@
-from .outcome import resolve_outcomes, expected_state, outcome_dist
+import random
+from .outcome import resolve_outcomes, outcome_dist, OutcomeTable
+from .prereq import compile_prereqs, check
 
 
 class PrereqsUnsatisfied(Exception):
     pass
 
 
+def _compiled(table, updates, dist):
+    """an `OutcomeTable` for the outcomes, reusing
+    `table` unless the updates or dist have been replaced
+    (they should be replaced, not modified in place)"""
+    if table is None or table.updates is not updates or table.dist is not dist:
+        table = OutcomeTable(updates, dist)
+    return table
+
+
 class Action():
     """
     An action an agent can take. actions has a distribution
@@ -34,15 +45,20 @@ class Action():
         self.updates, self.dist = outcomes
         self._cost = cost
 
+        # the outcomes compiled for computing expected states,
+        # and the prereqs compiled for checking them (see `prereq.compile_prereqs`)
+        self._table = None
+        self._program = None
+
     def __repr__(self):
         return 'Action({})'.format(self.name)
 
-    def __call__(self, state):
+    def __call__(self, state, rng=random):
         """complete this action (if its prereqs are satisfied),
         @returns an outcome state"""
         if not self.satisfied(state):
             raise PrereqsUnsatisfied
-        return resolve_outcomes(state, self.updates, self.dist)
+        return resolve_outcomes(state, self.updates, self.dist, rng)
  
     def satisfied(self, state):
         """ True if this Action's prerequisistes are satisifed by 
@@ -50,25 +66,25 @@ class Action():
         @parm: state: dict of {substate_key';substate_value }
         @true if all prerequisities are satisifed by the passed states
         """
-        sat = []
-        for p_key, prereqObj in self.prereqs.items():
-            if state is None:
-                sat.append(None)
-                break
-            elif p_key in state.keys():
-                reqObj =  self.prereqs[p_key]
-                isSat = reqObj( state[p_key] )
-                sat.append(isSat)
-            else: 
-                sat.append(False) # key not in state, can't be satisifed
-        return all(sat)
-        #return all(prereq(state[k]) for k, prereq in self.prereqs.items())
+        if not self.prereqs:
+            return True
+        if state is None:
+            return False
+        return check(self.program(), state)
+
+    def program(self):
+        """the action's prereqs, compiled. they're recompiled
+        if `prereqs` is replaced (it shouldn't be modified in place)"""
+        if self._program is None or self._program[0] is not self.prereqs:
+            self._program = (self.prereqs, compile_prereqs(self.prereqs))
+        return self._program[1]
 
     def cost(self):
         return self._cost
 
     def expected_state(self, state):
-        return expected_state(state, self.updates, self.dist)
+        self._table = _compiled(self._table, self.updates, self.dist)
+        return self._table.expected_state(state)
 
     def outcomes(self, state):
         return outcome_dist(state, self.updates, self.dist)
@@ -85,6 +101,7 @@ class Goal(Action):
         if failures is None:
             failures = ([{}], [1.])
         self.fail_updates, self.fail_dist = failures
+        self._fail_table = None
 
     def __repr__(self):
         return 'Goal({})'.format(self.name)
@@ -93,12 +110,13 @@ class Goal(Action):
         if self.time is not None:
             self.time -= 1
 
-    def fail(self, state):
+    def fail(self, state, rng=random):
         """fail to complete this goal, returning the resulting state"""
-        return resolve_outcomes(state, self.fail_updates, self.fail_dist)
+        return resolve_outcomes(state, self.fail_updates, self.fail_dist, rng)
 
     def reset(self):
         self.time = self._time
 
     def expected_failure_state(self, state):
-        return expected_state(state, self.fail_updates, self.fail_dist)
+        self._fail_table = _compiled(self._fail_table, self.fail_updates, self.fail_dist)
+        return self._fail_table.expected_state(state)
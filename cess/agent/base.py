@@ -1,5 +1,9 @@
+import random
 import asyncio
 from uuid import uuid4
+from ..rng import Stream, AGENT
+from .. import snapshot
+from ..bsp import MESSAGE, WRITE
 
 
 class Agent():
@@ -12,10 +16,29 @@ class Agent():
     # instead of using `super()`, use `self._super(Subclass, self)`
     _super = super
 
-    def __init__(self, state=None):
+    # the agent's random number generator; this is the global `random`
+    # module unless the simulation is seeded (see `reseed`)
+    rng = random
+    rng_key = None
+
+    # relative cost of running this agent, and a key for
+    # agents which interact heavily and should be kept together,
+    # for distributing agents (see `cess.cluster.partition`)
+    load = 1
+    affinity = None
+
+    # state keys other agents read as of the start of a step,
+    # served from a per-step snapshot (see `cess.snapshot`)
+    snapshot_keys = ()
+
+    def __init__(self, state=None, store=None):
+        """if an `AgentStore` is specified, the agent's
+        state is kept in it rather than in a dict"""
         self.id = uuid4().hex
         self.type = type(self)
         self._state = state or {}
+        if store is not None:
+            store.adopt(self)
 
     def __setitem__(self, key, val):
         """set a state value;
@@ -35,6 +58,9 @@ class Agent():
         @returns single value for one key
         @returns if more than one 'key' specified, a dict is returned
         """
+        val = snapshot.lookup(self.id, keys)
+        if val is not snapshot.MISSING:
+            return val
         if len(keys) == 1:
             return self._state[keys[0]]
         return [self._state[k] for k in keys]
@@ -53,6 +79,32 @@ class Agent():
         since it supports remote access"""
         return getattr(self, fname)(*args, **kwargs)
 
+    def reseed(self, seed, step):
+        """switch to the agent's random number stream for a step.
+        the stream depends only on the seed, the agent's key,
+        and the step, so it is the same wherever the agent runs"""
+        if self.rng_key is not None:
+            self.rng = Stream(seed, AGENT, self.rng_key, step)
+
+    def send(self, to, msg):
+        """send a message to an agent (or agent id), which it gets in its
+        inbox at the next step of a bulk-synchronous simulation (see `cess.bsp`)"""
+        self._mail(to, MESSAGE, msg)
+
+    def write(self, to, **kwargs):
+        """set state values on an agent (or agent id), applied at the
+        next step of a bulk-synchronous simulation (see `cess.bsp`)"""
+        self._mail(to, WRITE, kwargs)
+
+    def _mail(self, to, kind, payload):
+        order = (-1 if self.rng_key is None else self.rng_key, self.id)
+        entry = (order, self.id, kind, payload)
+        self.__dict__.setdefault('_outbox', []).append((getattr(to, 'id', to), entry))
+
+    def outbox(self):
+        """take the mail the agent has sent, as `(agent id, entry)`"""
+        return self.__dict__.pop('_outbox', [])
+
 
 class AgentProxy():
     """an agent proxy represents an agent that is accessed remotely.
@@ -68,6 +120,10 @@ class AgentProxy():
 
     @asyncio.coroutine
     def get(self, *keys):
+        # served locally if the values are in this step's snapshot
+        val = snapshot.lookup(self.id, keys)
+        if val is not snapshot.MISSING:
+            return val
         return (yield from self.worker.call_agent({
             'id': self.id,
             'func': 'get',
@@ -96,3 +152,6 @@ class AgentProxy():
 
     def __eq__(self, other):
         return self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
@@ -1,8 +1,41 @@
 import random
+import numpy as np
+from ..util import uniforms
+from collections.abc import Mapping, MutableMapping
+
+
+class QTable():
+    """a Q-table backed by an array, with integer-encoded states and actions.
+    each state's row has a column for each of its viable actions (in the
+    order they're listed), padded to the most actions any state has"""
+
+    def __init__(self, states_actions, dtype=np.float64):
+        self.states = list(states_actions.keys())
+        self.state_index = {s: i for i, s in enumerate(self.states)}
+
+        # state index -> viable actions, and (state index, action) -> column
+        self.actions = [list(actions) for actions in states_actions.values()]
+        self.action_index = [{a: j for j, a in enumerate(actions)} for actions in self.actions]
+        self.n_actions = np.array([len(actions) for actions in self.actions])
+
+        # padding columns can't be chosen
+        width = max(self.n_actions) if len(self.actions) else 0
+        self.valid = np.arange(width)[None, :] < self.n_actions[:, None]
+        self.dtype = dtype
+
+    def zeros(self, *shape):
+        """an array of Q-values, initialized to 0, with padding columns
+        set to -inf so they're never the best action"""
+        q = np.zeros(shape + self.valid.shape, dtype=self.dtype)
+        q[..., ~self.valid] = -np.inf
+        return q
+
+    def encode(self, state):
+        return self.state_index[state]
 
 
 class QLearner():
-    def __init__(self, states_actions, rewards, discount=0.5, explore=0.0, learning_rate=0.5):
+    def __init__(self, states_actions, rewards, discount=0.5, explore=0.0, learning_rate=0.5, rng=random, dtype=np.float64):
         """basic Q-learning. given an environment where actions result in uncertain states,
         Q-learning allows the agent to learn a policy (that is, the best action to take given a state).
 
@@ -11,29 +44,42 @@ class QLearner():
         - discount: how much the agent values future rewards over immediate rewards
         - explore: with what probability the agent "explores", i.e. chooses a random action
         - learning_rate: how quickly the agent learns
+        - rng: random number generator to explore with, e.g. an agent's `rng`
+        - dtype: of the Q-values, e.g. `np.float32` to save memory
+
+        Q-values are kept in an array (see `QTable`);
+        `Q` gives access to them as `Q[state][action]`
         """
         self.discount = discount
         self.explore = explore
         self.learning_rate = learning_rate
+        self.rng = rng
         self.R = rewards.get if isinstance(rewards, dict) else rewards
 
         # previous (state, action)
         self.prev = (None, None)
 
         # initialize Q
-        self.Q = {}
-        for state, actions in states_actions.items():
-            self.Q[state] = {a:0 for a in actions}
+        self.table = QTable(states_actions, dtype)
+        self.q = self.table.zeros()
+
+    @property
+    def Q(self):
+        """the Q-values, as state -> action -> value"""
+        return QView(self.table, self.q)
 
     def choose_action(self, state):
         """choose an action to take"""
-        if random.random() < self.explore:
-            action = random.choice(list(self.Q[state].keys()))
+        s = self.table.encode(state)
+        row = self.q[s]
+        best = row.argmax()
+        if self.rng.random() < self.explore:
+            action = self.rng.choice(self.table.actions[s])
         else:
-            action = self._best_action(state)
+            action = self.table.actions[s][best]
 
         # learn from the previous action, if there was one
-        self._learn(state)
+        self._learn(state, row[best])
 
         # remember this state and action
         self.prev = (state, action)
@@ -42,12 +88,233 @@ class QLearner():
 
     def _best_action(self, state):
         """choose the best action given a state"""
-        actions_rewards = list(self.Q[state].items())
-        return max(actions_rewards, key=lambda x: x[1])[0]
+        s = self.table.encode(state)
+        return self.table.actions[s][self.q[s].argmax()]
 
-    def _learn(self, state):
-        """update Q-value for the last taken action"""
+    def _learn(self, state, best=None):
+        """update Q-value for the last taken action.
+        `best` is the best Q-value for the state, if it's known"""
         p_state, p_action = self.prev
         if p_state is None:
             return
-        self.Q[p_state][p_action] = self.learning_rate * (self.R(state) + self.discount * max(self.Q[state].values())) - self.Q[p_state][p_action]
+        ps = self.table.encode(p_state)
+        pa = self.table.action_index[ps][p_action]
+        if best is None:
+            best = self.q[self.table.encode(state)].max()
+        q = self.q[ps, pa]
+        self.q[ps, pa] = q + self.learning_rate * (self.R(state) + self.discount * best - q)
+
+
+class QLearnerPool():
+    def __init__(self, n, states_actions, rewards, discount=0.5, explore=0.0, learning_rate=0.5, rng=random, dtype=np.float64):
+        """`n` Q-learners with the same states and actions (and parameters,
+        see `QLearner`), which choose actions and learn all at once,
+        e.g. for many agents of the same type. each learner's
+        Q-values are `Q[i]`, an array (see `QTable`)"""
+        self.n = n
+        self.discount = discount
+        self.explore = explore
+        self.learning_rate = learning_rate
+        self.rng = rng
+        self.table = QTable(states_actions, dtype)
+        self.Q = self.table.zeros(n)
+
+        # rewards for each state, if they're known upfront
+        self.R = rewards.get if isinstance(rewards, dict) else rewards
+        self._rewards = None
+        if isinstance(rewards, dict):
+            self._rewards = np.array([rewards.get(s, 0) for s in self.table.states], dtype=float)
+
+        # previous states and actions, encoded, or -1 if none
+        self.prev_states = np.full(n, -1)
+        self.prev_actions = np.full(n, -1)
+
+    def encode(self, states):
+        """encode states (one per learner) as an array of indices"""
+        index = self.table.state_index
+        return np.array([index[s] for s in states])
+
+    def choose_actions(self, states, rewards=None):
+        """choose an action for each learner, given its current state,
+        learning from each learner's previous action. `rewards` are the
+        learners' rewards for their current states; if not specified,
+        they're from the pool's rewards"""
+        s = self.encode(states)
+        idx = np.arange(self.n)
+        values = self.Q[idx, s]
+
+        # best actions, except where exploring
+        cols = np.argmax(values, axis=1)
+        if self.explore:
+            rolls = uniforms(self.n, self.rng)
+            exploring = np.flatnonzero(rolls < self.explore)
+            if len(exploring):
+                n_actions = self.table.n_actions[s[exploring]]
+                picks = uniforms(len(exploring), self.rng)
+                cols[exploring] = np.minimum((picks * n_actions).astype(int), n_actions - 1)
+
+        self._learn(s, idx, values, rewards, states)
+
+        self.prev_states = s
+        self.prev_actions = cols
+        actions = self.table.actions
+        return [actions[si][c] for si, c in zip(s.tolist(), cols.tolist())]
+
+    def _learn(self, s, idx, values, rewards, states):
+        """update Q-values for the learners' previous actions"""
+        learning = self.prev_states >= 0
+        if not learning.any():
+            return
+        if rewards is None:
+            if self._rewards is not None:
+                rewards = self._rewards[s]
+            else:
+                rewards = np.array([self.R(state) for state in states], dtype=float)
+        target = np.asarray(rewards, dtype=float) + self.discount * values.max(axis=1)
+
+        ps, pa = self.prev_states[learning], self.prev_actions[learning]
+        i = idx[learning]
+        self.Q[i, ps, pa] += self.learning_rate * (target[learning] - self.Q[i, ps, pa])
+
+    def best_actions(self, states):
+        """the best action for each learner, given its state"""
+        s = self.encode(states)
+        cols = np.argmax(self.Q[np.arange(self.n), s], axis=1)
+        return [self.table.actions[si][c] for si, c in zip(s.tolist(), cols.tolist())]
+
+    def learner_Q(self, i):
+        """a learner's Q-values, as state -> action -> value"""
+        return QView(self.table, self.Q[i])
+
+
+class QView(Mapping):
+    """Q-values in an array, accessed as state -> action -> value"""
+
+    def __init__(self, table, q):
+        self.table = table
+        self.q = q
+
+    def __getitem__(self, state):
+        return QRow(self.table, self.q, self.table.encode(state))
+
+    def __iter__(self):
+        return iter(self.table.states)
+
+    def __len__(self):
+        return len(self.table.states)
+
+
+class QRow(MutableMapping):
+    """a state's Q-values, as action -> value"""
+
+    def __init__(self, table, q, s):
+        self.q = q
+        self.s = s
+        self.actions = table.actions[s]
+        self.index = table.action_index[s]
+
+    def __getitem__(self, action):
+        return self.q[self.s, self.index[action]].item()
+
+    def __setitem__(self, action, val):
+        self.q[self.s, self.index[action]] = val
+
+    def __delitem__(self, action):
+        raise TypeError('actions can\'t be removed')
+
+    def __iter__(self):
+        return iter(self.actions)
+
+    def __len__(self):
+        return len(self.actions)
+
+
+class ReplayQLearner(QLearner):
+    def __init__(self, states_actions, rewards, memory=1000, batch_size=32, **kwargs):
+        """Q-learning with experience replay: transitions are remembered
+        (up to `memory` of them, in a ring buffer, replacing the oldest),
+        and each step the learner learns from a minibatch of `batch_size`
+        transitions sampled from them, rather than only the last one.
+        a transition sampled more than once in a batch is only learned from
+        once, and repeated (state, action)s learn from their mean error.
+        see `QLearner` for the other arguments"""
+        super().__init__(states_actions, rewards, **kwargs)
+        self.memory = memory
+        self.batch_size = batch_size
+
+        # transitions, with encoded states and action columns
+        self.transitions = np.zeros(memory, dtype=[
+            ('state', int), ('action', int), ('reward', float), ('next', int)])
+        self.size = 0
+        self.pos = 0
+
+    def remember(self, ps, pa, reward, s):
+        """add a transition to the replay memory"""
+        self.transitions[self.pos] = (ps, pa, reward, s)
+        self.pos = (self.pos + 1) % self.memory
+        self.size = min(self.size + 1, self.memory)
+
+    def _learn(self, state, best=None):
+        """remember the last transition, then learn from a minibatch"""
+        p_state, p_action = self.prev
+        if p_state is None:
+            return
+        ps = self.table.encode(p_state)
+        self.remember(ps, self.table.action_index[ps][p_action],
+                      self.R(state), self.table.encode(state))
+
+        rolls = uniforms(self.batch_size, self.rng)
+        batch = np.unique((rolls * self.size).astype(int) % self.size)
+        self.replay(batch)
+
+    def replay(self, batch):
+        """learn from the transitions at the specified indices at once"""
+        q = self.q
+        t = self.transitions[batch]
+        ps, pa = t['state'], t['action']
+        errors = t['reward'] + self.discount * q[t['next']].max(axis=1) - q[ps, pa]
+
+        # mean error for each (state, action)
+        cells = ps * q.shape[1] + pa
+        totals = np.bincount(cells, weights=errors, minlength=q.size)
+        counts = np.bincount(cells, minlength=q.size)
+        hit = counts > 0
+        q.flat[np.flatnonzero(hit)] += self.learning_rate * totals[hit]/counts[hit]
+
+
+class QLambdaLearner(QLearner):
+    def __init__(self, states_actions, rewards, trace_decay=0.9, **kwargs):
+        """Watkins' Q(lambda): each update is also applied to previously
+        taken (state, action)s, weighted by their eligibility traces,
+        which decay by `discount * trace_decay` each step, so rewards
+        propagate back along the path which led to them.
+        traces are reset when an exploratory (non-greedy) action is taken.
+        see `QLearner` for the other arguments"""
+        super().__init__(states_actions, rewards, **kwargs)
+        self.trace_decay = trace_decay
+        self.traces = np.zeros_like(self.q)
+
+    def choose_action(self, state):
+        greedy = self._best_action(state)
+        action = super().choose_action(state)
+
+        # the traces only hold while following the greedy policy
+        if action != greedy:
+            self.traces[:] = 0
+        return action
+
+    def _learn(self, state, best=None):
+        """update Q-values for all the traced (state, action)s"""
+        p_state, p_action = self.prev
+        if p_state is None:
+            return
+        ps = self.table.encode(p_state)
+        pa = self.table.action_index[ps][p_action]
+        if best is None:
+            best = self.q[self.table.encode(state)].max()
+        error = self.R(state) + self.discount * best - self.q[ps, pa]
+
+        # replacing traces
+        self.traces[ps, pa] = 1
+        self.q += self.learning_rate * error * self.traces
+        self.traces *= self.discount * self.trace_decay
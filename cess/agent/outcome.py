@@ -1,7 +1,8 @@
+import random
+import numpy as np
 from enum import Enum
-from collections import defaultdict
 from ..util import random_choice
-from .state import update_state
+from .state import State, update_state
 
 
 def update_dist(state, updates, dist):
@@ -15,10 +16,11 @@ def update_dist(state, updates, dist):
  
     # add missing mass if necessary
     # with a "no effect" outcome
+    # (without modifying the caller's lists)
     mass = sum(dist)
     if mass < 1:
-        updates.append({})
-        dist.append(1 - mass)
+        updates = list(updates) + [{}]
+        dist = list(dist) + [1 - mass]
 
     for update, prob in zip(updates, dist):
         yield update, prob
@@ -33,10 +35,10 @@ def outcome_dist(state, updates, dist):
         yield update_state(state, u, expected=True), p
 
 
-def resolve_outcomes(state, updates, dist):
+def resolve_outcomes(state, updates, dist, rng=random):
     """choose a random outcome, apply to the state,
     and return the new state"""
-    update = random_choice((u, p) for u, p in update_dist(state, updates, dist))
+    update = random_choice(((u, p) for u, p in update_dist(state, updates, dist)), rng)
     newState = update_state(state, update, expected=False)
 
     # only when resolving do we apply the special state function
@@ -49,26 +51,162 @@ def resolve_outcomes(state, updates, dist):
 
 def expected_state(state, updates, dist):
     """computes an expected state from a given state
-    over a set of possible outcomes"""
-    expstate = defaultdict(list)
-    for update, prob in update_dist(state, updates, dist):
-        outcome_state = update_state(state, update, expected=True)
-        for k, v in outcome_state.items():
-            try:
-                if isinstance(v, Enum):
-                    expstate[k].append((v, prob))
+    over a set of possible outcomes.
+    to compute many expected states for the same outcomes, use an `OutcomeTable`"""
+    return OutcomeTable(updates, dist).expected_state(state)
+
+
+def _is_number(val):
+    return type(val) in (int, float)
+
+
+class OutcomeTable():
+    """an outcome distribution `(updates, dist)`, compiled for computing
+    expected states. constant updates to numbers (which are added to
+    the state's values) are compiled into a matrix of changes, with a row
+    per outcome (and a "no effect" row for any missing probability mass)
+    and a column per updated key, so the expected values of those keys are
+    a dot product of the probabilities with the outcomes' values.
+    outcomes with update functions, and values which aren't numbers,
+    are still computed outcome by outcome.
+    if `dist` is callable it's evaluated for each state,
+    but the matrix is only compiled once"""
+
+    def __init__(self, updates, dist):
+        self.updates = updates
+        self.dist = dist
+        self._probs = None
+        if updates is None:
+            return
+
+        # the keys the outcomes update (the special '~' key is only for resolving)
+        self.keys = []
+        self.index = {}
+        for update in updates:
+            for k in (update or {}):
+                if k != '~' and k not in self.index:
+                    self.index[k] = len(self.keys)
+                    self.keys.append(k)
+
+        # outcomes which can't be compiled into the matrix
+        self.deltas = np.zeros((len(updates) + 1, len(self.keys)))
+        self.dynamic = []
+        for i, update in enumerate(updates):
+            for k, v in (update or {}).items():
+                if k == '~':
+                    continue
+                if _is_number(v):
+                    self.deltas[i, self.index[k]] = v
                 else:
-                    expstate[k].append(v * prob)
+                    self.dynamic.append(i)
+                    break
 
-            # for non-numerical types
-            except TypeError:
-                expstate[k].append((v, prob))
+        if dist is not None and not callable(dist):
+            self._probs = self._compile_dist(dist)
+
+    def _compile_dist(self, dist):
+        """probabilities of the outcomes, with
+        the missing mass on the "no effect" outcome"""
+        n = len(self.updates)
+        probs = np.zeros(n + 1)
+        dist = list(dist[:n])
+        probs[:len(dist)] = dist
+        mass = sum(dist)
+        if mass < 1:
+            probs[n] = 1 - mass
+        return probs
+
+    def probs(self, state):
+        """probabilities of the outcomes (and the "no effect"
+        outcome) for a state, or `None` if there aren't any"""
+        if self._probs is not None:
+            return self._probs
+        if self.dist is None or self.updates is None:
+            return None
+        dist = self.dist(state)
+        if dist is None:
+            return None
+        return self._compile_dist(dist)
 
-    for k in expstate.keys():
-        try:
-            expstate[k] = sum(expstate[k])
+    def expected_state(self, state):
+        """computes an expected state from `state`. for a dict, this is
+        the same as `expected_state`. for an immutable `State`, only
+        the values the outcomes update are computed, the rest are kept"""
+        probs = self.probs(state) if state is not None else None
+        if probs is None:
+            return state if isinstance(state, State) else {}
 
-        # non-numerical types: most likely value rather than the mean
-        except TypeError:
-            expstate[k] = max(expstate[k], key=lambda x: x[1])[0]
-    return dict(expstate)
+        changes = self._expected_values(state, probs)
+        if isinstance(state, State):
+            return state.update(changes) if changes else state
+
+        # values no outcome updates are weighted by the total probability
+        total = float(probs.sum())
+        expstate = {}
+        for k, v in state.items():
+            if k in changes:
+                expstate[k] = changes[k]
+            elif isinstance(v, Enum):
+                expstate[k] = v
+            else:
+                try:
+                    expstate[k] = v * total
+                except TypeError:
+                    expstate[k] = v
+        return expstate
+
+    def _expected_values(self, state, probs):
+        """expected values of the keys the outcomes update"""
+        cols, keys, others = [], [], []
+        for j, k in enumerate(self.keys):
+            if k in state:
+                if _is_number(state[k]):
+                    cols.append(j)
+                    keys.append(k)
+                else:
+                    others.append(k)
+
+        # only outcomes with some probability count
+        # (for outcomes which aren't compiled, or values which aren't numbers)
+        outcomes = {}
+        def outcome(i):
+            if i not in outcomes:
+                update = self.updates[i] if i < len(self.updates) else None
+                outcomes[i] = update_state(state, update, expected=True)
+            return outcomes[i]
+
+        expvals = {}
+        if cols:
+            values = np.array([state[k] for k in keys], dtype=float)
+            outcome_values = values + self.deltas[:, cols]
+
+            # values are coerced back to their type, i.e. ints are truncated
+            ints = [c for c, k in enumerate(keys) if type(state[k]) is int]
+            if ints:
+                outcome_values[:, ints] = np.trunc(outcome_values[:, ints])
+            for i in self.dynamic:
+                if probs[i]:
+                    o = outcome(i)
+                    outcome_values[i] = [o[k] for k in keys]
+            expvals.update(zip(keys, np.dot(probs, outcome_values).tolist()))
+
+        for k in others:
+            vals = []
+            for i, prob in enumerate(probs):
+                if i == len(self.updates) and not prob:
+                    continue
+                v = outcome(i)[k]
+                try:
+                    if isinstance(v, Enum):
+                        vals.append((v, prob))
+                    else:
+                        vals.append(v * prob)
+                except TypeError:
+                    vals.append((v, prob))
+            try:
+                expvals[k] = sum(vals)
+
+            # non-numerical types: most likely value rather than the mean
+            except TypeError:
+                expvals[k] = max(vals, key=lambda x: x[1])[0]
+        return expvals
@@ -1,7 +1,11 @@
 import math
 from .base import Agent
-from .utility import state_utility, change_utility, goals_utility
+from ..util import LRUCache
+from .state import State, state_hash
+from .prereq import PrereqIndex
+from .utility import state_utility, change_utility, goals_utility, UtilityModel
 from functools import partial
+from collections import deque
 
 
 class Planner():
@@ -9,6 +13,7 @@ class Planner():
     def __init__(self, succ_func, util_func):
         self.succ_func = succ_func
         self.util_func = util_func
+        self.table = {}
 
     def heuristic(self, node, goal):
         """an admissible heuristic never overestimates the distance to the goal"""
@@ -27,46 +32,82 @@ class Planner():
         else:
             return cost * 0.1 * (math.tanh(-util) + 1)
 
-    def _ida(self, agent, path, goal, length, depth, seen):
-        """subroutine for iterative deepening A*. Returns
-        @returns tuple of (min-distance-found,"""
-        _, node = path[-1]
+    def _ida(self, agent, link, goal, length, depth, iteration):
+        """subroutine for iterative deepening A*.
+        `link` is `(parent link, action, node, state hash)`;
+        paths are represented by these parent pointers rather than copied lists.
+        @returns tuple of (min-distance-found, solution link or None)"""
+        _, _, node, nhash = link
 
         f = length + self.heuristic(node, goal)
         if f > depth: return f, None
 
         state, _ = node
         if goal.satisfied(state):
-            return f, path
+            return f, link
 
-        # extended list filtering:
-        # skip nodes we have already seen
-        nhash = hash(frozenset(node.items()))
-        if nhash in seen: return f, None
-        seen.add(nhash)
+        entry = self.table.get(nhash)
+        if entry is not None:
+            g, bound, it = entry
+
+            # extended list filtering:
+            # skip nodes we have already reached as cheaply this iteration
+            if it == iteration and g <= length: return f, None
+
+            # a previous iteration found no solution under this node
+            # within `bound`, which still holds for the current depth
+            if g <= length and bound + (length - g) > depth:
+                return bound + (length - g), None
+
+        if entry is None or length <= entry[0] or entry[2] != iteration:
+            entry = [length, float('inf'), iteration]
+            self.table[nhash] = entry
 
         minimum = float('inf')
-        best_path = None
-        for action, child in self.succ_func(node):
+        exceeded = float('inf')
+        best = None
+        for action, child in self.succ_func((None, node)):
             # g(n) = distance(n)
-            thresh, new_path = self._ida(agent,
-                                         path + [(action, child)],
+            chash = state_hash(child[0], state, nhash)
+            thresh, solution = self._ida(agent,
+                                         (link, action, child, chash),
                                          goal,
                                          length + self.distance(node, child, action),
-                                         depth, seen)
-            if new_path is not None and thresh < minimum:
+                                         depth, iteration)
+            if solution is None:
+                exceeded = min(exceeded, thresh)
+            elif thresh < minimum:
                 minimum = thresh
-                best_path = new_path
-        return minimum, best_path
+                best = solution
+
+        # remember the smallest f-cost beyond the depth under this node
+        if best is None:
+            entry[1] = exceeded
+            return exceeded, None
+        return minimum, best
 
     def ida(self, agent, root, goal):
-        """iterative deepening A*"""
+        """iterative deepening A*.
+        `root` is a `(state, goals)` node"""
+        # state hash -> [best g-cost, bound, iteration],
+        # reused across deepening iterations
+        self.table = {}
+
         solution = None
         depth = self.heuristic(root, goal)
+        iteration = 0
+        link = (None, None, root, state_hash(root[0]))
         while solution is None:
-            _, solution = self._ida(agent, [(None, root)], goal, 0, depth, set())
+            _, solution = self._ida(agent, link, goal, 0, depth, iteration)
             depth += 1
-        return solution
+            iteration += 1
+
+        path = []
+        while solution is not None:
+            parent, action, node, _ = solution
+            path.append((action, node))
+            solution = parent
+        return path[::-1]
 
 
 def hill_climbing(root, succ_func, valid_func, depth):
@@ -77,27 +118,30 @@ def hill_climbing(root, succ_func, valid_func, depth):
     goes through a low-scoring node), but this saves _a lot_ of time"""
     new_goals = set()
     seen = set()
-    fringe = [[root]]
+
+    # the fringe holds `(parent link, node, path length, state hash)` links,
+    # so paths share their prefixes rather than being copied
+    _, (state, _) = root
+    fringe = deque([(None, root, 1, state_hash(state))])
     while fringe:
-        path = fringe.pop(0)
-        node = path[-1]
+        link = fringe.popleft()
+        parent, node, length, nhash = link
         act, (state, goals) = node
 
         # extended list filtering:
         # skip nodes we have already seen
-        nhash = hash(frozenset(state.items()))
         if nhash in seen: continue
         seen.add(nhash)
 
         # check that the next move is valid,
         # given the past node,
         # if not, save as a goal and backtrack
-        if len(path) >= 2 and not valid_func(node, path[-2]):
+        if parent is not None and not valid_func(node, parent[1]):
             new_goals.add(act)
             continue
 
         # if we terminate at a certain depth, break when we reach it
-        if depth is not None and len(path) > depth:
+        if depth is not None and length > depth:
             break
 
         succs = succ_func(node)
@@ -106,11 +150,28 @@ def hill_climbing(root, succ_func, valid_func, depth):
             break
 
         # assumed that these are best-ordered successors
-        fringe = [path + [succ] for succ in succs] + fringe
+        fringe.extendleft(reversed([
+            (link, succ, length + 1, state_hash(succ[1][0], state, nhash))
+            for succ in succs]))
+
+    path = []
+    while link is not None:
+        path.append(link[1])
+        link = link[0]
 
     # remove the root
-    path.pop(0)
-    return path, new_goals
+    path.pop()
+    return path[::-1], new_goals
+
+
+def _as_state(state):
+    return state if isinstance(state, State) else State(state)
+
+
+def _to_dicts(path):
+    """convert the `State`s in a planned path to dicts"""
+    return [(act, (state.to_dict() if isinstance(state, State) else state, goals))
+            for act, (state, goals) in path]
 
 
 class PlanningAgent(Agent):
@@ -119,14 +180,73 @@ class PlanningAgent(Agent):
     @param state: starting state of the agent.
     @param actions: list of Action objects
     @param goal: list of Goal objects
-    @param dict of  utility functions"""
-    def __init__(self, state, actions, goals, utility_funcs):
+    @param dict of  utility functions
+    @param cache_size: max entries in each of the planning caches"""
+    def __init__(self, state, actions, goals, utility_funcs, cache_size=1024):
         super().__init__(state)
+
+        # expected states and goal utilities are cached while planning,
+        # keyed on `(action, state)` and `(state, goals)`, with states as
+        # `State`s, which hash with their (incrementally updated) `state_hash`.
+        # the caches are cleared every `plan` call (i.e. every step, since
+        # outcome distributions and goal times can change between steps),
+        # and whenever actions, goals, or utility funcs are changed.
+        # which actions each state satisfies is cached too (see `_satisfied_actions`)
+        self._state_cache = LRUCache(cache_size)
+        self._utility_cache = LRUCache(cache_size)
+        self._prereq_cache = LRUCache(cache_size)
+
         self.goals = set(goals)
         self.actions = actions
         self.ufuncs = utility_funcs
-        self.utility = partial(state_utility, self.ufuncs)
-        self.planner = Planner(self._succ_func, self.utility)
+        self.planner = Planner(self._succ_func, self._change_utility)
+
+    @property
+    def actions(self):
+        return self._actions
+
+    @actions.setter
+    def actions(self, actions):
+        self._actions = actions
+        self._prereqs = PrereqIndex(actions)
+        self.clear_cache()
+
+    @property
+    def goals(self):
+        return self._goals
+
+    @goals.setter
+    def goals(self, goals):
+        self._goals = goals
+        self.clear_cache()
+
+    @property
+    def ufuncs(self):
+        return self._ufuncs
+
+    @ufuncs.setter
+    def ufuncs(self, ufuncs):
+        self._ufuncs = ufuncs
+        self.utility = partial(state_utility, ufuncs)
+        self.utility_model = UtilityModel(ufuncs)
+        self.clear_cache()
+
+    def _change_utility(self, from_state, to_state):
+        return change_utility(self.ufuncs, from_state, to_state)
+
+    def clear_cache(self):
+        """clear the planning caches"""
+        self._state_cache.clear()
+        self._utility_cache.clear()
+        self._prereq_cache.clear()
+
+    def cache_stats(self):
+        """hit/miss stats for the planning caches"""
+        return {
+            'expected_state': self._state_cache.stats(),
+            'goals_utility': self._utility_cache.stats(),
+            'prereqs': self._prereq_cache.stats()
+        }
 
     def actions_for_state(self, state):
         """the agent's possible actions
@@ -141,32 +261,97 @@ class PlanningAgent(Agent):
         # compute expected states
         succs = []
         for action in self.actions_for_state(state):
-            expstate = self._expected_state(action, state)
+            expstate = self._cached_expected_state(action, state)
             succs.append((action, (expstate, goals)))
 
         for goal in goals:
             if goal.satisfied(state):
-                expstate = self._expected_state(goal, state)
+                expstate = self._cached_expected_state(goal, state)
                 remaining_goals = goals.copy()
                 remaining_goals.remove(goal)
                 succs.append((goal, (expstate, remaining_goals)))
 
+        # the successors' actions are checked against this state, and then
+        # against their own, which only needs rechecking for what changed
+        self._satisfied_actions(state)
+        for _, (expstate, _) in succs:
+            self._satisfied_actions(expstate, state)
+
         # sort by expected utility, desc
-        succs = sorted(succs,
-                       key=lambda s: self._score_successor(state, s[1][0]),
-                       reverse=True)
+        scores = self._score_successors(state, [s[1][0] for s in succs])
+        succs = [s for _, s in sorted(zip(scores, succs),
+                                      key=lambda s: s[0],
+                                      reverse=True)]
         return succs
 
     def _score_successor(self, from_state, to_state):
         """score a successor based how it changes from the previous state"""
-        chutil = change_utility(self.ufuncs, from_state, to_state)
-        goutil = goals_utility(self.ufuncs, to_state, self.goals)
-        return chutil + goutil
+        return float(self._score_successors(from_state, [to_state])[0])
+
+    def _score_successors(self, from_state, to_states):
+        """score a list of successors at once"""
+        chutils = self.utility_model.change_utilities(from_state, to_states)
+        goutils = [self._goals_utility(to_state) for to_state in to_states]
+        return chutils + goutils
+
+    def _goals_utility(self, state):
+        """goals utility for a state, cached"""
+        key = (_as_state(state), frozenset(self.goals))
+        try:
+            util = self._utility_cache.get(key)
+
+        # states with unhashable values aren't cached
+        except TypeError:
+            return goals_utility(self.ufuncs, state, self.goals)
+        if util is None:
+            util = goals_utility(self.ufuncs, state, self.goals)
+            self._utility_cache.set(key, util)
+        return util
+
+    def _satisfied_actions(self, state, parent=None):
+        """which of the agent's actions a state satisfies (as a list,
+        see `PrereqIndex.check`), cached. if the state shares a base with
+        a `parent` state whose actions are cached, only the actions
+        depending on the keys which differ from it are rechecked"""
+        state = _as_state(state)
+        try:
+            satisfied = self._prereq_cache.get(state)
+            if satisfied is None and parent is not None:
+                parent = _as_state(parent)
+                keys = state.changed_from(parent)
+                if keys is not None:
+                    prev = self._prereq_cache.get(parent)
+                    if prev is not None:
+                        satisfied = self._prereqs.recheck(state, keys, prev)
+                        self._prereq_cache.set(state, satisfied)
+
+        # states with unhashable values aren't cached
+        except TypeError:
+            return self._prereqs.check(state)
+        if satisfied is None:
+            satisfied = self._prereqs.check(state)
+            self._prereq_cache.set(state, satisfied)
+        return satisfied
+
+    def _cached_expected_state(self, action, state):
+        """expected state for an action/goal, cached"""
+        key = (action, _as_state(state))
+        try:
+            expstate = self._state_cache.get(key)
+        except TypeError:
+            return self._expected_state(action, state)
+        if expstate is None:
+            expstate = self._expected_state(action, state)
+            self._state_cache.set(key, expstate)
+        # copy so that callers can't modify cached states
+        # (a `State` can't be modified, so this doesn't copy it)
+        return expstate.copy()
 
     def subplan(self, state, goal):
         """create a subplan to achieve a goal;
         i.e. the prerequisites for an action"""
-        return self.planner.ida(self, state, goal.as_action())
+        path = self.planner.ida(self, (State(state), self.goals), goal)
+        return _to_dicts(path)
 
     def _succ_func(self, node):
         """for planning; returns successors"""
@@ -177,14 +362,25 @@ class PlanningAgent(Agent):
         """for planning; checks if an action is possible"""
         act, (_, _) = node
         _, (state, _) = pnode
-        return act.satisfied(state)
+
+        # goals, and actions from `actions_for_state` which
+        # aren't the agent's, are checked on their own
+        i = self._prereqs.positions.get(act)
+        if i is None:
+            return act.satisfied(state)
+        return self._satisfied_actions(state)[i]
 
     def plan(self, state, goals, depth=None):
         """generate a plan; uses hill climbing search to minimize searching time.
-        will generate new goals for actions which are impossible given the current state but desired"""
-        plan, goals = hill_climbing((None, (state, self.goals)), self._succ_func, self._valid_func, depth)
+        will generate new goals for actions which are impossible given the current state but desired.
+        states are searched as immutable `State`s, so expected states only copy the values actions change"""
+        self.clear_cache()
+
+        # actions' prereqs may have been replaced since the last plan
+        self._prereqs = PrereqIndex(self.actions)
+        plan, goals = hill_climbing((None, (State(state), self.goals)), self._succ_func, self._valid_func, depth)
         self.goals = self.goals | goals
-        return plan, self.goals
+        return _to_dicts(plan), self.goals
 
     def _expected_state(self, action, state):
         """computes expected state for an action/goal,
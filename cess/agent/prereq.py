@@ -1,4 +1,20 @@
+"""
+prerequisites, for actions and goals.
+
+prerequisites on numbers made from `operator` comparisons (`lt`, `le`,
+`gt`, `ge`, `eq`), and ands and ors of them, are sets of intervals.
+they're compiled into flat programs of interval checks (see
+`compile_prereqs`), rather than evaluated through nested calls, which
+can be checked against many states at once (`satisfied_batch`).
+a `PrereqIndex` checks many actions' prerequisites against a state,
+and only rechecks those which depend on the keys an update changed
+(`PlanningAgent` uses one to check its actions while planning).
+other prerequisites are checked by calling them, as usual.
+"""
+
 import math
+import operator
+import numpy as np
 
 
 class Prereq():
@@ -21,6 +37,25 @@ class Prereq():
             return False
         return self.comparator(val, self.target)
 
+    def intervals(self):
+        """the values which satisfy this prereq, as a list of
+        `(low, low closed, high, high closed)` intervals
+        (`None` for unbounded), or `None` if it can't be represented so"""
+        if type(self.target) not in (int, float) or self.target != self.target:
+            return None
+        t = self.target
+        if self.comparator is operator.lt:
+            return [(None, False, t, False)]
+        elif self.comparator is operator.le:
+            return [(None, False, t, True)]
+        elif self.comparator is operator.gt:
+            return [(t, False, None, False)]
+        elif self.comparator is operator.ge:
+            return [(t, True, None, False)]
+        elif self.comparator is operator.eq:
+            return [(t, True, t, True)]
+        return None
+
 
     def __and__(self, other_prereq):
         """returns a new prereq AND'd with this prereq"""
@@ -50,6 +85,12 @@ class OrPrereq(Prereq):
     def __call__(self, val):
         return self.p1(val) or self.p2(val)
 
+    def intervals(self):
+        i1, i2 = _intervals(self.p1), _intervals(self.p2)
+        if i1 is None or i2 is None:
+            return None
+        return i1 + i2
+
     def distance(self, val):
         """for OR relationship, minimum of distances is the distance"""
         return min(self.p1.distance(val), self.p2.distance(val))
@@ -64,6 +105,18 @@ class AndPrereq(Prereq):
     def __call__(self, val):
         return self.p1(val) and self.p2(val)
 
+    def intervals(self):
+        i1, i2 = _intervals(self.p1), _intervals(self.p2)
+        if i1 is None or i2 is None:
+            return None
+        intervals = []
+        for a in i1:
+            for b in i2:
+                i = _intersect(a, b)
+                if i is not None:
+                    intervals.append(i)
+        return intervals
+
     def distance(self, val):
         """for AND relationship, the sum of the distances is the distance"""
         return self.p1.distance(val) + self.p2.distance(val)
@@ -76,3 +129,147 @@ def distance_to_prereqs(state, prereqs):
         pre, val = prereqs[k], state[k]
         dist_sum += pre.distance(val)
     return math.sqrt(dist_sum)
+
+
+def _intervals(prereq):
+    """a prereq's intervals, or `None` if it isn't made of
+    intervals (including if it's a plain callable)"""
+    intervals = getattr(prereq, 'intervals', None)
+    if not callable(intervals):
+        return None
+    return intervals()
+
+
+def _intersect(a, b):
+    """the intersection of two intervals, or `None` if it's empty"""
+    lo, lo_closed, hi, hi_closed = a
+    blo, blo_closed, bhi, bhi_closed = b
+    if lo is None or (blo is not None and blo > lo):
+        lo, lo_closed = blo, blo_closed
+    elif blo == lo:
+        lo_closed = lo_closed and blo_closed
+    if hi is None or (bhi is not None and bhi < hi):
+        hi, hi_closed = bhi, bhi_closed
+    elif bhi == hi:
+        hi_closed = hi_closed and bhi_closed
+    if lo is not None and hi is not None:
+        if lo > hi or (lo == hi and not (lo_closed and hi_closed)):
+            return None
+    return lo, lo_closed, hi, hi_closed
+
+
+def _interval_test(lo, lo_closed, hi, hi_closed):
+    """a test for a value being in an interval"""
+    if lo is not None and lo == hi:
+        return lambda v: v is not None and v == lo
+    lower = operator.ge if lo_closed else operator.gt
+    upper = operator.le if hi_closed else operator.lt
+    if lo is None and hi is None:
+        return lambda v: v is not None
+    elif lo is None:
+        return lambda v: v is not None and upper(v, hi)
+    elif hi is None:
+        return lambda v: v is not None and lower(v, lo)
+    return lambda v: v is not None and lower(v, lo) and upper(v, hi)
+
+
+def compile_prereq(prereq):
+    """compile a prereq into a test for a value.
+    returns `(test, intervals)`, where intervals is `None`
+    if the prereq isn't made of intervals (the test is then the prereq)"""
+    intervals = _intervals(prereq)
+    if intervals is None:
+        return prereq, None
+    if not intervals:
+        return (lambda v: False), intervals
+    if len(intervals) == 1:
+        return _interval_test(*intervals[0]), intervals
+    tests = [_interval_test(*i) for i in intervals]
+    def test(v):
+        for t in tests:
+            if t(v):
+                return True
+        return False
+    return test, intervals
+
+
+def compile_prereqs(prereqs):
+    """compile a dict of prereqs (state key -> prereq) into a
+    program, a tuple of `(key, test, intervals)` (see `compile_prereq`)"""
+    return tuple((k,) + compile_prereq(p) for k, p in prereqs.items())
+
+
+def check(program, state):
+    """whether a state satisfies a compiled program
+    (stopping at the first unsatisfied prereq)"""
+    for key, test, _ in program:
+        if key not in state or not test(state[key]):
+            return False
+    return True
+
+
+def satisfied_batch(program, states):
+    """whether each of a batch of states satisfies a compiled
+    program, as a boolean array. prereqs made of intervals are
+    checked for all the states at once, where their values are numbers"""
+    ok = np.ones(len(states), dtype=bool)
+    for key, test, intervals in program:
+        idx = np.flatnonzero(ok)
+        if not len(idx):
+            break
+        vals = [states[i].get(key) for i in idx]
+        try:
+            if intervals is None:
+                raise TypeError
+            arr = np.array([np.nan if v is None else v for v in vals], dtype=float)
+        except (TypeError, ValueError):
+            ok[idx] = [test(v) for v in vals]
+            continue
+        sat = np.zeros(len(idx), dtype=bool)
+        for lo, lo_closed, hi, hi_closed in intervals:
+            inside = ~np.isnan(arr)
+            if lo is not None:
+                inside &= (arr >= lo) if lo_closed else (arr > lo)
+            if hi is not None:
+                inside &= (arr <= hi) if hi_closed else (arr < hi)
+            sat |= inside
+        ok[idx] = sat
+    return ok
+
+
+class PrereqIndex():
+    """the prerequisites of many actions (or goals), compiled to check
+    them all against a state, with an index of the state keys each
+    action depends on, so after an update, only the actions whose
+    prereqs depend on the changed keys are rechecked"""
+
+    def __init__(self, actions):
+        self.actions = list(actions)
+        self.programs = [a.program() for a in self.actions]
+
+        # action -> its position
+        self.positions = {a: i for i, a in enumerate(self.actions)}
+
+        # state key -> indices of the actions which depend on it
+        self.index = {}
+        for i, program in enumerate(self.programs):
+            for key, _, _ in program:
+                self.index.setdefault(key, []).append(i)
+
+    def check(self, state):
+        """whether each action is satisfied by the state, as a list"""
+        if state is None:
+            return [not p for p in self.programs]
+        return [check(p, state) for p in self.programs]
+
+    def recheck(self, state, keys, satisfied):
+        """update which actions are satisfied (`satisfied`, as returned by
+        `check` for a previous state), for a state where only `keys` changed"""
+        satisfied = list(satisfied)
+        for i in set(i for k in keys for i in self.index.get(k, ())):
+            satisfied[i] = check(self.programs[i], state)
+        return satisfied
+
+    def satisfied(self, state):
+        """the actions the state satisfies"""
+        return [a for a, ok in zip(self.actions, self.check(state)) if ok]
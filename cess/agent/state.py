@@ -1,15 +1,141 @@
 """ 
 Contains tools for doing state updates
 state variable is expected to be a dict
-of key:value pairs that our are various state date.
+of key:value pairs that our are various state date,
+or an immutable `State`, which is updated without copying.
 """
+from collections.abc import Mapping
+
+
+class State(Mapping):
+    """an immutable agent state, for generating many states cheaply
+    (e.g. while planning). it's a dict of changes overlaid on a base dict,
+    which is shared by states derived from it and never modified, so an
+    update only copies the changes (the base is only copied again once
+    the changes outgrow it). its hash is the same as `state_hash`'s,
+    and is updated incrementally from the state it was derived from.
+    use `to_dict` to get an (independent) dict"""
+    __slots__ = ('_base', '_changes', '_hash')
+
+    def __init__(self, state=None):
+        if isinstance(state, State):
+            self._base, self._changes, self._hash = state._base, state._changes, state._hash
+        else:
+            self._base = dict(state or {})
+            self._changes = {}
+            self._hash = None
+
+    def __getitem__(self, key):
+        changes = self._changes
+        if key in changes:
+            return changes[key]
+        return self._base[key]
+
+    def __contains__(self, key):
+        return key in self._base or key in self._changes
+
+    def __iter__(self):
+        yield from self._base
+        for key in self._changes:
+            if key not in self._base:
+                yield key
+
+    def __len__(self):
+        return len(self._base) + sum(1 for k in self._changes if k not in self._base)
+
+    def __hash__(self):
+        return state_hash(self)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        if isinstance(other, State) and self._hash is not None \
+                and other._hash is not None and self._hash != other._hash:
+            return False
+        if len(self) != len(other):
+            return False
+        for k, v in self.items():
+            if k not in other or other[k] != v:
+                return False
+        return True
+
+    def __repr__(self):
+        return 'State({})'.format(self.to_dict())
+
+    def copy(self):
+        # immutable, so there's no need to copy
+        return self
+
+    def to_dict(self):
+        """the state as a dict"""
+        state = dict(self._base)
+        state.update(self._changes)
+        return state
+
+    def changed_from(self, other):
+        """the keys whose values differ from another state's, if the states
+        share a base (e.g. one was derived from the other), or `None`
+        if that can't be told without comparing every value"""
+        if not isinstance(other, State) or other._base is not self._base:
+            return None
+        changes, other_changes = self._changes, other._changes
+        keys = [k for k, v in changes.items()
+                if k not in other_changes or not (other_changes[k] is v or other_changes[k] == v)]
+        keys.extend(k for k in other_changes if k not in changes)
+        return keys
+
+    def set(self, key, val):
+        """a new state, with `key` set to `val`"""
+        return self.update({key: val})
+
+    def update(self, changes):
+        """a new state, with the specified changes"""
+        child = self._child()
+        child._changes.update(changes)
+        return child._finish(self, changes)
+
+    def _child(self):
+        """a state derived from this one, to make changes to
+        (in its `_changes`) before it's finished"""
+        child = State.__new__(State)
+        child._base = self._base
+        child._changes = dict(self._changes)
+        child._hash = None
+        return child
+
+    def _finish(self, parent, keys):
+        """finish a state derived from `parent`
+        by changing the specified keys"""
+        if parent._hash is not None:
+            h = parent._hash
+            try:
+                for k in keys:
+                    if k in parent:
+                        h ^= hash((k, parent[k]))
+                    h ^= hash((k, self[k]))
+                self._hash = h
+            except TypeError:
+                pass
+
+        # start from a new base if the changes outgrow this one
+        if len(self._changes) > 8 and 2*len(self._changes) > len(self._base):
+            self._base = self.to_dict()
+            self._changes = {}
+        return self
+
 
 def update_state(state, update, expected=False):
     """Generates a new state based on the specified update dict;
     @updates: Dict of update function. value can be: constant (to add), or
      a function taking a 'state' dictionary 
-    @returns copy of state with updated values.
+    @returns copy of state with updated values,
+    or for a `State`, a new `State` with only the updated values changed.
     note: this does not attenuate (clamp) the state"""
+    if isinstance(state, State):
+        return _update(state, update, expected)
+
     if state is not None:
         state = state.copy()
     
@@ -41,12 +167,52 @@ def update_state(state, update, expected=False):
     return state
 
 
+def _update(state, update, expected):
+    """`update_state` for a `State`"""
+    if update is None:
+        return state
+
+    # like `update_state`, update functions see the values updated before them
+    new = state._child()
+    changes = new._changes
+    keys = []
+    for k, v in update.items():
+        if k not in state:
+            continue
+        val = new[k]
+        typ = type(val)
+        try:
+            val = v(new)
+            if isinstance(val, tuple):
+                val, exp = val
+            else:
+                exp = val
+            if expected:
+                val = exp
+        except TypeError:
+            val += v
+        changes[k] = typ(val)
+        keys.append(k)
+    return new._finish(state, keys)
+
+
 def attenuate_state(state, ranges):
     """attenuates a state so that its values are within the specified ranges
     edits value of passed states, and returns passed (updated) state
+    (or, for an immutable `State`, returns an attenuated `State`)
     @ranges dict of ranges 'key:range-obj'
     @state dict of states 'key:value'
     """
+    if isinstance(state, State):
+        changes = {}
+        for k, r in ranges.items():
+            if k in state:
+                v = state[k]
+                val = attenuate_value(v, r)
+                if val != v:
+                    changes[k] = val
+        return state.update(changes) if changes else state
+
     for k, v in state.items():
         if k in ranges:
             state[k] = attenuate_value(v, ranges[k])
@@ -59,3 +225,35 @@ def attenuate_value(value, range):
     if mn is not None: value = max(mn, value)
     if mx is not None: value = min(mx, value)
     return value
+
+
+def state_hash(state, parent=None, parent_hash=None):
+    """hashes a state (independent of key order).
+    if the state is derived from a `parent` state with a known hash,
+    the hash is updated incrementally from the parent's rather than
+    hashing every item (and without building a frozenset).
+    a `State`'s hash is cached, and is usually already known"""
+    if isinstance(state, State):
+        if state._hash is None:
+            state._hash = state_hash(state.to_dict(), parent, parent_hash)
+        return state._hash
+
+    if parent is None or parent_hash is None:
+        h = 0
+        for item in state.items():
+            h ^= hash(item)
+        return h
+
+    h = parent_hash
+    for k, v in state.items():
+        if k in parent:
+            pv = parent[k]
+            if pv is v or pv == v:
+                continue
+            h ^= hash((k, pv))
+        h ^= hash((k, v))
+    if len(parent) != len(state):
+        for k, pv in parent.items():
+            if k not in state:
+                h ^= hash((k, pv))
+    return h
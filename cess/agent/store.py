@@ -0,0 +1,236 @@
+"""
+columnar storage for agent state.
+
+an `AgentStore` keeps the state of many agents (usually of one type)
+in numpy columns, one per state key, with a row per agent.
+agents backed by a store see their state through a `StateRow`,
+which behaves like the state dict, so agent code doesn't change,
+but whole-population reads, writes, and reductions are vectorized.
+"""
+
+import numpy as np
+from collections.abc import MutableMapping
+
+
+def _dtype_for(value):
+    """the column dtype to use for a value"""
+    if isinstance(value, (bool, np.bool_)):
+        return np.dtype(bool)
+    elif isinstance(value, (int, np.integer)):
+        return np.dtype(np.int64)
+    elif isinstance(value, (float, np.floating)):
+        return np.dtype(np.float64)
+    return np.dtype(object)
+
+
+def _fits(dtype, value):
+    """whether or not a value can be stored
+    in a column without changing its type"""
+    if dtype.kind == 'O':
+        return True
+    return np.promote_types(dtype, _dtype_for(value)) == dtype
+
+
+class StateRow(MutableMapping):
+    """a view of one agent's state in an `AgentStore`.
+    once the agent is removed from the store, the view is detached
+    (its `row` is `None`) and can't be used anymore"""
+
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def _row(self):
+        if self.row is None:
+            raise ValueError('state was removed from its store')
+        return self.row
+
+    def __getitem__(self, key):
+        return self.store._get(self._row(), key)
+
+    def __setitem__(self, key, val):
+        self.store._set(self._row(), key, val)
+
+    def __delitem__(self, key):
+        self.store._del(self._row(), key)
+
+    def __iter__(self):
+        row = self._row()
+        for key, present in self.store.present.items():
+            if present[row]:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'StateRow({})'.format(dict(self))
+
+    def copy(self):
+        """a detached copy of the state, as a dict"""
+        return dict(self)
+
+    def __reduce__(self):
+        # serializing an agent (e.g. to send it to a worker)
+        # detaches its state from the store
+        return (dict, (dict(self),))
+
+
+class AgentStore():
+    """state storage for a population of agents, as numpy columns"""
+
+    def __init__(self, schema=None, capacity=64):
+        """`schema` optionally maps state keys to dtypes;
+        otherwise dtypes are inferred from the first value set for a key"""
+        self.schema = {k: np.dtype(v) for k, v in (schema or {}).items()}
+        self.capacity = capacity
+        self.size = 0
+
+        # key -> column of values, key -> mask of rows which have the key
+        self.columns = {}
+        self.present = {}
+
+        # agent id -> row, row -> agent id
+        self.rows = {}
+        self.ids = []
+        self.views = {}
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, id):
+        return id in self.rows
+
+    def add(self, id, state=None):
+        """add an agent's state to the store,
+        returning a row view of it"""
+        if self.size == self.capacity:
+            self._grow(self.capacity * 2)
+        row = self.size
+        self.size += 1
+        self.rows[id] = row
+        self.ids.append(id)
+        view = StateRow(self, row)
+        self.views[id] = view
+        for key, val in (state or {}).items():
+            self._set(row, key, val)
+        return view
+
+    def adopt(self, agent):
+        """move an existing (dict-backed) agent's state into the store.
+        if the agent already has a row (e.g. it's a copy of an agent in
+        the store, returned from another process), the row is overwritten"""
+        if agent.id not in self.rows:
+            agent._state = self.add(agent.id, agent._state)
+            return agent
+
+        state = dict(agent._state)
+        view = self.views[agent.id]
+        for key in list(view):
+            if key not in state:
+                del view[key]
+        for key, val in state.items():
+            view[key] = val
+        agent._state = view
+        return agent
+
+    def remove(self, id):
+        """remove an agent from the store, returning its state as a dict
+        (to replace the agent's `_state` with). its row view is detached"""
+        row = self.rows.pop(id)
+        view = self.views.pop(id)
+        state = dict(view)
+        view.row = None
+
+        # move the last row into the vacated one, to keep columns dense
+        last = self.size - 1
+        if row != last:
+            moved = self.ids[last]
+            for key in self.columns:
+                self.columns[key][row] = self.columns[key][last]
+                self.present[key][row] = self.present[key][last]
+            self.ids[row] = moved
+            self.rows[moved] = row
+            self.views[moved].row = row
+        for key in self.columns:
+            self.present[key][last] = False
+        self.ids.pop()
+        self.size -= 1
+        return state
+
+    def _grow(self, capacity):
+        for key, col in self.columns.items():
+            new = np.zeros(capacity, dtype=col.dtype)
+            new[:self.size] = col[:self.size]
+            self.columns[key] = new
+            present = np.zeros(capacity, dtype=bool)
+            present[:self.size] = self.present[key][:self.size]
+            self.present[key] = present
+        self.capacity = capacity
+
+    def _add_column(self, key, dtype):
+        self.columns[key] = np.zeros(self.capacity, dtype=dtype)
+        self.present[key] = np.zeros(self.capacity, dtype=bool)
+
+    def _upcast(self, key, value):
+        """change a column's type so it can hold the value"""
+        col = self.columns[key]
+        self.columns[key] = col.astype(np.promote_types(col.dtype, _dtype_for(value)))
+
+    def _get(self, row, key):
+        present = self.present.get(key)
+        if present is None or not present[row]:
+            raise KeyError(key)
+        val = self.columns[key][row]
+        # return native python values, as a dict would
+        return val.item() if isinstance(val, np.generic) else val
+
+    def _set(self, row, key, val):
+        if key not in self.columns:
+            self._add_column(key, self.schema.get(key, _dtype_for(val)))
+        elif not _fits(self.columns[key].dtype, val):
+            self._upcast(key, val)
+        self.columns[key][row] = val
+        self.present[key][row] = True
+
+    def _del(self, row, key):
+        if key not in self.present or not self.present[key][row]:
+            raise KeyError(key)
+        self.present[key][row] = False
+
+    def column(self, key):
+        """the values for a key for all agents in the store,
+        in row order (see `ids`). this is a view, not a copy"""
+        return self.columns[key][:self.size]
+
+    def read(self, key, ids=None):
+        """read a key for all (or the specified) agents"""
+        if ids is None:
+            return self.column(key).copy()
+        return self.columns[key][[self.rows[id] for id in ids]]
+
+    def write(self, key, values, ids=None):
+        """write a key for all (or the specified) agents;
+        `values` may be a scalar or one value per agent"""
+        values = np.asarray(values)
+        if values.dtype.kind not in 'biufO':
+            values = values.astype(object)
+        if key not in self.columns:
+            self._add_column(key, self.schema.get(key, values.dtype))
+        elif np.promote_types(self.columns[key].dtype, values.dtype) != self.columns[key].dtype:
+            self.columns[key] = self.columns[key].astype(
+                np.promote_types(self.columns[key].dtype, values.dtype))
+        if ids is None:
+            self.columns[key][:self.size] = values
+            self.present[key][:self.size] = True
+        else:
+            rows = [self.rows[id] for id in ids]
+            self.columns[key][rows] = values
+            self.present[key][rows] = True
+
+    def reduce(self, key, func=np.mean):
+        """reduce a key over all agents which have it, e.g. a mean"""
+        col = self.column(key)
+        return func(col[self.present[key][:self.size]])
@@ -1,3 +1,4 @@
+import numpy as np
 from .prereq import distance_to_prereqs
 
 
@@ -64,3 +65,80 @@ def goal_utility(ufuncs, state, goal):
 def goals_utility(ufuncs, state, goals):
     """computes sum of utilities for a set of goals"""
     return sum(goal_utility(ufuncs, state, g) for g in goals)
+
+
+# values used to check if a utility function is vectorizable
+_probe = np.array([1., 2., 3.])
+
+
+def _vectorizable(func):
+    """whether or not a utility function can be applied
+    directly to a numpy array, giving the same results
+    as applying it to each value"""
+    try:
+        out = np.asarray(func(_probe), dtype=float)
+        if out.shape != _probe.shape:
+            return False
+        expected = [func(float(v)) for v in _probe]
+        return np.allclose(out, expected)
+    except Exception:
+        return False
+
+
+class UtilityModel():
+    """utility functions compiled for scoring many states at once.
+    utility functions which work on numpy arrays are applied to
+    a whole column of values; others are applied value by value"""
+
+    def __init__(self, ufuncs):
+        self.ufuncs = ufuncs
+        self.vectorized = {attr: _vectorizable(f) for attr, f in ufuncs.items()}
+
+    def _apply(self, attr, values):
+        """apply an attribute's utility function to a list of values"""
+        func = self.ufuncs[attr]
+        if self.vectorized[attr]:
+            try:
+                arr = np.asarray(values, dtype=float)
+            except (TypeError, ValueError):
+                arr = None
+            if arr is not None:
+                return np.asarray(func(arr), dtype=float)
+        return np.array([func(v) for v in values], dtype=float)
+
+    def _columns(self, states):
+        """for each attribute with a utility function,
+        the indices of the states which have it and their values"""
+        for attr in self.ufuncs:
+            idx, values = [], []
+            for i, state in enumerate(states):
+                if attr in state:
+                    idx.append(i)
+                    values.append(state[attr])
+            if idx:
+                yield attr, idx, values
+
+    def state_utilities(self, states):
+        """computes utilities for a list of states"""
+        utils = np.zeros(len(states))
+        for attr, idx, values in self._columns(states):
+            utils[idx] += self._apply(attr, values)
+        return utils
+
+    def change_utilities(self, curr_state, states):
+        """computes utilities for changes from a state
+        to each of a list of states"""
+        utils = np.zeros(len(states))
+        for attr, idx, values in self._columns(states):
+            current = self._apply(attr, [curr_state[attr]])[0]
+            utils[idx] += self._apply(attr, values) - current
+        return utils
+
+    def expected_utility(self, state, outcomes):
+        """computes expected utility of going from
+        a given state to a set of possible outcomes"""
+        outcomes = list(outcomes)
+        if not outcomes:
+            return 0
+        states, probs = zip(*outcomes)
+        return float(np.dot(probs, self.change_utilities(state, states)))
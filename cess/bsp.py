@@ -0,0 +1,70 @@
+"""
+bulk-synchronous parallel (BSP) execution.
+
+each step of a BSP simulation is a superstep: every agent's `step(inbox)`
+runs wherever the agent is, with the messages sent to it in the previous
+superstep, and can send messages (`agent.send`) or state writes
+(`agent.write`) to other agents. once all agents have stepped (the
+barrier), the mail they sent is exchanged all at once, and delivered at
+the start of the next superstep: state writes are applied, then agents
+get their messages in their inboxes.
+
+when distributed, mail between agents on the same worker never leaves
+the worker, and the rest is exchanged through the arbiter in one batch
+per worker, so a superstep takes O(workers) messages rather than a round
+trip per interaction (see `Arbiter.superstep`).
+
+mail is kept as `(order, sender id, kind, payload)` entries. inboxes are
+ordered by sender (then by the order the sender sent them), so they're
+the same however the agents are distributed.
+"""
+
+import asyncio
+import inspect
+from collections import defaultdict
+
+# kinds of mail
+MESSAGE, WRITE = 0, 1
+
+
+def deliver(agents, mail):
+    """deliver mail (agent id -> entries) to agents (agent id -> agent),
+    applying state writes. returns agent id -> inbox,
+    where an inbox is a list of `(sender id, message)`"""
+    inboxes = {}
+    for id, entries in mail.items():
+        agent = agents.get(id)
+        if agent is None:
+            continue
+        entries.sort(key=lambda e: e[0])
+        inbox = []
+        for _, sender, kind, payload in entries:
+            if kind == WRITE:
+                for key, val in payload.items():
+                    agent[key] = val
+            else:
+                inbox.append((sender, payload))
+        inboxes[id] = inbox
+    return inboxes
+
+
+def collect(agents):
+    """collect the mail agents have sent, as agent id -> entries"""
+    sent = defaultdict(list)
+    for agent in agents:
+        for to, entry in agent.outbox():
+            sent[to].append(entry)
+    return sent
+
+
+@asyncio.coroutine
+def superstep(agents, mail, func='step', args=()):
+    """run a superstep over agents (agent id -> agent) with their mail,
+    returning the mail they sent"""
+    inboxes = deliver(agents, mail)
+    results = [getattr(agent, func)(inboxes.get(id, []), *args)
+               for id, agent in agents.items()]
+    coros = [r for r in results if inspect.isgenerator(r) or asyncio.iscoroutine(r)]
+    if coros:
+        yield from asyncio.gather(*coros)
+    return collect(agents.values())
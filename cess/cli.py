@@ -1,39 +1,51 @@
 import sys
 import click
+import signal
 import asyncio
 import logging
 import traceback
 import threading
 import multiprocessing
+from uuid import uuid4
+from collections import Counter
 from logging import FileHandler
+from .cluster import transport
+from .cluster.client import Client
 from .cluster.worker import Worker
 from .cluster.arbiter import Arbiter
-from concurrent.futures import ProcessPoolExecutor
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 
 
-def _splitconn(conn):
-    host, port = conn.split(':')
-    return host, int(port)
+@click.group()
+@click.option('--loop', type=click.Choice(['auto', 'asyncio', 'uvloop']), default='auto',
+              help='event loop to use; auto uses uvloop if it is installed')
+def cli(loop):
+    """addresses (CONN) are host:port, or unix:/path for a unix domain socket"""
+    if loop == 'asyncio':
+        return
+    if not transport.use_fast_loop() and loop == 'uvloop':
+        raise click.UsageError('uvloop is not installed')
 
 
-@click.group()
-def cli():
-    pass
+# shared memory is opt-in, see `cluster.shm`
+shared_option = click.option('--shared', is_flag=True,
+                             help='connect to peers on the same host over shared memory')
 
 
 @cli.command()
-@click.argument('conn', 'host and port to run the arbiter on')
-def arbiter(conn):
-    """start an arbiter"""
-    host, port = _splitconn(conn)
+@click.argument('conn')
+@shared_option
+def arbiter(conn, shared):
+    """start an arbiter at CONN"""
+    host, port = transport.parse(conn)
     loop = asyncio.get_event_loop()
 
-    # creates a server and starts listening to TCP connections
-    server = Arbiter()
+    # creates a server and starts listening to connections
+    server = Arbiter(shared=shared)
     loop.run_until_complete(server.start(host, port))
 
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
     try:
         loop.run_forever()
     except KeyboardInterrupt:
@@ -44,21 +56,32 @@ def arbiter(conn):
 
 
 @cli.command()
-@click.argument('conn', 'arbiter host and port')
-@click.argument('start_port', 'starting port for workers', default=8880)
-@click.argument('cores', 'number of cores to use; 0 for all', default=0)
-def node(conn, start_port, cores):
-    """start a node with multiple workers"""
-    host, port = _splitconn(conn)
-    Node().start(host, port, start_port, cores)
+@click.argument('conn')
+@click.argument('start_port', default=8880)
+@click.argument('cores', default=0)
+@shared_option
+def node(conn, start_port, cores, shared):
+    """start a node with multiple workers, for the arbiter at CONN,
+    with workers on ports from START_PORT (or, if the arbiter is on a
+    unix socket, on sockets at its path suffixed by those numbers).
+    CORES is the number of workers to run;
+    0 for one per cpu, or negative for that many fewer"""
+    host, port = transport.parse(conn)
+    Node(shared=shared).start(host, port, start_port, cores)
 
 
-def start_worker(arbiter_host, arbiter_port, port):
-    """start a worker"""
-    loop = asyncio.get_event_loop()
-    work = Worker()
-    loop.run_until_complete(work.start(arbiter_host, arbiter_port, port=port))
+def start_worker(arbiter_host, arbiter_port, port, id=None, host='127.0.0.1', shared=False):
+    """start a worker, which runs until interrupted or terminated"""
+    # a fresh loop, in case this process was forked from one with a loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    work = Worker(shared=shared)
+    if id is not None:
+        work.id = id
+    loop.run_until_complete(work.start(arbiter_host, arbiter_port, host=host, port=port))
 
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, loop.stop)
     try:
         loop.run_forever()
     finally:
@@ -67,33 +90,166 @@ def start_worker(arbiter_host, arbiter_port, port):
 
 
 @cli.command()
-@click.argument('conn', 'arbiter host and port')
-@click.argument('port', 'port to run worker on', default=8880)
-def worker(conn, port):
-    host, port = _splitconn(conn)
-    start_worker(host, port)
+@click.argument('conn')
+@click.argument('port', default='8880')
+@shared_option
+def worker(conn, port, shared):
+    """start a worker on PORT (or a unix:/path), for the arbiter at CONN"""
+    arbiter_host, arbiter_port = transport.parse(conn)
+    if port.startswith(transport.UNIX):
+        host, port = transport.parse(port)
+    else:
+        host, port = '127.0.0.1', int(port)
+    start_worker(arbiter_host, arbiter_port, port, host=host, shared=shared)
+
+
+def n_workers(cores):
+    """how many workers to run: `cores` if positive (up to the number
+    of cpus), otherwise all cpus less `-cores` (at least one)"""
+    cpus = multiprocessing.cpu_count()
+    if cores > 0:
+        return min(cpus, cores)
+    return max(1, cpus + cores)
 
 
 class Node():
+    """supervises a node's worker processes, one per core:
+    restarts workers which crash, shuts them down on SIGINT/SIGTERM,
+    and reports which workers are alive to the arbiter"""
+
+    def __init__(self, heartbeat=5, max_restarts=5, grace=10, shared=False):
+        """
+        - heartbeat: seconds between liveness reports to the arbiter
+        - max_restarts: how many times a worker is restarted before giving up
+        - grace: seconds workers have to shut down before they are killed
+        - shared: whether workers connect to peers on the same host over shared memory
+        """
+        self.id = uuid4().hex
+        self.shared = shared
+        self.heartbeat = heartbeat
+        self.max_restarts = max_restarts
+        self.grace = grace
+        self.stopping = False
+
+        # port -> worker process, and worker id -> port
+        self.processes = {}
+        self.workers = {}
+
+        # port -> restarts, and ids of exited workers not yet reported
+        self.restarts = Counter()
+        self.exited = set()
+
+        # keep references to in-flight reports
+        self.reporting = set()
+
     def start(self, arbiter_host, arbiter_port, start_port, cores):
+        """start the workers and supervise them until shut down"""
         logger = logging.getLogger('cluster.worker')
         logger.addHandler(MPLogHandler('/tmp/node.log'))
 
-        cpus = multiprocessing.cpu_count()
-        if cores > 0:
-            cores = min(cpus, cores)
+        self.loop = asyncio.get_event_loop()
+        self.arbiter = Client(arbiter_host, arbiter_port)
+        self.arbiter_conn = (arbiter_host, arbiter_port)
+
+        n = n_workers(cores)
+        logger.info('starting {} workers'.format(n))
+        for port in range(start_port, start_port + n):
+            self.spawn(port)
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(sig, self.stop)
+        beat = asyncio.Task(self.beat())
+        try:
+            self.loop.run_forever()
+        finally:
+            beat.cancel()
+            for p in self.processes.values():
+                if p.is_alive():
+                    p.kill()
+                p.join()
+            self.arbiter.close()
+
+    def address(self, port):
+        """the address of the worker on the specified port. workers use
+        unix domain sockets if the arbiter does (with the port as a suffix)"""
+        host, path = self.arbiter_conn
+        if transport.is_unix(host):
+            return host, '{}.{}'.format(path, port)
+        return '127.0.0.1', port
+
+    def spawn(self, port):
+        """start a worker process on the specified port"""
+        id = uuid4().hex
+        host, addr = self.address(port)
+        p = multiprocessing.Process(target=start_worker,
+                                    args=self.arbiter_conn + (addr,),
+                                    kwargs={'id': id, 'host': host, 'shared': self.shared})
+        p.start()
+        self.processes[port] = p
+        self.workers[id] = port
+
+        # a process' sentinel becomes ready when it exits
+        self.loop.add_reader(p.sentinel, self._exited, id)
+
+    def _exited(self, id):
+        port = self.workers.pop(id)
+        p = self.processes[port]
+        self.loop.remove_reader(p.sentinel)
+        p.join()
+        self.exited.add(id)
+
+        if self.stopping:
+            if not self.workers:
+                self.loop.stop()
+            return
+
+        logger = logging.getLogger('cluster.worker')
+        if self.restarts[port] < self.max_restarts:
+            logger.warning('worker on port {} exited ({}), restarting'.format(port, p.exitcode))
+            self.restarts[port] += 1
+            self.spawn(port)
         else:
-            cores = max(1, cpus - cores)
+            logger.error('worker on port {} exited ({}), not restarting'.format(port, p.exitcode))
+        self._report()
+
+    def stop(self):
+        """shut down workers, killing any that don't exit in time"""
+        if self.stopping:
+            return
+        self.stopping = True
+        if not self.workers:
+            self.loop.stop()
+            return
+        for port in self.workers.values():
+            self.processes[port].terminate()
+        self.loop.call_later(self.grace, self.loop.stop)
 
-        logger.info('starting {} workers'.format(cores))
-        with ProcessPoolExecutor(max_workers=cores) as executor:
-            port = start_port
-            for _ in range(cores):
-                executor.submit(start_worker, arbiter_host, arbiter_port, port)
-                port += 1
+    def _report(self):
+        task = asyncio.Task(self.report())
+        self.reporting.add(task)
+        task.add_done_callback(self.reporting.discard)
 
-            while True:
-                pass
+    @asyncio.coroutine
+    def beat(self):
+        """periodically report liveness"""
+        while not self.stopping:
+            yield from self.report()
+            yield from asyncio.sleep(self.heartbeat)
+
+    @asyncio.coroutine
+    def report(self):
+        """report which of this node's workers are alive (or have exited)"""
+        exited = set(self.exited)
+        workers = {id: True for id in self.workers}
+        workers.update({id: False for id in exited})
+        try:
+            yield from self.arbiter.send_recv({
+                'cmd': 'heartbeat',
+                'node': self.id,
+                'workers': workers})
+            self.exited -= exited
+        except OSError:
+            logging.getLogger('cluster.worker').warning('could not reach arbiter')
 
 
 class MPLogHandler(logging.Handler):
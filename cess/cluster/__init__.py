@@ -1,11 +1,15 @@
 import asyncio
 from .client import Client
+from .routing import Router
+from .partition import as_edges
+from .. import snapshot
 from ..agent import Agent, AgentProxy
 
 
 class Cluster(Client):
-    def __init__(self, host, port):
-        super().__init__(host, port)
+    def __init__(self, host, port, shared=False):
+        super().__init__(host, port, shared=shared)
+        self.router = Router(self, shared=shared)
 
     def submit(self, command, **data):
         """submit a command (and optionally data) to the arbiter (synchronous)"""
@@ -18,6 +22,15 @@ class Cluster(Client):
                 print(result['traceback'])
         return results
 
+    def populate(self, agents, costs=None, groups=None, graph=None, agent_attr=None):
+        """distribute agents across the cluster (synchronous).
+        calls to the agents are then routed directly to their workers.
+        see `partition` for `costs` and `groups`, and `as_edges` for `graph` and `agent_attr`"""
+        edges = as_edges(graph, agent_attr) if graph is not None else None
+        resp = self.submit('populate', agents=agents, costs=costs, groups=groups, edges=edges)
+        self.router.update(resp.get('agents'), resp.get('workers'))
+        return resp
+
     @asyncio.coroutine
     def call_agents(self, func, *args, **kwargs):
         return (yield from self.send_recv({
@@ -27,12 +40,58 @@ class Cluster(Client):
             'kwargs': kwargs
         }))
 
+    @asyncio.coroutine
+    def superstep(self, func='step', *args):
+        """run a superstep of a bulk-synchronous simulation
+        (see `cess.bsp`) across the cluster"""
+        resp = yield from self.send_recv({
+            'cmd': 'superstep',
+            'func': func,
+            'args': args
+        })
+        if resp['status'] != 'ok':
+            raise resp['exception']
+        return resp
+
+    @asyncio.coroutine
+    def snapshot(self, clear=False):
+        """have the arbiter take the step's snapshot across the
+        cluster (see `Arbiter.snapshot`), and publish it here too.
+        if `clear` is true, the snapshot is cleared everywhere instead"""
+        resp = yield from self.send_recv({'cmd': 'snapshot', 'clear': clear})
+        snapshot.publish(resp['snapshot'])
+        return resp
+
+    @asyncio.coroutine
+    def rebalance(self, dry_run=False, **options):
+        """have the arbiter migrate agents between workers
+        (see `Arbiter.rebalance`), returning its report"""
+        report = yield from self.send_recv({
+            'cmd': 'rebalance',
+            'dry_run': dry_run,
+            'options': options
+        })
+        self.router.update(report.get('agents'))
+        return report
+
+    @asyncio.coroutine
+    def repartition(self, dry_run=False, graph=None, agent_attr=None):
+        """have the arbiter re-place agents to minimize calls between
+        workers (see `Arbiter.repartition`), returning its report"""
+        report = yield from self.send_recv({
+            'cmd': 'repartition',
+            'dry_run': dry_run,
+            'edges': as_edges(graph, agent_attr) if graph is not None else None
+        })
+        self.router.update(report.get('agents'))
+        return report
+
     @asyncio.coroutine
     def call_agent(self, data):
         d = {'args': [], 'kwargs': {}}
         d.update(data)
         d['cmd'] = 'call_agent'
-        return (yield from self.send_recv(d))
+        return (yield from self.router.call_agent(d))
 
 
 def proxy_agents(agent):
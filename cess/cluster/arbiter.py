@@ -1,8 +1,11 @@
-import math
+import time
 import asyncio
 import logging
+from collections import defaultdict, Counter
 from .client import Client
 from .server import Server
+from .partition import partition, graph_partition, as_edges, cut
+from .rebalance import Rebalancer
 
 logger = logging.getLogger(__name__)
 
@@ -10,15 +13,37 @@ logger = logging.getLogger(__name__)
 class Arbiter(Server):
     """the arbiter manages all of the workers"""
 
-    def __init__(self):
+    def __init__(self, shared=False):
+        """if `shared` is true, connections to workers
+        on the same host go over shared memory (see `shm`)"""
+        self.shared = shared
         self.agents = {}
         self.workers = {}
+
+        # worker id -> number of cores (i.e. capacity)
+        self.ncores = {}
+        self.rebalancer = Rebalancer()
+
+        # (agent id, agent id) -> calls between the agents, as reported by workers
+        self.interactions = Counter()
+
+        # node id -> time of its last heartbeat
+        self.nodes = {}
+
+        # agent id -> mail exchanged between workers, for the next superstep
+        self.mail = defaultdict(list)
         super().__init__()
         self.handlers = {
             'register': self.register,
             'populate': self.populate,
             'call_agent': self.call_agent,
             'call_agents': self.call_agents,
+            'call_agents_batch': self.call_agents_batch,
+            'rebalance': self.rebalance,
+            'repartition': self.repartition,
+            'heartbeat': self.heartbeat,
+            'superstep': self.superstep,
+            'snapshot': self.snapshot,
         }
 
     @asyncio.coroutine
@@ -32,22 +57,194 @@ class Arbiter(Server):
 
     @asyncio.coroutine
     def populate(self, data):
+        """distribute agents across workers, weighted by the workers' cores.
+        optionally, `costs` maps agent ids to measured costs,
+        `groups` maps agent ids to affinity groups, and `edges` is the
+        agents' interaction graph, to minimize calls between workers (see `partition`)"""
         agents = data['agents']
-        agents_per_worker = math.ceil(len(agents)/len(self.workers))
+        capacities = {id: self.ncores.get(id, 1) for id in self.workers}
+        edges = as_edges(data['edges']) if data.get('edges') else None
+        parts = partition(agents, capacities, data.get('costs'), data.get('groups'), edges)
 
         tasks = []
-        i = 0
-        for id, worker in self.workers.items():
-            to_send = agents[i:i+agents_per_worker]
-            tasks.append(asyncio.Task(worker.send_recv({
+        for id, to_send in parts.items():
+            tasks.append(asyncio.Task(self.workers[id].send_recv({
                 'cmd': 'populate', 'agents': to_send})))
 
             # keep track of where agents are
             for agent in to_send:
                 self.agents[agent.id] = id
-            i += agents_per_worker
         yield from asyncio.gather(*tasks)
-        return {'success': 'ok'}
+
+        # so workers can call each other directly
+        yield from self.publish_routes(self.agents)
+        return {'success': 'ok', 'agents': self.agents, 'workers': self.addresses()}
+
+    @asyncio.coroutine
+    def superstep(self, data):
+        """run a superstep of a bulk-synchronous simulation (see `cess.bsp`)
+        on all workers. this is the barrier: once every worker has stepped
+        its agents, the mail they sent to agents on other workers is
+        exchanged, in one message per worker, for the next superstep"""
+        outgoing = defaultdict(dict)
+        undelivered = 0
+        mail, self.mail = self.mail, defaultdict(list)
+        for id, entries in mail.items():
+            worker_id = self.agents.get(id)
+            if worker_id in self.workers:
+                outgoing[worker_id][id] = entries
+            else:
+                undelivered += len(entries)
+
+        ids = list(self.workers.keys())
+        resps = yield from asyncio.gather(*[
+            self.workers[id].send_recv({
+                'cmd': 'superstep',
+                'func': data.get('func', 'step'),
+                'args': data.get('args', ()),
+                'mail': outgoing.get(id, {})
+            }) for id in ids])
+
+        exchanged = 0
+        for resp in resps:
+            if resp['status'] != 'ok':
+                return resp
+            for id, entries in resp['mail'].items():
+                self.mail[id].extend(entries)
+                exchanged += len(entries)
+        return {'status': 'ok', 'exchanged': exchanged, 'undelivered': undelivered}
+
+    @asyncio.coroutine
+    def snapshot(self, data):
+        """take the step's snapshot (see `cess.snapshot`): every worker
+        captures its agents' part, then gets the other workers' parts in bulk.
+        returns the whole snapshot. if `clear` is true, workers clear theirs instead"""
+        ids = list(self.workers.keys())
+        if data.get('clear'):
+            yield from asyncio.gather(*[
+                self.workers[id].send_recv({'cmd': 'publish_snapshot', 'snapshot': None})
+                for id in ids])
+            return {'status': 'ok', 'snapshot': None}
+
+        resps = yield from asyncio.gather(*[
+            self.workers[id].send_recv({'cmd': 'snapshot'}) for id in ids])
+        parts = dict(zip(ids, (resp['snapshot'] for resp in resps)))
+
+        yield from asyncio.gather(*[
+            self.workers[id].send_recv({
+                'cmd': 'publish_snapshot',
+                'snapshot': {a: s for w, part in parts.items() if w != id for a, s in part.items()}
+            }) for id in ids])
+
+        snap = {}
+        for part in parts.values():
+            snap.update(part)
+        return {'status': 'ok', 'snapshot': snap}
+
+    @asyncio.coroutine
+    def rebalance(self, data):
+        """migrate agents between workers, based on the workers'
+        agent timings and cross-worker calls since the last rebalance.
+        this should only be called between steps.
+        if `dry_run` is true, the planned moves are reported but not made.
+        `options` can override the rebalancer's thresholds (see `Rebalancer`)"""
+        costs, remote_calls = yield from self.collect_stats()
+        rebalancer = self.rebalancer
+        if data.get('options'):
+            rebalancer = Rebalancer(**data['options'])
+        capacities = {id: self.ncores.get(id, 1) for id in self.workers}
+        report = rebalancer.plan(self.agents, capacities, costs, remote_calls)
+
+        if not data.get('dry_run') and report['moves']:
+            yield from self.migrate(report['moves'])
+            report['agents'] = {id: to for id, _, to, _ in report['moves']}
+        return report
+
+    @asyncio.coroutine
+    def repartition(self, data):
+        """re-place agents to minimize calls between workers, refining their
+        current placement, based on the interaction graph recorded from
+        agent calls (or the specified `edges`), with agents weighted by
+        their measured costs. like `rebalance`, this should only be called
+        between steps, and if `dry_run` is true the moves are only reported"""
+        costs, _ = yield from self.collect_stats()
+        edges = as_edges(data['edges']) if data.get('edges') else dict(self.interactions)
+
+        mean = (sum(costs.values())/len(costs) if costs else 0) or 1
+        weights = {id: costs.get(id) or mean for id in self.agents}
+        capacities = {id: self.ncores.get(id, 1) for id in self.workers}
+        assign = graph_partition(weights, capacities, edges,
+                                 initial=self.agents,
+                                 tolerance=data.get('tolerance', 0.05))
+
+        moves = [(id, self.agents[id], w, 'graph')
+                 for id, w in assign.items() if w != self.agents[id]]
+        report = {
+            'moves': moves,
+            'cut': cut(self.agents, edges),
+            'expected_cut': cut(assign, edges)
+        }
+        if not data.get('dry_run') and moves:
+            yield from self.migrate(moves)
+            report['agents'] = {id: to for id, _, to, _ in moves}
+        return report
+
+    @asyncio.coroutine
+    def collect_stats(self):
+        """collect and reset workers' stats, returning agent costs and
+        calls between workers. agent interactions are accumulated"""
+        resps = yield from asyncio.gather(*[
+            w.send_recv({'cmd': 'stats', 'reset': True}) for w in self.workers.values()])
+        costs, remote_calls = {}, []
+        for resp in resps:
+            costs.update(resp['timings'])
+            remote_calls.extend(resp['remote_calls'])
+            for caller, id, n in resp['interactions']:
+                self.interactions[caller, id] += n
+        return costs, remote_calls
+
+    @asyncio.coroutine
+    def migrate(self, moves):
+        """move agents between workers, as a list of
+        `(agent id, from worker, to worker, ...)`"""
+        releases = defaultdict(list)
+        for id, frm, to, *_ in moves:
+            releases[frm].append(id)
+        sources = list(releases.keys())
+        resps = yield from asyncio.gather(*[
+            self.workers[w].send_recv({'cmd': 'release', 'ids': releases[w]})
+            for w in sources])
+
+        destinations = {id: to for id, _, to, *_ in moves}
+        adoptions = defaultdict(list)
+        for resp in resps:
+            for agent in resp['agents']:
+                adoptions[destinations[agent.id]].append(agent)
+
+            # mail waiting for migrated agents is delivered
+            # through the arbiter at the next superstep
+            for id, entries in resp.get('mail', {}).items():
+                self.mail[id].extend(entries)
+        yield from asyncio.gather(*[
+            self.workers[w].send_recv({'cmd': 'adopt', 'agents': agents})
+            for w, agents in adoptions.items()])
+
+        self.agents.update(destinations)
+        yield from self.publish_routes(destinations)
+
+    def addresses(self):
+        """worker id -> (host, port)"""
+        return {id: (w.host, w.port) for id, w in self.workers.items()}
+
+    @asyncio.coroutine
+    def publish_routes(self, agents=None, invalidate=None):
+        """publish agent placements (and/or invalidations) to all workers"""
+        msg = {'cmd': 'routes', 'workers': self.addresses()}
+        if agents is not None:
+            msg['agents'] = agents
+        if invalidate is not None:
+            msg['invalidate'] = invalidate
+        yield from asyncio.gather(*[w.send_recv(msg) for w in self.workers.values()])
 
     @asyncio.coroutine
     def register(self, data):
@@ -55,14 +252,39 @@ class Arbiter(Server):
         try:
             if type == 'worker':
                 host, port = data['host'], data['port']
-                self.workers[id] = Client(host, port)
-                self.ncores[id] = data['ncores']
+                self.workers[id] = Client(host, port, shared=self.shared)
+                self.ncores[id] = data.get('ncores', 1)
                 logger.info('registered {} at {}:{}'.format(type, host, port))
             return {'success': 'ok'}
         except ConnectionRefusedError:
             logger.exception('could not connect to {}:{}'.format(host, port))
             raise
 
+    @asyncio.coroutine
+    def heartbeat(self, data):
+        """liveness report from a node, where `workers` maps
+        the ids of the node's workers to whether they're alive.
+        workers which have exited are deregistered"""
+        self.nodes[data['node']] = time.time()
+        for id, alive in data['workers'].items():
+            if not alive and id in self.workers:
+                yield from self.deregister(id)
+        return {'status': 'ok'}
+
+    @asyncio.coroutine
+    def deregister(self, id):
+        """remove a worker which has gone down. its agents are lost"""
+        self.workers.pop(id).close()
+        self.ncores.pop(id, None)
+        lost = [a for a, w in self.agents.items() if w == id]
+        for a in lost:
+            del self.agents[a]
+        if lost:
+            logger.error('worker {} went down, losing {} agents'.format(id, len(lost)))
+        else:
+            logger.warning('worker {} went down'.format(id))
+        yield from self.publish_routes(invalidate=lost)
+
     @asyncio.coroutine
     def call_agent(self, data):
         """call a method on an agent and get the result"""
@@ -74,3 +296,44 @@ class Arbiter(Server):
 
         # pass along the request to that worker, return the result
         return (yield from worker.send_recv(data))
+
+    @asyncio.coroutine
+    def call_agents_batch(self, data):
+        """route a batch of agent calls, sending
+        one batch to each worker involved"""
+        requests = data['requests']
+        results = [None for _ in requests]
+
+        # worker id -> indices of requests for its agents
+        batches = defaultdict(list)
+        for i, d in enumerate(requests):
+            try:
+                batches[self.agents[d['id']]].append(i)
+            except KeyError as e:
+                results[i] = {'status': 'failed', 'exception': e,
+                              'traceback': 'no worker for agent {}'.format(d['id'])}
+
+        # a worker which can't be reached only fails its own batch
+        worker_ids = list(batches.keys())
+        resps = yield from asyncio.gather(*[
+            self.workers[id].send_recv({
+                'cmd': 'call_agents_batch',
+                'requests': [requests[i] for i in batches[id]]
+            }) for id in worker_ids], return_exceptions=True)
+
+        for id, resp in zip(worker_ids, resps):
+            if isinstance(resp, Exception):
+                for i in batches[id]:
+                    results[i] = {'status': 'failed', 'exception': resp,
+                                  'traceback': 'could not reach worker {}: {!r}'.format(id, resp)}
+                continue
+
+            # the whole batch failed on the worker
+            if resp.get('status') != 'ok':
+                for i in batches[id]:
+                    results[i] = {'status': 'failed', 'exception': resp.get('exception'),
+                                  'traceback': resp.get('traceback')}
+                continue
+            for i, result in zip(batches[id], resp['results']):
+                results[i] = result
+        return {'status': 'ok', 'results': results}
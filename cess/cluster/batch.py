@@ -0,0 +1,53 @@
+import asyncio
+
+
+class Batcher():
+    """coalesces agent calls issued within the same event loop tick
+    into a single `call_agents_batch` request to a client,
+    then fans the results back out to the awaiting callers"""
+
+    def __init__(self, client):
+        self.client = client
+        self.pending = []
+
+        # the event loop only keeps weak references to tasks,
+        # so keep in-flight sends from being garbage collected
+        self.sending = set()
+
+    def submit(self, data):
+        """queue an agent call, returning a future for its result"""
+        future = asyncio.Future()
+        if not self.pending:
+            # flush once everything already scheduled
+            # for this tick has had a chance to submit
+            asyncio.get_event_loop().call_soon(self._flush)
+        self.pending.append((data, future))
+        return future
+
+    def _flush(self):
+        batch, self.pending = self.pending, []
+        task = asyncio.Task(self._send(batch))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+
+    @asyncio.coroutine
+    def _send(self, batch):
+        try:
+            resp = yield from self.client.send_recv({
+                'cmd': 'call_agents_batch',
+                'requests': [data for data, _ in batch]
+            })
+            results = resp['results']
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if result['status'] == 'ok':
+                future.set_result(result['result'])
+            else:
+                future.set_exception(result['exception'])
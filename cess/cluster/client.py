@@ -1,35 +1,268 @@
-from . import protocol
-from asyncio import streams, coroutine
+import asyncio
+from . import protocol, shm, transport
+from collections import deque, Counter
+from asyncio import coroutine
+
+
+class Connection():
+    """a single connection to a server, with its negotiated codecs"""
+
+    def __init__(self, reader, writer, codecs):
+        self.reader = reader
+        self.writer = writer
+        self.codecs = codecs
+        self.last_used = asyncio.get_event_loop().time()
+        self.uses = 0
+
+    @classmethod
+    @coroutine
+    def open(cls, host, port, codecs, shared=False, **options):
+        """open a connection and negotiate codecs (and other options) for it.
+        if `shared` is true, offer to upgrade the connection to shared memory,
+        which the server accepts if it's on the same host"""
+        reader, writer = yield from transport.open_connection(host, port)
+        hello = {'cmd': 'hello', 'codecs': codecs}
+        hello.update(options)
+        if shared and shm.available():
+            hello['shm'] = shm.host_id()
+        yield from protocol.write(writer, hello, ['pickle'])
+        resp = yield from protocol.read(reader)
+        if resp.get('shm'):
+            channel = yield from shm.attach(reader, writer, resp['shm'])
+            if channel is not None:
+                reader = writer = channel
+        return cls(reader, writer, resp['codecs'])
+
+    def healthy(self):
+        return not (self.reader.at_eof() or self.writer.transport.is_closing())
+
+    def close(self):
+        self.writer.close()
+
+    @coroutine
+    def request(self, data):
+        """send data to the server, get a response"""
+        self.uses += 1
+        yield from protocol.write(self.writer, data, self.codecs)
+        resp = yield from protocol.read(self.reader)
+        self.last_used = asyncio.get_event_loop().time()
+        return resp
+
+
+class PipelinedConnection(Connection):
+    """a connection which can have many requests in flight at once;
+    responses are matched to requests by request id"""
+
+    def __init__(self, reader, writer, codecs):
+        super().__init__(reader, writer, codecs)
+        self.next_id = 1
+        self.pending = {}
+        self.lock = asyncio.Lock()
+        self.receiver = asyncio.Task(self._receive())
+
+    @classmethod
+    @coroutine
+    def open(cls, host, port, codecs, **options):
+        options['pipeline'] = True
+        return (yield from super().open(host, port, codecs, **options))
+
+    @coroutine
+    def _receive(self):
+        """dispatch responses to the requests awaiting them"""
+        try:
+            while True:
+                request_id, resp = yield from protocol.read_frame(self.reader)
+                future = self.pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(resp)
+        except Exception as e:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            self.pending.clear()
+            self.close()
+
+    def close(self):
+        super().close()
+        if not self.receiver.done():
+            self.receiver.cancel()
+
+    @coroutine
+    def request(self, data):
+        self.uses += 1
+        request_id = self.next_id
+        self.next_id = self.next_id % (2**32 - 1) + 1
+        future = asyncio.Future()
+        self.pending[request_id] = future
+        yield from self.lock.acquire()
+        try:
+            yield from protocol.write(self.writer, data, self.codecs, request_id)
+        finally:
+            self.lock.release()
+        resp = yield from future
+        self.last_used = asyncio.get_event_loop().time()
+        return resp
+
+
+class Pool():
+    """a bounded pool of connections. when all connections
+    are in use, requests wait for one to be released"""
+
+    def __init__(self, connect, max_size=32, idle_timeout=60):
+        self.connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+        # most recently released last
+        self.idle = deque()
+        self.in_use = set()
+        self.connecting = 0
+        self.waiters = deque()
+        self.counts = Counter()
+
+    @property
+    def size(self):
+        return len(self.idle) + len(self.in_use) + self.connecting
+
+    def _evict(self):
+        """close connections which have been idle for too long, or are dead"""
+        now = asyncio.get_event_loop().time()
+        for conn in list(self.idle):
+            if not conn.healthy() or now - conn.last_used > self.idle_timeout:
+                self.idle.remove(conn)
+                conn.close()
+                self.counts['evictions'] += 1
+
+    @coroutine
+    def acquire(self):
+        """get a connection, opening a new one if none are idle
+        and the pool isn't full, otherwise waiting for one"""
+        while True:
+            self._evict()
+            if self.idle:
+                conn = self.idle.pop()
+                self.in_use.add(conn)
+                return conn
+
+            if self.size < self.max_size:
+                self.connecting += 1
+                try:
+                    conn = yield from self.connect()
+                except:
+                    # the slot is free again, for a waiter to connect with
+                    self._wake()
+                    raise
+                finally:
+                    self.connecting -= 1
+                self.counts['connects'] += 1
+                self.in_use.add(conn)
+                return conn
+
+            self.counts['waits'] += 1
+            waiter = asyncio.Future()
+            self.waiters.append(waiter)
+            yield from waiter
+
+    def release(self, conn, discard=False):
+        """return a connection to the pool,
+        or close it if it is discarded or dead"""
+        self.in_use.discard(conn)
+        if discard or not conn.healthy():
+            conn.close()
+        else:
+            self.idle.append(conn)
+        self._wake()
+
+    def _wake(self):
+        """wake the next waiter"""
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def close(self):
+        while self.idle:
+            self.idle.pop().close()
+        for conn in self.in_use:
+            conn.close()
+        self.in_use.clear()
+
+    def stats(self):
+        stats = dict(self.counts)
+        stats.update(in_use=len(self.in_use), idle=len(self.idle))
+        return stats
 
 
 class Client():
-    def __init__(self, host, port):
+    def __init__(self, host, port, codecs=None, pool_size=32, idle_timeout=60, pipeline=False, shared=False):
+        """a client for a server.
+        requests go over a bounded pool of connections or,
+        if `pipeline` is true, all over a single connection.
+        if `shared` is true, connections to a server on the
+        same host go over shared memory (see `shm` for its costs)"""
         self.host = host
         self.port = port
-        self.streams = {}
-
-    @coroutine
-    def _get_stream(self):
-        """get an unused stream"""
-        stream = None
-        for stream_, open in self.streams.items():
-            reader, writer = stream_
-            if writer.transport._closing:
-                del self.streams[stream_]
-            elif open:
-                stream = stream_
-                break
-        if stream is None:
-            stream = yield from streams.open_connection(self.host, self.port)
-        self.streams[stream] = False
-        return stream
+        self.shared = shared
+
+        # codecs to offer the server, in order of preference
+        self.codecs = list(codecs or protocol.codec_names.keys())
+
+        self.pipeline = pipeline
+        self.pool = Pool(self._connect,
+                         max_size=1 if pipeline else pool_size,
+                         idle_timeout=idle_timeout)
+
+    @coroutine
+    def _connect(self):
+        cls = PipelinedConnection if self.pipeline else Connection
+        return (yield from cls.open(self.host, self.port, self.codecs, shared=self.shared))
 
     @coroutine
     def send_recv(self, data):
         """send data to a server, get a response"""
-        stream = yield from self._get_stream()
-        reader, writer = stream
-        yield from protocol.write(writer, data)
-        resp = yield from protocol.read(reader)
-        self.streams[stream] = True
+        if self.pipeline:
+            return (yield from self._send_recv_pipelined(data))
+
+        conn = yield from self.pool.acquire()
+        reused = conn.uses > 0
+        try:
+            resp = yield from conn.request(data)
+        except (ConnectionError, EOFError):
+            self.pool.release(conn, discard=True)
+            self.pool.counts['failures'] += 1
+
+            # an idle connection may have been dropped by the server,
+            # in which case reconnect and try again once
+            if not reused:
+                raise
+            self.pool.counts['reconnects'] += 1
+            conn = yield from self.pool.acquire()
+            try:
+                resp = yield from conn.request(data)
+            except:
+                self.pool.release(conn, discard=True)
+                raise
+        except:
+            self.pool.release(conn, discard=True)
+            raise
+        self.pool.release(conn)
         return resp
+
+    @coroutine
+    def _send_recv_pipelined(self, data):
+        # the single connection is shared, so release it immediately
+        conn = yield from self.pool.acquire()
+        self.pool.release(conn)
+        try:
+            return (yield from conn.request(data))
+        except (ConnectionError, EOFError):
+            self.pool.counts['failures'] += 1
+            raise
+
+    def stats(self):
+        """connection pool stats"""
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.close()
@@ -0,0 +1,268 @@
+"""
+parallel execution on a single machine, without an arbiter or TCP.
+
+agents are sharded across local worker processes, each connected to
+the driver process by a socket pair. the driver plays the arbiter's
+role, routing (batched) agent calls between the shards.
+"""
+
+import socket
+import asyncio
+import logging
+import multiprocessing
+from . import protocol
+from .worker import Worker
+from .arbiter import Arbiter
+from .batch import Batcher
+from .routing import Router
+from .partition import partition, as_edges
+from .. import snapshot
+from ..agent import AgentProxy
+
+logger = logging.getLogger(__name__)
+
+
+class Channel():
+    """a duplex connection between two processes;
+    either end can send requests to the other"""
+
+    def __init__(self, reader, writer, handler):
+        self.reader = reader
+        self.writer = writer
+        self.handler = handler
+        self.next_id = 1
+        self.pending = {}
+        self.responding = set()
+        self.lock = asyncio.Lock()
+        self.closed = asyncio.Future()
+        self.receiver = asyncio.Task(self._receive())
+
+    @classmethod
+    @asyncio.coroutine
+    def open(cls, sock, handler):
+        reader, writer = yield from asyncio.open_connection(sock=sock)
+        return cls(reader, writer, handler)
+
+    @asyncio.coroutine
+    def _write(self, request_id, msg):
+        yield from self.lock.acquire()
+        try:
+            yield from protocol.write(self.writer, msg, request_id=request_id)
+        finally:
+            self.lock.release()
+
+    @asyncio.coroutine
+    def _receive(self):
+        try:
+            while True:
+                request_id, (kind, data) = yield from protocol.read_frame(self.reader)
+                if kind == 'request':
+                    task = asyncio.Task(self._respond(request_id, data))
+                    self.responding.add(task)
+                    task.add_done_callback(self.responding.discard)
+                else:
+                    future = self.pending.pop(request_id, None)
+                    if future is None or future.done():
+                        continue
+                    if kind == 'error':
+                        future.set_exception(data)
+                    else:
+                        future.set_result(data)
+        except Exception as e:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            self.pending.clear()
+            self.writer.close()
+            if not self.closed.done():
+                self.closed.set_result(True)
+
+    @asyncio.coroutine
+    def _respond(self, request_id, data):
+        try:
+            resp = yield from self.handler(data)
+            msg = ('response', resp)
+        except Exception as e:
+            logger.exception(e)
+            msg = ('error', e)
+        yield from self._write(request_id, msg)
+
+    @asyncio.coroutine
+    def send_recv(self, data):
+        """send a request to the other end, get a response"""
+        request_id = self.next_id
+        self.next_id = self.next_id % (2**32 - 1) + 1
+        future = asyncio.Future()
+        self.pending[request_id] = future
+        yield from self._write(request_id, ('request', data))
+        return (yield from future)
+
+    def close(self):
+        self.writer.close()
+
+
+def _run_shard(id, sock, agents, inherited):
+    """entry point for a shard process"""
+    # forked processes inherit the driver's ends of the socket pairs,
+    # which have to be closed so the driver closing them is seen here
+    for s in inherited:
+        s.close()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    worker = Worker()
+    worker.id = id
+    AgentProxy.worker = worker
+    worker.agents = {a.id: a for a in agents}
+
+    # all non-local calls go through the driver
+    channel = loop.run_until_complete(Channel.open(sock, worker.respond))
+    worker.arbiter = channel
+    worker.router = Router(channel, local_id=worker.id)
+    try:
+        loop.run_until_complete(channel.closed)
+    finally:
+        loop.close()
+
+
+class LocalCluster(Arbiter):
+    """runs agents across a pool of local processes.
+    this has the same interface as a `Cluster`, so
+    agents can be accessed through `AgentProxy`s as usual"""
+
+    def __init__(self, n_workers=None):
+        super().__init__()
+        self.handlers = {
+            'call_agent': super().call_agent,
+            'call_agents': super().call_agents,
+            'call_agents_batch': self.call_agents_batch,
+        }
+        self.n_workers = n_workers or multiprocessing.cpu_count()
+        self.processes = []
+        self.batcher = Batcher(self)
+
+        # if processes are forked, they inherit their agents,
+        # otherwise the agents are sent to them
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+
+    def populate(self, agents, costs=None, groups=None, graph=None, agent_attr=None):
+        """shard agents across worker processes (synchronous).
+        see `partition` for `costs` and `groups`, and `as_edges` for `graph` and `agent_attr`"""
+        loop = asyncio.get_event_loop()
+        forked = self.context.get_start_method() == 'fork'
+        n_workers = max(1, min(self.n_workers, len(agents)))
+        edges = as_edges(graph, agent_attr) if graph is not None else None
+        parts = partition(agents, {i: 1 for i in range(n_workers)}, costs, groups, edges)
+        shards = [parts[i] for i in range(n_workers)]
+        socks = []
+        for i, shard in enumerate(shards):
+            ours, theirs = socket.socketpair()
+            socks.append(ours)
+            if forked:
+                args = (i, theirs, shard, socks)
+            else:
+                args = (i, theirs, [], [])
+            proc = self.context.Process(target=_run_shard, args=args, daemon=True)
+            proc.start()
+            theirs.close()
+            self.processes.append(proc)
+            self.workers[i] = loop.run_until_complete(Channel.open(ours, self.respond))
+            for agent in shard:
+                self.agents[agent.id] = i
+
+        if not forked:
+            loop.run_until_complete(asyncio.gather(*[
+                self.workers[i].send_recv({'cmd': 'populate', 'agents': shard})
+                for i, shard in enumerate(shards)]))
+        return {'success': 'ok'}
+
+    def collect(self):
+        """retrieve agents from the worker processes (synchronous)"""
+        loop = asyncio.get_event_loop()
+        resps = loop.run_until_complete(asyncio.gather(*[
+            w.send_recv({'cmd': 'collect'}) for w in self.workers.values()]))
+        return {a.id: a for resp in resps for a in resp['agents']}
+
+    def stop(self):
+        """shut down the worker processes"""
+        loop = asyncio.get_event_loop()
+        for channel in self.workers.values():
+            channel.close()
+        loop.run_until_complete(asyncio.wait(
+            [c.closed for c in self.workers.values()], timeout=5))
+        for proc in self.processes:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        self.workers = {}
+        self.processes = []
+
+    def addresses(self):
+        # shards reach each other through this process
+        return {}
+
+    @asyncio.coroutine
+    def superstep(self, func='step', *args):
+        """run a superstep of a bulk-synchronous
+        simulation across the worker processes"""
+        resp = yield from super().superstep({
+            'cmd': 'superstep',
+            'func': func,
+            'args': args
+        })
+        if resp['status'] != 'ok':
+            raise resp['exception']
+        return resp
+
+    @asyncio.coroutine
+    def snapshot(self, clear=False):
+        """take the step's snapshot across the worker
+        processes, and publish it in this process too
+        (or clear it everywhere)"""
+        resp = yield from super().snapshot({'cmd': 'snapshot', 'clear': clear})
+        snapshot.publish(resp['snapshot'])
+        return resp
+
+    @asyncio.coroutine
+    def rebalance(self, dry_run=False, **options):
+        """migrate agents between the worker processes"""
+        return (yield from super().rebalance({
+            'cmd': 'rebalance',
+            'dry_run': dry_run,
+            'options': options
+        }))
+
+    @asyncio.coroutine
+    def repartition(self, dry_run=False, graph=None, agent_attr=None):
+        """re-place agents across the worker processes
+        to minimize calls between them"""
+        return (yield from super().repartition({
+            'cmd': 'repartition',
+            'dry_run': dry_run,
+            'edges': as_edges(graph, agent_attr) if graph is not None else None
+        }))
+
+    @asyncio.coroutine
+    def send_recv(self, data):
+        """requests from this process are handled directly"""
+        return (yield from self.respond(data))
+
+    @asyncio.coroutine
+    def call_agent(self, data):
+        """call a method on an agent, for `AgentProxy`s in this process"""
+        d = {'args': [], 'kwargs': {}}
+        d.update(data)
+        d['cmd'] = 'call_agent'
+        return (yield from self.batcher.submit(d))
+
+    @asyncio.coroutine
+    def call_agents(self, func, *args, **kwargs):
+        """call a method on all agents"""
+        return (yield from super().call_agents({
+            'cmd': 'call_agents',
+            'func': func,
+            'args': args,
+            'kwargs': kwargs
+        }))
@@ -0,0 +1,379 @@
+"""
+partitioning agents across workers.
+
+agents are weighted by their cost (declared with an agent's `load`
+attribute, or measured and passed in) and workers by their capacity
+(e.g. number of cores). agents with the same `affinity` are kept
+together, since they are expected to interact heavily.
+
+if the agents' interaction graph is known (e.g. a grid, or as recorded
+from agent calls), agents are instead placed to minimize the
+interactions between workers (see `graph_partition`).
+"""
+
+import math
+from collections import OrderedDict, deque
+
+
+def agent_cost(agent, costs=None):
+    """the cost of running an agent; measured if available,
+    otherwise as declared by the agent (default 1)"""
+    if costs is not None and agent.id in costs:
+        return costs[agent.id]
+    return getattr(agent, 'load', 1)
+
+
+def affinity_groups(agents, groups=None):
+    """group agents which should be placed together.
+    `groups` optionally maps agent ids to group keys,
+    otherwise agents' `affinity` attributes are used"""
+    units = OrderedDict()
+    for agent in agents:
+        if groups is not None:
+            key = groups.get(agent.id)
+        else:
+            key = getattr(agent, 'affinity', None)
+        if key is None:
+            key = ('agent', agent.id)
+        units.setdefault(key, []).append(agent)
+    return list(units.values())
+
+
+def partition(agents, capacities, costs=None, groups=None, edges=None):
+    """assign agents to workers, balancing cost relative to capacity.
+    `capacities` maps worker ids to capacities.
+    without `edges`, this is greedy longest-processing-time-first scheduling:
+    the costliest groups are assigned first, each to the
+    worker which would have the lowest relative load after.
+    with `edges` (see `as_edges`), this is a min edge-cut graph partition;
+    it's an error if none of the edges are between the agents.
+    @returns dict of worker id -> list of agents (in their original order)"""
+    if not capacities:
+        raise ValueError('no workers to partition agents across')
+
+    order = {agent.id: i for i, agent in enumerate(agents)}
+    units = [(sum(agent_cost(a, costs) for a in unit), i, unit)
+             for i, unit in enumerate(affinity_groups(agents, groups))]
+
+    if edges:
+        unit_of = {a.id: i for _, i, unit in units for a in unit}
+        unit_edges = {}
+        matched = False
+        for (u, v), w in edges.items():
+            if u in unit_of and v in unit_of:
+                matched = True
+                if unit_of[u] != unit_of[v]:
+                    key = (unit_of[u], unit_of[v])
+                    unit_edges[key] = unit_edges.get(key, 0) + w
+        if not matched:
+            raise ValueError('none of the graph\'s edges are between agents; '
+                             'if its nodes hold the agents, specify `agent_attr`')
+        assign = graph_partition({i: cost for cost, i, _ in units}, capacities, unit_edges)
+        parts = {w: [] for w in capacities}
+        for _, i, unit in units:
+            parts[assign[i]].extend(unit)
+        for part in parts.values():
+            part.sort(key=lambda a: order[a.id])
+        return parts
+
+    units.sort(key=lambda u: (-u[0], u[1]))
+
+    workers = list(capacities.keys())
+    caps = [max(capacities[w], 1e-9) for w in workers]
+    loads = [0 for _ in workers]
+    parts = {w: [] for w in workers}
+
+    for cost, _, unit in units:
+        i = min(range(len(workers)), key=lambda i: ((loads[i] + cost)/caps[i], i))
+        loads[i] += cost
+        parts[workers[i]].extend(unit)
+
+    for part in parts.values():
+        part.sort(key=lambda a: order[a.id])
+    return parts
+
+
+def as_edges(graph, agent_attr=None):
+    """normalize an interaction graph to a dict of `(agent id, agent id) -> weight`.
+    `graph` may be such a dict, a list of `(agent id, agent id, weight)`,
+    or a networkx graph whose nodes are agents (or agent ids), or
+    whose nodes have the agents as the `agent_attr` attribute
+    (e.g. a grid with agents placed on it)"""
+    if isinstance(graph, dict):
+        return dict(graph)
+    if not hasattr(graph, 'edges'):
+        return {(u, v): w for u, v, w in graph}
+
+    def agent_id(node):
+        if agent_attr is not None:
+            data = graph.node[node] if hasattr(graph, 'node') else graph.nodes[node]
+            node = data.get(agent_attr)
+        return getattr(node, 'id', node)
+
+    edges = {}
+    for u, v, data in graph.edges(data=True):
+        u, v = agent_id(u), agent_id(v)
+        if u is None or v is None or u == v:
+            continue
+        edges[u, v] = edges.get((u, v), 0) + data.get('weight', 1)
+    return edges
+
+
+def _adjacency(weights, edges):
+    """undirected adjacency (node -> neighbor -> weight)
+    for the nodes in `weights`"""
+    adj = {n: {} for n in weights}
+    for (u, v), w in edges.items():
+        if u == v or u not in adj or v not in adj:
+            continue
+        adj[u][v] = adj[u].get(v, 0) + w
+        adj[v][u] = adj[v].get(u, 0) + w
+    return adj
+
+
+def cut(assign, edges):
+    """total weight of edges between parts"""
+    return sum(w for (u, v), w in edges.items()
+               if u in assign and v in assign and assign[u] != assign[v])
+
+
+def _limits(weights, capacities, tolerance):
+    """the maximum weight each part should have; at least
+    enough for the part's share to be reachable in whole nodes"""
+    total = sum(weights.values())
+    total_cap = sum(capacities.values())
+    heaviest = max(weights.values()) if weights else 0
+    limits = {}
+    for p, c in capacities.items():
+        share = total * c/total_cap
+        whole = math.ceil(share/heaviest) * heaviest if heaviest else share
+        limits[p] = max(share * (1 + tolerance), whole)
+    return limits
+
+
+def _match(weights, adj, max_weight):
+    """heavy-edge matching: pair each node with the unmatched neighbor
+    it has the heaviest edge to. returns node -> coarse node"""
+    match = {}
+    coarse = 0
+    for u in sorted(weights, key=lambda n: len(adj[n])):
+        if u in match:
+            continue
+        best, best_w = None, 0
+        for v, w in adj[u].items():
+            if v not in match and w > best_w and weights[u] + weights[v] <= max_weight:
+                best, best_w = v, w
+        match[u] = coarse
+        if best is not None:
+            match[best] = coarse
+        coarse += 1
+    return match
+
+
+def _contract(weights, adj, match):
+    """collapse matched nodes into coarse nodes"""
+    c_weights = {}
+    for n, c in match.items():
+        c_weights[c] = c_weights.get(c, 0) + weights[n]
+    c_adj = {c: {} for c in c_weights}
+    for u, nbrs in adj.items():
+        cu = match[u]
+        for v, w in nbrs.items():
+            cv = match[v]
+            if cu != cv:
+                c_adj[cu][cv] = c_adj[cu].get(cv, 0) + w
+    return c_weights, c_adj
+
+
+def _grow(weights, adj, capacities, limits):
+    """initial partition by growing parts breadth-first through the graph,
+    assigning each node to the part it is most connected to (if it fits)"""
+    assign = {}
+    loads = {p: 0 for p in capacities}
+    visited = set()
+    for root in sorted(weights, key=lambda n: -weights[n]):
+        if root in visited:
+            continue
+        visited.add(root)
+        queue = deque([root])
+        while queue:
+            n = queue.popleft()
+            conn = {}
+            for v, w in adj[n].items():
+                if v in assign:
+                    conn[assign[v]] = conn.get(assign[v], 0) + w
+            fits = [p for p in capacities if loads[p] + weights[n] <= limits[p]]
+            if fits:
+                p = max(fits, key=lambda p: (conn.get(p, 0), -loads[p]/capacities[p]))
+            else:
+                p = min(capacities, key=lambda p: (loads[p] + weights[n])/capacities[p])
+            assign[n] = p
+            loads[p] += weights[n]
+            for v in adj[n]:
+                if v not in visited:
+                    visited.add(v)
+                    queue.append(v)
+    return assign
+
+
+def _refine(assign, weights, adj, capacities, limits, passes):
+    """greedy k-way boundary refinement (in the spirit of Kernighan-Lin/
+    Fiduccia-Mattheyses): move nodes to the part they are most connected to,
+    if that reduces the cut and keeps parts within their limits.
+    moves blocked by the limits are paired up into swaps where possible.
+    nodes in overloaded parts are moved even if the cut increases"""
+    loads = {p: 0 for p in capacities}
+    for n, p in assign.items():
+        loads[p] += weights[n]
+
+    def connections(n):
+        conn = {}
+        for v, w in adj[n].items():
+            q = assign[v]
+            conn[q] = conn.get(q, 0) + w
+        return conn
+
+    def move(n, q):
+        loads[assign[n]] -= weights[n]
+        loads[q] += weights[n]
+        assign[n] = q
+
+    for _ in range(passes):
+        moved = 0
+        blocked = {}
+        for n in weights:
+            p = assign[n]
+            conn = connections(n)
+            overloaded = loads[p] > limits[p]
+            if not overloaded and not any(q != p for q in conn):
+                continue
+
+            best, best_gain = p, 0
+            candidates = capacities if overloaded else conn
+            for q in candidates:
+                if q == p:
+                    continue
+                gain = conn.get(q, 0) - conn.get(p, 0)
+                if loads[q] + weights[n] > limits[q]:
+                    if gain > 0:
+                        blocked.setdefault((p, q), []).append(n)
+                    continue
+                if best == p and overloaded or gain > best_gain:
+                    best, best_gain = q, gain
+            if best != p:
+                move(n, best)
+                moved += 1
+
+        # swap nodes which are blocked from moving into each other's parts
+        for (p, q), ns in list(blocked.items()):
+            ms = blocked.pop((q, p), None)
+            if not ms:
+                continue
+            for n in ns:
+                if assign[n] != p:
+                    continue
+                gain_n = connections(n)
+                gain_n = gain_n.get(q, 0) - gain_n.get(p, 0)
+                for m in ms:
+                    if assign[m] != q:
+                        continue
+                    gain_m = connections(m)
+                    gain_m = gain_m.get(p, 0) - gain_m.get(q, 0)
+                    delta = weights[m] - weights[n]
+                    if gain_n + gain_m - 2*adj[n].get(m, 0) > 0 \
+                            and loads[p] + delta <= limits[p] \
+                            and loads[q] - delta <= limits[q]:
+                        move(n, q)
+                        move(m, p)
+                        moved += 2
+                        break
+        if not moved:
+            break
+    return assign
+
+
+def _relabel(assign, initial, weights, capacities):
+    """rename parts (among those of equal capacity) so that as
+    much weight as possible stays in its initial part"""
+    overlap = {}
+    for n, p in assign.items():
+        q = initial.get(n)
+        if q in capacities:
+            overlap[p, q] = overlap.get((p, q), 0) + weights[n]
+    mapping, used = {}, set()
+    for (p, q), _ in sorted(overlap.items(), key=lambda i: -i[1]):
+        if p not in mapping and q not in used and capacities[p] == capacities[q]:
+            mapping[p] = q
+            used.add(q)
+    for p in capacities:
+        if p not in mapping:
+            q = next(q for q in capacities if q not in used and capacities[q] == capacities[p])
+            mapping[p] = q
+            used.add(q)
+    return {n: mapping[p] for n, p in assign.items()}
+
+
+def _multilevel(weights, adj, capacities, tolerance, passes):
+    # coarsen, without letting nodes get too heavy to balance
+    levels = []
+    max_weight = sum(weights.values())/(2 * len(capacities)) or 1
+    while len(weights) > 8 * len(capacities):
+        match = _match(weights, adj, max_weight)
+        if len(set(match.values())) > 0.9 * len(weights):
+            break
+        levels.append((weights, adj, match))
+        weights, adj = _contract(weights, adj, match)
+
+    limits = _limits(weights, capacities, tolerance)
+    assign = _grow(weights, adj, capacities, limits)
+    _refine(assign, weights, adj, capacities, limits, passes)
+    for weights, adj, match in reversed(levels):
+        assign = {n: assign[match[n]] for n in weights}
+        limits = _limits(weights, capacities, tolerance)
+        _refine(assign, weights, adj, capacities, limits, passes)
+    return assign
+
+
+def graph_partition(weights, capacities, edges, initial=None, tolerance=0.05, passes=8):
+    """k-way partition of a graph which minimizes the weight of
+    edges cut between parts, keeping parts balanced by capacity.
+    - weights: node -> weight (e.g. cost)
+    - capacities: part -> capacity
+    - edges: dict of `(node, node) -> weight`; edges are undirected
+    - initial: node -> part, to refine an existing partition rather than
+      partition from scratch (so few nodes move)
+    - tolerance: how far above their share of the total weight parts can go
+
+    from scratch, this is multilevel partitioning: the graph is coarsened
+    by repeatedly merging nodes along their heaviest edges, the coarsest
+    graph is partitioned, then the partition is projected back down
+    through the levels, refining it at each.
+
+    refinement can get stuck if the initial partition is poor,
+    so if partitioning from scratch cuts less, that is used instead
+    (with parts renamed so that as few nodes move as possible).
+    @returns dict of node -> part"""
+    if not capacities:
+        raise ValueError('no parts to partition across')
+    adj = _adjacency(weights, edges)
+    fresh = _multilevel(weights, adj, capacities, tolerance, passes)
+    if initial is None:
+        return fresh
+
+    assign = {}
+    loads = {p: 0 for p in capacities}
+    for n in weights:
+        p = initial.get(n)
+        if p in capacities:
+            assign[n] = p
+            loads[p] += weights[n]
+    for n in weights:
+        if n not in assign:
+            p = min(capacities, key=lambda p: (loads[p] + weights[n])/capacities[p])
+            assign[n] = p
+            loads[p] += weights[n]
+    limits = _limits(weights, capacities, tolerance)
+    _refine(assign, weights, adj, capacities, limits, passes)
+    if cut(fresh, edges) < cut(assign, edges):
+        return _relabel(fresh, initial, weights, capacities)
+    return assign
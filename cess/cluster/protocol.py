@@ -1,49 +1,247 @@
 import dill
 import pickle
+import struct
 import asyncio
 import logging
-from hashlib import md5
+from collections import Counter, OrderedDict
 
 logger = logging.getLogger('cluster')
-sentinel = md5(b'SENTINEL').hexdigest().encode() # eh what should this be
 
+# each frame is a fixed header followed by the payload.
+# the header holds the protocol version, the id of the codec
+# the payload was serialized with, a request id (so responses
+# can be matched to pipelined requests), and the payload length.
+# the version always comes first, and is bumped whenever the
+# header's layout changes, so mismatched peers are rejected:
+# 1: version, length; 2: adds the codec id; 3: adds the request id
+VERSION = 3
+header = struct.Struct('!BBII')
 
-def dumps(x):
-    """serialize python object(s)"""
+# payloads larger than this are read in chunks
+# into a preallocated buffer
+CHUNK_SIZE = 2**16
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Codec():
+    """a serializer that can be used for frame payloads.
+    `accepts` is a predicate for which objects the codec can
+    faithfully serialize; if it is `None` the codec accepts anything"""
+
+    def __init__(self, id, name, dumps, loads, accepts=None):
+        self.id = id
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self.accepts = accepts
+
+    def __repr__(self):
+        return 'Codec({})'.format(self.name)
+
+
+# id -> codec, name -> codec
+codecs = {}
+codec_names = OrderedDict()
+
+# codec name -> counts of frames and bytes sent/received
+stats = {}
+
+
+def register(id, name, dumps, loads, accepts=None):
+    """register a codec. codecs are tried in registration order,
+    the first one which accepts an object is used to serialize it"""
+    codec = Codec(id, name, dumps, loads, accepts)
+    codecs[id] = codec
+    codec_names[name] = codec
+    stats[name] = Counter()
+    return codec
+
+
+def codec_stats():
+    """returns per-codec counts of frames and bytes sent and received"""
+    return {name: dict(counts) for name, counts in stats.items()}
+
+
+_plain_types = (type(None), bool, int, float, complex, str, bytes)
+_plain_containers = (list, tuple, set, frozenset)
+
+
+def is_plain(x):
+    """whether or not an object consists only of primitive values
+    and builtin containers, i.e. can be handled without dill"""
+    typ = type(x)
+    if typ in _plain_types:
+        return True
+    elif typ in _plain_containers:
+        return all(is_plain(i) for i in x)
+    elif typ is dict:
+        return all(is_plain(k) and is_plain(v) for k, v in x.items())
+    return False
+
+
+# plain-data messages (e.g. most `call_agent` requests) are serialized
+# with stdlib pickle; dill is only used for payloads that need it,
+# e.g. agents or closures
+register(1, 'pickle',
+         lambda x: pickle.dumps(x, protocol=pickle.HIGHEST_PROTOCOL),
+         pickle.loads,
+         accepts=is_plain)
+register(2, 'dill',
+         lambda x: dill.dumps(x, protocol=pickle.HIGHEST_PROTOCOL),
+         dill.loads)
+
+
+def _select(x, names=None):
+    """select the first codec (of those named, if specified)
+    which accepts the object"""
+    if names is None:
+        candidates = codec_names.values()
+    else:
+        candidates = [codec_names[n] for n in names if n in codec_names]
+    for codec in candidates:
+        if codec.accepts is None or codec.accepts(x):
+            return codec
+    raise ProtocolError('no codec available for {}'.format(type(x)))
+
+
+def dumps(x, names=None):
+    """serialize python object(s), returning
+    the id of the codec used and the payload"""
     try:
-        return dill.dumps(x, protocol=pickle.HIGHEST_PROTOCOL)
+        codec = _select(x, names)
+        payload = codec.dumps(x)
     except Exception as e:
         logger.info("Failed to serialize %s", x)
         logger.exception(e)
         raise
+    counts = stats[codec.name]
+    counts['sent'] += 1
+    counts['bytes_sent'] += len(payload)
+    return codec.id, payload
 
 
-def loads(x):
+def loads(codec_id, x):
     """deserialize python object(s)"""
     try:
-        return dill.loads(x)
+        codec = codecs[codec_id]
+    except KeyError:
+        raise ProtocolError('unknown codec {}'.format(codec_id))
+    try:
+        msg = codec.loads(x)
     except Exception as e:
         logger.exception(e)
         raise
+    counts = stats[codec.name]
+    counts['received'] += 1
+    counts['bytes_received'] += len(x)
+    return msg
+
+
+def negotiate(names):
+    """the codecs, of those named by a peer, which are also available here"""
+    return [n for n in names if n in codec_names]
+
+
+def frame(codec_id, payload, request_id=0):
+    """build the header for a serialized payload"""
+    return header.pack(VERSION, codec_id, request_id, len(payload))
+
+
+def parse_header(data):
+    """returns the codec id, request id,
+    and payload length for a frame header"""
+    version, codec_id, request_id, length = header.unpack(data)
+    if version != VERSION:
+        raise ProtocolError('unsupported protocol version {}'.format(version))
+    return codec_id, request_id, length
+
+
+class Decoder():
+    """incremental frame decoder, for when data arrives
+    in arbitrary chunks (e.g. from a `asyncio.Protocol`).
+    each payload is written into a buffer preallocated
+    to its full length, so it is never copied into a growing buffer"""
+
+    def __init__(self):
+        self._header = bytearray()
+        self._codec = None
+        self._request_id = None
+        self._payload = None
+        self._view = None
+        self._pos = 0
+
+    def feed(self, data):
+        """feed received bytes, yielding any
+        completed messages as `(request_id, msg)`"""
+        data = memoryview(data)
+        while data:
+            if self._payload is None:
+                needed = header.size - len(self._header)
+                self._header += data[:needed]
+                data = data[needed:]
+                if len(self._header) < header.size:
+                    break
+                self._codec, self._request_id, length = parse_header(self._header)
+                self._header = bytearray()
+                self._payload = bytearray(length)
+                self._view = memoryview(self._payload)
+                self._pos = 0
+
+            n = min(len(self._payload) - self._pos, len(data))
+            self._view[self._pos:self._pos+n] = data[:n]
+            self._pos += n
+            data = data[n:]
+
+            if self._pos == len(self._payload):
+                payload = self._payload
+                self._view.release()
+                self._payload, self._view = None, None
+                yield self._request_id, loads(self._codec, payload)
+
+
+@asyncio.coroutine
+def _read_payload(stream, length):
+    """read a large payload in chunks, directly
+    into a buffer allocated to its full length"""
+    payload = bytearray(length)
+    view = memoryview(payload)
+    pos = 0
+    while pos < length:
+        chunk = yield from stream.read(min(CHUNK_SIZE, length - pos))
+        if not chunk:
+            raise asyncio.IncompleteReadError(bytes(view[:pos]), length)
+        view[pos:pos+len(chunk)] = chunk
+        pos += len(chunk)
+    view.release()
+    return payload
+
+
+@asyncio.coroutine
+def read_frame(stream):
+    """read a frame from a stream, returning `(request_id, msg)`"""
+    codec_id, request_id, length = parse_header((yield from stream.readexactly(header.size)))
+    if length <= CHUNK_SIZE:
+        payload = yield from stream.readexactly(length)
+    else:
+        payload = yield from _read_payload(stream, length)
+    return request_id, loads(codec_id, payload)
 
 
 @asyncio.coroutine
 def read(stream):
     """read data from a stream"""
-    # hack for `stream.readuntil`
-    buffer = b''
-    while True:
-        buffer += yield from stream.readexactly(1)
-        if buffer.endswith(sentinel):
-            break
-    msg = buffer[:-len(sentinel)]
-    msg = loads(msg)
+    _, msg = yield from read_frame(stream)
     return msg
 
 
 @asyncio.coroutine
-def write(stream, msg):
-    """write data to a stream"""
-    msg = dumps(msg)
-    yield stream.write(msg + sentinel)
-
+def write(stream, msg, codecs=None, request_id=0):
+    """write data to a stream, optionally
+    restricted to the specified codecs"""
+    codec_id, payload = dumps(msg, codecs)
+    stream.write(frame(codec_id, payload, request_id))
+    stream.write(payload)
+    yield from stream.drain()
@@ -0,0 +1,145 @@
+"""
+rebalancing agents across workers between steps.
+
+workers report how long each of their agents took to run (see
+`Worker.stats`) and how many calls each agent received from other
+workers. from these the rebalancer plans migrations which:
+
+- move (or swap) agents to the worker which calls them the most, to
+  cut cross-worker calls, as long as that doesn't overload the worker
+- move agents off the most loaded workers (relative to their
+  capacity) until the imbalance is within a threshold
+"""
+
+from collections import defaultdict, Counter, OrderedDict
+
+
+def imbalance(loads, capacities):
+    """how much the most loaded worker is above
+    the mean load (relative to capacity), e.g. 0.1 for 10%"""
+    total_cap = sum(capacities.values())
+    if not loads or not total_cap:
+        return 0
+    mean = sum(loads.values())/total_cap
+    if not mean:
+        return 0
+    return max(loads[w]/capacities[w] for w in loads)/mean - 1
+
+
+class Rebalancer():
+    def __init__(self, threshold=0.1, min_calls=10, max_moves=None):
+        """
+        - threshold: imbalance (see `imbalance`) tolerated before moving agents to balance load
+        - min_calls: minimum calls from another worker before moving an agent closer to its callers
+        - max_moves: maximum agents to move per rebalance
+        """
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.max_moves = max_moves
+
+    def plan(self, placements, capacities, costs, remote_calls):
+        """plan agent migrations.
+        - placements: agent id -> worker id
+        - capacities: worker id -> capacity (e.g. cores)
+        - costs: agent id -> measured cost (e.g. seconds)
+        - remote_calls: list of (agent id, calling worker id, number of calls)
+        @returns a report, with `moves` as a list of `(agent id, from worker, to worker, reason)`"""
+        placements = dict(placements)
+        loads = {w: 0 for w in capacities}
+        hosted = defaultdict(set)
+        for id, w in placements.items():
+            if w in loads:
+                loads[w] += costs.get(id, 0)
+                hosted[w].add(id)
+        before = imbalance(loads, capacities)
+
+        mean = sum(loads.values())/(sum(capacities.values()) or 1)
+        limit = mean * (1 + self.threshold)
+        moves = []
+
+        def move(id, to, reason):
+            frm = placements[id]
+            cost = costs.get(id, 0)
+            loads[frm] -= cost
+            loads[to] += cost
+            hosted[frm].remove(id)
+            hosted[to].add(id)
+            placements[id] = to
+            moves.append((id, frm, to, reason))
+
+        def unmove():
+            id, frm, to, _ = moves.pop()
+            cost = costs.get(id, 0)
+            loads[to] -= cost
+            loads[frm] += cost
+            hosted[to].remove(id)
+            hosted[frm].add(id)
+            placements[id] = frm
+
+        def can_move():
+            return self.max_moves is None or len(moves) < self.max_moves
+
+        def fits(w):
+            return loads[w]/capacities[w] <= limit
+
+        # move agents to the workers which call them the most
+        callers = defaultdict(Counter)
+        for id, source, n in remote_calls:
+            callers[id][source] += n
+        pending = OrderedDict()
+        for id, counts in sorted(callers.items(), key=lambda i: -sum(i[1].values())):
+            source, n = counts.most_common(1)[0]
+            if id not in placements or source not in capacities or source == placements[id]:
+                continue
+
+            # only if they outnumber calls from the agent's current worker
+            if n >= self.min_calls and n > counts.get(placements[id], 0):
+                pending[id] = source
+
+        while pending and can_move():
+            id, to = pending.popitem(last=False)
+            frm = placements[id]
+            move(id, to, 'locality')
+            if fits(to):
+                continue
+
+            # if that overloads the destination, try swapping
+            # with an agent which belongs on the source worker
+            swap = next((id_ for id_, to_ in pending.items()
+                         if to_ == frm and placements[id_] == to), None)
+            if swap is not None and can_move():
+                move(swap, frm, 'locality')
+                if fits(to) and fits(frm):
+                    del pending[swap]
+                    continue
+                unmove()
+            unmove()
+
+        # move agents from the most to the least loaded workers
+        moved = set(m[0] for m in moves)
+        while can_move() and len(loads) > 1:
+            rel = {w: loads[w]/capacities[w] for w in loads}
+            hi = max(rel, key=rel.get)
+            lo = min(rel, key=rel.get)
+            if rel[hi] <= limit:
+                break
+
+            # the agent which best evens out the two workers
+            best, best_peak = None, rel[hi]
+            for id in hosted[hi] - moved:
+                cost = costs.get(id, 0)
+                peak = max((loads[hi] - cost)/capacities[hi],
+                           (loads[lo] + cost)/capacities[lo])
+                if peak < best_peak:
+                    best, best_peak = id, peak
+            if best is None:
+                break
+            moved.add(best)
+            move(best, lo, 'load')
+
+        return {
+            'moves': moves,
+            'imbalance': before,
+            'expected_imbalance': imbalance(loads, capacities),
+            'loads': loads
+        }
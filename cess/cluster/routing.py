@@ -0,0 +1,83 @@
+import asyncio
+from .batch import Batcher
+from .client import Client
+
+
+class AgentMoved(Exception):
+    """raised when a directly-routed call reaches
+    a worker which no longer hosts the agent"""
+    pass
+
+
+class Router():
+    """routes agent calls directly to the worker hosting the agent,
+    using the agent placement published by the arbiter.
+    calls for agents without a known route go through the fallback
+    client (i.e. the arbiter), which always knows where agents are"""
+
+    def __init__(self, fallback, local_id=None, shared=False):
+        self.fallback = Batcher(fallback)
+
+        # whether direct connections to workers on
+        # the same host go over shared memory
+        self.shared = shared
+
+        # the id of the worker this router belongs to, if any
+        self.local_id = local_id
+
+        # agent id -> worker id
+        self.agents = {}
+
+        # worker id -> (host, port)
+        self.addresses = {}
+
+        # worker id -> batcher for a direct connection
+        self.peers = {}
+
+    def update(self, agents=None, workers=None, invalidate=None):
+        """update the routing table with agent placements
+        and worker addresses, and/or drop routes for agents"""
+        for id, addr in (workers or {}).items():
+            addr = tuple(addr)
+            if self.addresses.get(id) != addr:
+                self.addresses[id] = addr
+
+                # close the connection to the old address
+                peer = self.peers.pop(id, None)
+                if peer is not None:
+                    peer.client.close()
+        self.agents.update(agents or {})
+        for id in invalidate or []:
+            self.agents.pop(id, None)
+
+    def _peer(self, worker_id):
+        """get the batcher for a direct connection to a worker"""
+        try:
+            return self.peers[worker_id]
+        except KeyError:
+            host, port = self.addresses[worker_id]
+            peer = Batcher(Client(host, port, shared=self.shared))
+            self.peers[worker_id] = peer
+            return peer
+
+    @asyncio.coroutine
+    def call_agent(self, data):
+        """call a method on an agent, directly if possible"""
+        id = data['id']
+        worker_id = self.agents.get(id)
+
+        # tag calls with the calling worker, so they can be
+        # taken into account when rebalancing agents
+        if self.local_id is not None:
+            data = dict(data, source=self.local_id)
+        if worker_id is not None and worker_id != self.local_id and worker_id in self.addresses:
+            d = dict(data)
+            d['routed'] = True
+            try:
+                return (yield from self._peer(worker_id).submit(d))
+
+            # stale route (the agent migrated) or the peer is unreachable;
+            # the request was not run, so fall back to the arbiter
+            except (AgentMoved, ConnectionRefusedError):
+                self.update(invalidate=[id])
+        return (yield from self.fallback.submit(data))
@@ -1,6 +1,7 @@
+import asyncio
 import logging
-from . import protocol
-from asyncio import streams, coroutine, Task
+from . import protocol, shm, transport
+from asyncio import coroutine, Task, Lock
 
 logger = logging.getLogger(__name__)
 
@@ -8,6 +9,7 @@ logger = logging.getLogger(__name__)
 class Server():
     def __init__(self):
         self.server = None
+        self.address = None
 
         # task -> (reader, writer)
         self.clients = {}
@@ -28,19 +30,62 @@ class Server():
     @coroutine
     def _handle_client(self, client_reader, client_writer):
         """handle a client's request and serve it a response"""
-        while True:
-            try:
-                data = (yield from protocol.read(client_reader))
+        # codecs negotiated for this connection
+        codecs = None
+
+        # if the client pipelines requests, they are handled concurrently
+        # and responses are written as they complete
+        # (references to the tasks are kept so they aren't garbage collected)
+        pipeline = None
+        responding = set()
+
+        # the connection (and, if it was upgraded, its shared memory)
+        # is always released, however the client's handling ends
+        try:
+            while True:
+                request_id, data = (yield from protocol.read_frame(client_reader))
                 if not data: # an empty string means the client disconnected
-                    client_writer.close()
                     break
-                resp = yield from self.respond(data)
-                yield from protocol.write(client_writer, resp)
+                if data.get('cmd') == 'hello':
+                    codecs = protocol.negotiate(data['codecs'])
+                    if data.get('pipeline'):
+                        pipeline = Lock()
+                    resp = {'codecs': codecs}
+
+                    # upgrade to shared memory, if the client is on this host
+                    rings = shm.offer(data)
+                    if rings is not None:
+                        resp['shm'] = [r.name for r in rings]
+                        yield from protocol.write(client_writer, resp, codecs, request_id)
+                        channel = yield from shm.accept(client_reader, client_writer, rings)
+                        if channel is not None:
+                            client_reader = client_writer = channel
+                        continue
+                elif pipeline is not None:
+                    task = Task(self._respond_pipelined(client_writer, pipeline, request_id, data, codecs))
+                    responding.add(task)
+                    task.add_done_callback(responding.discard)
+                    continue
+                else:
+                    resp = yield from self.respond(data)
+                yield from protocol.write(client_writer, resp, codecs, request_id)
 
-            # disconnected
-            except EOFError:
-                client_writer.close()
-                break
+        # disconnected
+        except EOFError:
+            pass
+        except Exception:
+            logger.exception('error handling client, disconnecting it')
+        finally:
+            client_writer.close()
+
+    @coroutine
+    def _respond_pipelined(self, client_writer, lock, request_id, data, codecs):
+        resp = yield from self.respond(data)
+        yield from lock.acquire()
+        try:
+            yield from protocol.write(client_writer, resp, codecs, request_id)
+        finally:
+            lock.release()
 
     @coroutine
     def respond(self, data):
@@ -55,14 +100,23 @@ class Server():
 
     @coroutine
     def start(self, host, port):
-        """start the server"""
+        """start the server, on a TCP host and port,
+        or a unix domain socket (host `unix` and the socket's path)"""
         logger.info('started at {}:{}'.format(host, port))
-        self.server = yield from streams.start_server(self._accept_client, host, port, reuse_address=True)
+        self.server = yield from transport.start_server(self._accept_client, host, port)
+        self.address = (host, port)
 
     @coroutine
     def stop(self):
         """stop the server"""
         if self.server is not None:
             self.server.close()
+
+            # disconnect clients, and let their handlers clean up
+            for _, writer in self.clients.values():
+                writer.close()
+            if self.clients:
+                yield from asyncio.wait(list(self.clients))
             yield from self.server.wait_closed()
+            transport.cleanup(*self.address)
             self.server = None
@@ -0,0 +1,412 @@
+"""
+shared-memory transport for peers on the same host.
+
+connections are opened over a socket as usual. if both ends are on
+the same host, the connection is upgraded during the hello: the server
+creates a pair of ring buffers in shared memory (one per direction),
+the client attaches to them, and frames are from then on written into
+the ring buffers instead of the socket.
+
+a `Channel` has the same interface as the socket's reader and writer
+streams, so it can be used in their place (see `Connection.open` and
+`Server._handle_client`).
+
+each ring buffer has a single producer and a single consumer, so it
+needs no locks: only the producer advances the head, and only the
+consumer advances the tail. the positions aren't shared through the
+ring buffer, they're sent over the socket: after writing, the producer
+sends its new head, and after reading, the consumer sends its new tail
+(once half the ring buffer is free, or if the producer is waiting for
+space). each end only goes as far as the positions it was sent, so the
+socket orders the shared memory (data is always written before it's
+read, and read before it's overwritten, without relying on fences),
+and a peer waiting on a ring buffer can't miss being woken up.
+
+it's opt-in (`Client(..., shared=True)`, or `--shared` from the cli):
+- each connection allocates two ring buffers (`DEFAULT_CAPACITY` each),
+  so a full pool of connections can use a lot of shared memory.
+- each message still costs a small write to the socket, so this saves
+  copying large payloads through the socket, not latency on small ones.
+"""
+
+import socket
+import struct
+import asyncio
+import logging
+from collections import deque
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+logger = logging.getLogger('cluster')
+
+# a ring buffer starts with its capacity (in its own cache line),
+# followed by the data
+CONTROL_SIZE = 64
+
+# default size of each direction's ring buffer
+DEFAULT_CAPACITY = 2**20
+
+# what peers send each other over the socket: a tag and a position
+RECORD = struct.Struct('!cQ')
+
+# a ring buffer was written up to a head, or read up to a tail,
+# or the producer is waiting for space
+PUBLISHED, FREED, WAITING = b'h', b't', b'w'
+
+# names of shared memory created by this process
+_created = set()
+
+
+def available():
+    """whether shared memory is supported here"""
+    return shared_memory is not None
+
+
+def host_id():
+    """identifies this host (and boot), so peers
+    can tell if they are on the same host"""
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            boot = f.read().strip()
+    except OSError:
+        boot = ''
+    return '{}/{}'.format(socket.gethostname(), boot)
+
+
+class RingBuffer():
+    """a single-producer, single-consumer byte queue in shared memory.
+    each end tracks the head and tail itself; the producer learns
+    the tail, and the consumer the head, from the other end"""
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.capacity, = struct.unpack_from('Q', shm.buf)
+        self.data = shm.buf[CONTROL_SIZE:CONTROL_SIZE+self.capacity]
+        self.head = 0
+        self.tail = 0
+
+    @classmethod
+    def create(cls, capacity=DEFAULT_CAPACITY):
+        shm = shared_memory.SharedMemory(create=True, size=CONTROL_SIZE + capacity)
+        struct.pack_into('Q', shm.buf, 0, capacity)
+        _created.add(shm.name)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        shm = shared_memory.SharedMemory(name=name)
+
+        # attaching registers the memory with this process' resource tracker,
+        # which would unlink it when this process exits; that's up to its owner
+        if name not in _created:
+            try:
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            except Exception:
+                pass
+        return cls(shm)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def readable(self):
+        """bytes available to read"""
+        return self.head - self.tail
+
+    def writable(self):
+        """bytes of free space"""
+        return self.capacity - self.readable()
+
+    def write(self, data):
+        """write as much of `data` (a memoryview) as fits,
+        returning how many bytes were written"""
+        n = min(len(data), self.writable())
+        if n:
+            start = self.head % self.capacity
+            first = min(n, self.capacity - start)
+            self.data[start:start+first] = data[:first]
+            if first < n:
+                self.data[:n-first] = data[first:n]
+            self.head += n
+        return n
+
+    def read_into(self, view):
+        """read as many bytes as are available (up to the
+        length of `view`) into `view`, returning how many were read"""
+        n = min(len(view), self.readable())
+        if n:
+            start = self.tail % self.capacity
+            first = min(n, self.capacity - start)
+            view[:first] = self.data[start:start+first]
+            if first < n:
+                view[first:n] = self.data[:n-first]
+            self.tail += n
+        return n
+
+    def close(self):
+        self.data.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.shm.name)
+
+
+class Channel():
+    """a connection to a peer over a pair of ring buffers, with the
+    socket to the peer used to exchange their positions. it can be
+    used in place of both the reader and writer streams of the socket"""
+
+    def __init__(self, rx, tx, reader, writer):
+        self.rx = rx
+        self.tx = tx
+        self.reader = reader
+        self.writer = writer
+        self.transport = writer.transport
+        self.closed = False
+
+        # data which didn't fit in the ring buffer yet
+        self.pending = deque()
+
+        # the positions last sent to the peer, and whether
+        # the peer is waiting for space in `rx`
+        self._published = 0
+        self._freed = 0
+        self._peer_waiting = False
+
+        # bytes received from the peer which don't make up a whole record yet
+        self._received = bytearray()
+
+        # futures for coroutines waiting on the peer
+        self._eof = False
+        self._waiters = []
+
+        # the socket is watched directly, rather than through
+        # the reader stream, unless the event loop doesn't support that
+        self._sock = writer.get_extra_info('socket')
+        self._listener = None
+        try:
+            self.transport.pause_reading()
+            asyncio.get_event_loop().add_reader(self._sock.fileno(), self._on_ring)
+        except Exception:
+            self.transport.resume_reading()
+            self._listener = asyncio.Task(self._listen())
+
+    def _on_ring(self):
+        try:
+            data = self._sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if data:
+            self._receive(data)
+        else:
+            self._eof = True
+            asyncio.get_event_loop().remove_reader(self._sock.fileno())
+        self._wake()
+
+    @asyncio.coroutine
+    def _listen(self):
+        """handle whatever the peer sends"""
+        try:
+            while True:
+                data = yield from self.reader.read(4096)
+                if not data:
+                    break
+                self._receive(data)
+                self._wake()
+        except ConnectionError:
+            pass
+        finally:
+            self._eof = True
+            self._wake()
+
+    def _receive(self, data):
+        """update the ring buffers' positions from the peer's records"""
+        self._received += data
+        end = len(self._received) - len(self._received) % RECORD.size
+        for tag, pos in RECORD.iter_unpack(self._received[:end]):
+            if tag == PUBLISHED:
+                self.rx.head = pos
+            elif tag == FREED:
+                self.tx.tail = pos
+            elif tag == WAITING:
+                self._peer_waiting = True
+                self._free()
+        del self._received[:end]
+
+    def _wake(self):
+        waiters, self._waiters = self._waiters, []
+        for future in waiters:
+            if not future.done():
+                future.set_result(None)
+
+    def _send(self, tag, pos):
+        if not self.transport.is_closing():
+            self.writer.write(RECORD.pack(tag, pos))
+
+    def _publish(self):
+        """send the peer what's been written to `tx` since it was last told"""
+        if self.tx.head != self._published:
+            self._published = self.tx.head
+            self._send(PUBLISHED, self._published)
+
+    def _free(self):
+        """send the peer what's been read from `rx` since it was last told,
+        if it's waiting for space, or if it's half the ring buffer"""
+        freed = self.rx.tail - self._freed
+        if freed and (self._peer_waiting or freed >= self.rx.capacity//2):
+            self._freed = self.rx.tail
+            self._peer_waiting = False
+            self._send(FREED, self._freed)
+
+    @asyncio.coroutine
+    def _wait(self, ready):
+        """wait until `ready()`, returning false if the peer disconnected"""
+        while not ready():
+            if self._eof or self.transport.is_closing():
+                return False
+            future = asyncio.Future()
+            self._waiters.append(future)
+            yield from future
+            if self.closed:
+                raise ConnectionResetError('channel closed')
+        return True
+
+    def at_eof(self):
+        return self.closed or (self._eof and not self.rx.readable())
+
+    @asyncio.coroutine
+    def read(self, n=-1):
+        """read up to `n` bytes, waiting for at least one"""
+        if not (yield from self._wait(self.rx.readable)):
+            return b''
+        available = self.rx.readable()
+        buf = bytearray(available if n < 0 else min(n, available))
+        self.rx.read_into(memoryview(buf))
+        self._free()
+        return buf
+
+    @asyncio.coroutine
+    def readexactly(self, n):
+        """read exactly `n` bytes, straight into a buffer of that size"""
+        buf = bytearray(n)
+        view = memoryview(buf)
+        pos = 0
+        while pos < n:
+            if not (yield from self._wait(self.rx.readable)):
+                raise asyncio.IncompleteReadError(bytes(view[:pos]), n)
+            pos += self.rx.read_into(view[pos:])
+            self._free()
+        view.release()
+        return buf
+
+    def write(self, data):
+        """write data, as much as fits straight into the ring buffer.
+        the rest is written by `drain`, which also tells the peer
+        (so several writes followed by a drain only tell it once)"""
+        if self.closed:
+            raise ConnectionResetError('channel closed')
+        data = memoryview(data)
+        if not self.pending:
+            n = self.tx.write(data)
+            data = data[n:]
+        if data:
+            # keep a copy unless the data is immutable
+            self.pending.append(data if isinstance(data.obj, bytes) else bytes(data))
+
+    @asyncio.coroutine
+    def drain(self):
+        """wait until all written data is in the ring buffer"""
+        self._publish()
+        while self.pending:
+            if not self.tx.writable():
+                self._send(WAITING, self.tx.tail)
+            if not (yield from self._wait(self.tx.writable)):
+                raise ConnectionResetError('peer disconnected')
+            data = self.pending[0]
+            n = self.tx.write(data)
+            self._publish()
+            if n == len(data):
+                self.pending.popleft()
+            else:
+                self.pending[0] = data[n:]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._listener is None:
+            asyncio.get_event_loop().remove_reader(self._sock.fileno())
+        else:
+            self._listener.cancel()
+        self.writer.close()
+        self.pending.clear()
+        self.rx.close()
+        self.tx.close()
+
+
+def offer(data):
+    """server side of the upgrade: if the client offering shared memory
+    (in its hello `data`) is on this host, create ring buffers for it.
+    returns `(client->server, server->client)` ring buffers, or `None`"""
+    if not available() or data.get('shm') != host_id():
+        return None
+    try:
+        return RingBuffer.create(), RingBuffer.create()
+    except OSError:
+        logger.exception('could not create shared memory')
+        return None
+
+
+@asyncio.coroutine
+def accept(reader, writer, rings):
+    """server side of the upgrade, once the ring buffers are offered:
+    wait for the client to acknowledge attaching to them, and confirm
+    once the channel is listening (so nothing the client sends through
+    it is left in the reader stream). returns a channel, or `None`
+    to stay on the socket"""
+    try:
+        ack = yield from reader.readexactly(1)
+    except:
+        for ring in rings:
+            ring.close()
+        raise
+    if ack == b'\1':
+        channel = Channel(rings[0], rings[1], reader, writer)
+        writer.write(b'\1')
+        return channel
+    for ring in rings:
+        ring.close()
+    return None
+
+
+@asyncio.coroutine
+def attach(reader, writer, names):
+    """client side of the upgrade: attach to the ring buffers
+    the server offered (by name), acknowledge whether that worked,
+    and wait for the server to confirm.
+    returns a channel, or `None` to stay on the socket"""
+    rings = []
+    try:
+        for name in names:
+            rings.append(RingBuffer.attach(name))
+    except OSError:
+        logger.exception('could not attach to shared memory')
+        for ring in rings:
+            ring.close()
+        writer.write(b'\0')
+        return None
+    writer.write(b'\1')
+    try:
+        yield from reader.readexactly(1)
+    except:
+        for ring in rings:
+            ring.close()
+        raise
+    tx, rx = rings
+    return Channel(rx, tx, reader, writer)
@@ -0,0 +1,69 @@
+"""
+opening connections and starting servers over TCP or unix domain sockets.
+
+addresses are `(host, port)` everywhere. a unix domain socket is
+addressed with the host `unix` and the socket's path as the port,
+so it can be passed around (e.g. to the arbiter, or in routes)
+like any other address. as a string, it's written `unix:/path`.
+"""
+
+import os
+import stat
+import asyncio
+from asyncio import streams
+
+UNIX = 'unix'
+
+
+def parse(conn):
+    """parse `host:port` or `unix:/path` into an address"""
+    host, port = conn.split(':', 1)
+    if host == UNIX:
+        return host, port
+    return host, int(port)
+
+
+def is_unix(host):
+    return host == UNIX
+
+
+@asyncio.coroutine
+def open_connection(host, port):
+    """open a connection, returning its reader and writer streams"""
+    if is_unix(host):
+        return (yield from streams.open_unix_connection(port))
+    return (yield from streams.open_connection(host, port))
+
+
+@asyncio.coroutine
+def start_server(client_connected_cb, host, port):
+    """start a server listening on the address"""
+    if is_unix(host):
+        # a socket file left by a server which didn't stop cleanly
+        try:
+            if stat.S_ISSOCK(os.stat(port).st_mode):
+                os.remove(port)
+        except FileNotFoundError:
+            pass
+        return (yield from streams.start_unix_server(client_connected_cb, port))
+    return (yield from streams.start_server(client_connected_cb, host, port, reuse_address=True))
+
+
+def cleanup(host, port):
+    """remove a stopped server's socket file, if any"""
+    if is_unix(host):
+        try:
+            os.remove(port)
+        except FileNotFoundError:
+            pass
+
+
+def use_fast_loop():
+    """use uvloop's event loop, if it's installed.
+    returns whether or not it's used"""
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
@@ -1,42 +1,83 @@
+import time
 import logging
 import inspect
 import asyncio
 import traceback
+from collections import Counter, defaultdict
 from uuid import uuid4
 from .client import Client
 from .server import Server
+from .routing import Router, AgentMoved
+from .. import bsp, snapshot
 from ..agent import AgentProxy
+from ..agent.store import StateRow
 
 logger = logging.getLogger(__name__)
 
+# `asyncio.Task.current_task` was removed in later versions of python
+current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+
 
 class Worker(Server):
-    def __init__(self):
+    def __init__(self, shared=False):
+        """if `shared` is true, connections to the arbiter and
+        to workers on the same host go over shared memory (see `shm`)"""
+        self.shared = shared
         self.agents = {}
         self.arbiter = None
+        self.router = None
         super().__init__()
         self.handlers = {
             'populate': self.populate,
             'call_agent': self.call_agent,
             'call_agents': self.call_agents,
+            'call_agents_batch': self.call_agents_batch,
+            'routes': self.routes,
+            'collect': self.collect,
+            'stats': self.stats,
+            'release': self.release,
+            'adopt': self.adopt,
+            'superstep': self.superstep,
+            'snapshot': self.snapshot,
+            'publish_snapshot': self.publish_snapshot,
         }
         self.id = uuid4().hex
 
+        # agent id -> time spent running its calls,
+        # (agent id, worker id) -> calls to the agent from that worker, and
+        # (agent id, agent id) -> calls from one agent to another
+        self.timings = Counter()
+        self.remote_calls = Counter()
+        self.interactions = Counter()
+
+        # task -> id of the agent running in it;
+        # an agent's calls to other agents run in its task
+        self.running = {}
+
+        # agent id -> mail sent by agents on this worker, for the next superstep
+        self.mail = defaultdict(list)
+
+        # this worker's part of the current step's snapshot
+        self.captured = {}
+
     @asyncio.coroutine
-    def start(self, arbiter_host, arbiter_port, host='127.0.0.1', port=8899):
+    def start(self, arbiter_host, arbiter_port, host='127.0.0.1', port=8899, ncores=1):
         """start the worker, specifying the arbiter host/port
-        and host/port for the worker"""
+        and host/port for the worker. `ncores` is the worker's
+        capacity, relative to other workers"""
         yield from super().start(host, port)
-        self.arbiter = Client(arbiter_host, arbiter_port)
+        self.arbiter = Client(arbiter_host, arbiter_port, shared=self.shared)
+        self.router = Router(self.arbiter, local_id=self.id, shared=self.shared)
         try:
             yield from self.arbiter.send_recv({
                 'cmd': 'register',
                 'id': self.id,
                 'host': host,
                 'port': port,
+                'ncores': ncores,
                 'type': 'worker'})
         except ConnectionRefusedError:
-            logger.exception('could not connect to arbiter at {}:{}'.format(host, port))
+            logger.exception('could not connect to arbiter at {}:{}'.format(arbiter_host, arbiter_port))
             raise
 
     @asyncio.coroutine
@@ -47,6 +88,48 @@ class Worker(Server):
         self.agents = {a.id: a for a in data['agents']}
         return {'status': 'ok'}
 
+    @asyncio.coroutine
+    def collect(self, data):
+        """return this worker's agents"""
+        return {'status': 'ok', 'agents': list(self.agents.values())}
+
+    @asyncio.coroutine
+    def stats(self, data):
+        """agent timings and calls from other workers, since they were last reset"""
+        stats = {
+            'status': 'ok',
+            'timings': dict(self.timings),
+            'remote_calls': [(id, source, n) for (id, source), n in self.remote_calls.items()],
+            'interactions': [(caller, id, n) for (caller, id), n in self.interactions.items()]
+        }
+        if data.get('reset'):
+            self.timings.clear()
+            self.remote_calls.clear()
+            self.interactions.clear()
+        return stats
+
+    @asyncio.coroutine
+    def release(self, data):
+        """remove agents from this worker, returning them (to migrate them),
+        along with any mail waiting for them"""
+        agents, mail = [], {}
+        for id in data['ids']:
+            agent = self.agents.pop(id)
+            if isinstance(agent._state, StateRow):
+                agent._state = agent._state.store.remove(id)
+            self.timings.pop(id, None)
+            if id in self.mail:
+                mail[id] = self.mail.pop(id)
+            agents.append(agent)
+        return {'status': 'ok', 'agents': agents, 'mail': mail}
+
+    @asyncio.coroutine
+    def adopt(self, data):
+        """add (migrated) agents to this worker"""
+        for agent in data['agents']:
+            self.agents[agent.id] = agent
+        return {'status': 'ok'}
+
     @asyncio.coroutine
     def call_agents(self, data):
         """call a method on all agents"""
@@ -66,6 +149,71 @@ class Worker(Server):
             logger.exception(tb)
             return {'status': 'failed', 'exception': e, 'traceback': tb}
 
+    @asyncio.coroutine
+    def superstep(self, data):
+        """run a superstep of a bulk-synchronous simulation (see `cess.bsp`),
+        calling `func` (default `step`) on each agent with its inbox.
+        mail comes from agents on this worker and, exchanged by the arbiter,
+        from other workers. mail sent to agents on this worker is kept
+        for the next superstep, the rest is returned to the arbiter"""
+        mail, self.mail = self.mail, defaultdict(list)
+        for id, entries in data.get('mail', {}).items():
+            mail[id].extend(entries)
+        try:
+            inboxes = bsp.deliver(self.agents, mail)
+            yield from asyncio.gather(*[
+                self._step(id, data.get('func', 'step'), inboxes.get(id, []), data.get('args', ()))
+                for id in self.agents])
+        except Exception as e:
+            tb = traceback.format_exc()
+            logger.exception(e)
+            return {'status': 'failed', 'exception': e, 'traceback': tb}
+
+        remote = {}
+        for to, entries in bsp.collect(self.agents.values()).items():
+            for entry in entries:
+                self.interactions[entry[1], to] += 1
+            if to in self.agents:
+                self.mail[to].extend(entries)
+            else:
+                remote[to] = entries
+        return {'status': 'ok', 'mail': remote}
+
+    @asyncio.coroutine
+    def snapshot(self, data):
+        """capture the snapshot of this worker's agents
+        for the step (see `cess.snapshot`), and return it"""
+        self.captured = snapshot.capture(self.agents.values())
+        return {'status': 'ok', 'snapshot': self.captured}
+
+    @asyncio.coroutine
+    def publish_snapshot(self, data):
+        """publish the step's snapshot, with the
+        other workers' parts of it (in `snapshot`), or clear it if that's `None`"""
+        snap = data['snapshot']
+        if snap is None:
+            self.captured = {}
+            snapshot.clear()
+            return {'status': 'ok'}
+        snap.update(self.captured)
+        snapshot.publish(snap)
+        return {'status': 'ok'}
+
+    @asyncio.coroutine
+    def _step(self, id, func, inbox, args):
+        task = current_task()
+        self.running[task] = id
+        try:
+            start = time.perf_counter()
+            try:
+                result = getattr(self.agents[id], func)(inbox, *args)
+            finally:
+                self.timings[id] += time.perf_counter() - start
+            if inspect.isgenerator(result):
+                yield from self._timed(id, result)
+        finally:
+            del self.running[task]
+
     @asyncio.coroutine
     def call_agent(self, data):
         """call a method on an agent and get the result"""
@@ -73,15 +221,87 @@ class Worker(Server):
         d.update(data)
         id = d['id']
 
+        # record which agent (if any) is making the call
+        task = current_task()
+        caller = self.running.get(task)
+        if caller is not None:
+            self.interactions[caller, id] += 1
+
         # check locally
         if id in self.agents:
-            agent = self.agents[id]
-            result = getattr(agent, d['func'])(*d['args'], **d['kwargs'])
-            if inspect.isgenerator(result):
-                result = yield from result
+            source = d.get('source')
+            if source is not None and source != self.id:
+                self.remote_calls[id, source] += 1
+
+            self.running[task] = id
+            try:
+                start = time.perf_counter()
+                try:
+                    agent = self.agents[id]
+                    result = getattr(agent, d['func'])(*d['args'], **d['kwargs'])
+                finally:
+                    self.timings[id] += time.perf_counter() - start
+                if inspect.isgenerator(result):
+                    result = yield from self._timed(id, result)
+            finally:
+                if caller is None:
+                    del self.running[task]
+                else:
+                    self.running[task] = caller
             return result
 
-        # pass request to the arbiter
+        # a peer routed this directly, but the agent isn't here (anymore)
+        elif d.get('routed'):
+            raise AgentMoved(id)
+
+        # pass request directly to the agent's worker if its location
+        # is known, otherwise to the arbiter
         else:
             d['cmd'] = 'call_agent'
-            return (yield from self.arbiter.send_recv(d))
+            return (yield from self.router.call_agent(d))
+
+    def _timed(self, id, coro):
+        """run an agent's coroutine, timing it only while it runs,
+        i.e. not while it waits on other agents"""
+        value, exc = None, None
+        while True:
+            start = time.perf_counter()
+            try:
+                if exc is None:
+                    future = coro.send(value)
+                else:
+                    future = coro.throw(exc)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self.timings[id] += time.perf_counter() - start
+            try:
+                value, exc = (yield future), None
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as e:
+                value, exc = None, e
+
+    @asyncio.coroutine
+    def routes(self, data):
+        """update the routing table, as published by the arbiter"""
+        self.router.update(data.get('agents'), data.get('workers'), data.get('invalidate'))
+        return {'status': 'ok'}
+
+    @asyncio.coroutine
+    def call_agents_batch(self, data):
+        """call methods on a batch of agents, returning
+        a result (or failure) for each call"""
+        results = yield from asyncio.gather(*[self._try_call_agent(d) for d in data['requests']])
+        return {'status': 'ok', 'results': results}
+
+    @asyncio.coroutine
+    def _try_call_agent(self, data):
+        try:
+            result = yield from self.call_agent(data)
+            return {'status': 'ok', 'result': result}
+        except Exception as e:
+            tb = traceback.format_exc()
+            logger.exception(e)
+            return {'status': 'failed', 'exception': e, 'traceback': tb}
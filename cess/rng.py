@@ -0,0 +1,52 @@
+"""
+reproducible random number streams.
+
+streams are derived from a simulation seed and a key,
+e.g. `(AGENT, agent index, step)`, rather than drawn in sequence from
+one generator, so every agent gets the same numbers at every step
+regardless of which process it runs in or what order agents run in.
+"""
+
+import random
+import numpy as np
+
+# stream namespaces
+SIMULATION = 0
+AGENT = 1
+
+
+class Stream(random.Random):
+    """a random number stream for a `(seed, *key)`.
+    this has the stdlib `random.Random` interface,
+    plus `batch` for drawing many numbers at once"""
+
+    def __init__(self, seed, *key):
+        self.seed_ = seed
+        self.key = key
+        self.seq = np.random.SeedSequence(seed, spawn_key=key)
+        self._generator = None
+        super().__init__(int.from_bytes(self.seq.generate_state(4).tobytes(), 'little'))
+
+    @property
+    def generator(self):
+        """a numpy generator for this stream,
+        using the counter-based Philox bit generator"""
+        if self._generator is None:
+            self._generator = np.random.Generator(
+                np.random.Philox(self.seq.spawn(1)[0]))
+        return self._generator
+
+    def batch(self, n):
+        """`n` floats in [0, 1), as an array"""
+        return self.generator.random(n)
+
+    def __reduce__(self):
+        gen_state = self._generator.bit_generator.state if self._generator is not None else None
+        return (type(self), (self.seed_,) + self.key, (self.getstate(), gen_state))
+
+    def __setstate__(self, state):
+        random_state, gen_state = state
+        self.setstate(random_state)
+        if gen_state is not None:
+            self.generator.bit_generator.state = gen_state
+
@@ -1,41 +1,132 @@
+import random
 import asyncio
+import numpy as np
+from collections import defaultdict
+from . import bsp, snapshot
+from .rng import Stream, SIMULATION
 from .agent import AgentProxy
+from .agent.store import StateRow
 from .cluster import Cluster, proxy_agents
+from .cluster.local import LocalCluster
 
 
 class Simulation():
 
     
-    def __init__(self, agents):
-        """a agent-based simulation"""
+    def __init__(self, agents, seed=None, snapshot=False):
+        """a agent-based simulation.
+        if a `seed` is specified, the simulation (`self.rng`) and each agent
+        (`agent.rng`) get their own random number streams for each step,
+        so runs are reproducible, however agents are distributed.
+        if `snapshot` is true, agents' `snapshot_keys` are read from a
+        snapshot taken at the start of each step (see `cess.snapshot`)"""
         self.agents = agents
         self.is_done = False
+        self.seed = seed
+        self.snapshot = snapshot
+        self.timestep = 0
+        self.rng = random if seed is None else Stream(seed, SIMULATION, 0)
 
-    def run(self, steps, arbiter=None):
+        # the cluster the agents are distributed across, while running
+        self.cluster = None
+
+        # agents are keyed by their position
+        for i, agent in enumerate(agents):
+            agent.rng_key = i
+
+        # agent type -> columnar stores of agents of that type
+        self.stores = {}
+        for agent in agents:
+            state = getattr(agent, '_state', None)
+            if isinstance(state, StateRow):
+                stores = self.stores.setdefault(type(agent), [])
+                if state.store not in stores:
+                    stores.append(state.store)
+
+    def run(self, steps, arbiter=None, workers=None, rebalance=None, graph=None, agent_attr=None):
         """run the simulation for a specified number of time steps.
         if you specify a connection tuple for `arbiter`, e.g. `('127.0.0.1', 8888)`,
-        this will distribute the agents to the arbiter's cluster"""
+        this will distribute the agents to the arbiter's cluster.
+        if you instead specify a number of `workers`, the agents are
+        distributed across that many local processes for the run.
+        if distributed, agents are rebalanced across workers
+        every `rebalance` steps, if specified. if the agents'
+        interaction `graph` is known, they are initially placed
+        to minimize calls between workers (see `cluster.partition.as_edges`);
+        if the graph's nodes hold the agents (e.g. a grid), `agent_attr`
+        is the node attribute they're in"""
+        cluster = None
         if arbiter is not None:
+            host, port = arbiter
+            cluster = Cluster(host, port)
+        elif workers is not None:
+            cluster = LocalCluster(workers)
+
+        if cluster is not None:
             # distribute agents across cluster
             for agent in self.agents:
                 proxy_agents(agent)
+            cluster.populate(self.agents, graph=graph, agent_attr=agent_attr)
 
-            host, port = arbiter
-            cluster = Cluster(host, port)
-            cluster.submit('populate', agents=self.agents)
-
+            agents = self.agents
             _agents = []
             for agent in self.agents:
                 proxy = AgentProxy(agent)
                 proxy.worker = cluster
                 _agents.append(proxy)
             self.agents = _agents
+        self.cluster = cluster
 
         loop = asyncio.get_event_loop()
-        for _ in range(steps):
-            if self.is_done :
-                break
-            loop.run_until_complete(self.step())
+        try:
+            for _ in range(steps):
+                if self.is_done :
+                    break
+                self.reseed(cluster)
+                if self.snapshot:
+                    self.take_snapshot(cluster)
+                loop.run_until_complete(self.step())
+                self.timestep += 1
+                if cluster is not None and rebalance and self.timestep % rebalance == 0:
+                    loop.run_until_complete(cluster.rebalance())
+
+        # retrieve agents from local processes when done
+        finally:
+            self.cluster = None
+            if self.snapshot and cluster is not None:
+                loop.run_until_complete(cluster.snapshot(clear=True))
+            snapshot.clear()
+            if isinstance(cluster, LocalCluster):
+                collected = cluster.collect()
+                cluster.stop()
+                self.agents = [collected[a.id] for a in agents]
+
+                # collected agents come back detached from their stores
+                for agent in agents:
+                    state = getattr(agent, '_state', None)
+                    if isinstance(state, StateRow):
+                        state.store.adopt(collected[agent.id])
+
+    def reseed(self, cluster=None):
+        """switch the simulation and its agents
+        to their random number streams for the current step"""
+        if self.seed is None:
+            return
+        self.rng = Stream(self.seed, SIMULATION, self.timestep)
+        if cluster is not None:
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(cluster.call_agents('reseed', self.seed, self.timestep))
+        else:
+            for agent in self.agents:
+                agent.reseed(self.seed, self.timestep)
+
+    def take_snapshot(self, cluster=None):
+        """snapshot the agents' `snapshot_keys` for the current step"""
+        if cluster is not None:
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(cluster.snapshot())
+        else:
+            snapshot.publish(snapshot.capture(self.agents))
 
     @asyncio.coroutine
     def step(self):
@@ -47,3 +138,47 @@ class Simulation():
         loop = asyncio.get_event_loop()
         loop.run_until_complete(coro)
 
+    def _store(self, type=None):
+        """get the store for a type of agent,
+        or the only store if no type is specified"""
+        if type is None:
+            stores = set(s for ss in self.stores.values() for s in ss)
+        else:
+            stores = set(self.stores.get(type, []))
+        if len(stores) != 1:
+            raise ValueError('expected one agent store, found {}; specify an agent type'.format(len(stores)))
+        return stores.pop()
+
+    def read(self, key, type=None):
+        """read a state value for all agents in a store, as an array"""
+        return self._store(type).read(key)
+
+    def write(self, key, values, type=None):
+        """write a state value for all agents in a store"""
+        self._store(type).write(key, values)
+
+    def reduce(self, key, func=np.mean, type=None):
+        """reduce a state value over all agents in a store, e.g.
+        `sim.reduce('wage', type=Person)` for the mean wage"""
+        return self._store(type).reduce(key, func)
+
+
+class BSPSimulation(Simulation):
+    """a bulk-synchronous parallel simulation (see `cess.bsp`).
+    each step, every agent's `step(inbox)` runs wherever the agent is,
+    and the mail agents send is exchanged at the end of the step"""
+
+    def __init__(self, agents, seed=None, snapshot=False):
+        super().__init__(agents, seed=seed, snapshot=snapshot)
+
+        # agent id -> mail for the next step, when not distributed
+        self.mail = defaultdict(list)
+
+    @asyncio.coroutine
+    def step(self):
+        """run a superstep"""
+        if self.cluster is None:
+            agents = {agent.id: agent for agent in self.agents}
+            self.mail = yield from bsp.superstep(agents, self.mail)
+        else:
+            yield from self.cluster.superstep()
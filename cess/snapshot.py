@@ -0,0 +1,65 @@
+"""
+double-buffered snapshots of agent state.
+
+agents often read other agents' state (e.g. `supplier.get('price')`)
+when it can't change within a step. when distributed, each of those reads
+is a round trip. an agent class can declare the state keys others only
+need to read as of the start of the step, as `snapshot_keys`, e.g.:
+
+    class Firm(Agent):
+        snapshot_keys = ('price', 'supply')
+
+in a snapshot simulation (`Simulation(..., snapshot=True)`), those keys
+are captured at the start of each step (wherever the agents are) and,
+when distributed, replicated in bulk to every worker (see
+`Arbiter.snapshot`). for the rest of the step, `get` on an agent or an
+`AgentProxy` is served from the snapshot, without a round trip, if the
+keys are in it. the snapshot is immutable for the step: writes go to the
+agents' live state, which becomes the next step's snapshot. so reads
+don't depend on the order agents step in, or on where they are.
+
+snapshot values aren't copied: replace them (`agent['x'] = ...`)
+rather than mutating them in place.
+"""
+
+# returned by `lookup` for values which aren't in the snapshot
+MISSING = object()
+
+# the snapshot for the current step, as agent id -> {key: value}
+_current = None
+
+
+def capture(agents):
+    """snapshot the `snapshot_keys` of agents, as agent id -> {key: value}"""
+    return {agent.id: dict(zip(agent.snapshot_keys, agent[agent.snapshot_keys]))
+            for agent in agents if agent.snapshot_keys}
+
+
+def publish(snapshot):
+    """make `snapshot` the current step's snapshot in this process"""
+    global _current
+    _current = snapshot
+
+
+def clear():
+    publish(None)
+
+
+def current():
+    return _current
+
+
+def lookup(id, keys):
+    """get state values of an agent from the current snapshot,
+    as `Agent.get` returns them, or `MISSING` if they aren't all in it"""
+    if _current is None:
+        return MISSING
+    state = _current.get(id)
+    if state is None:
+        return MISSING
+    try:
+        if len(keys) == 1:
+            return state[keys[0]]
+        return [state[k] for k in keys]
+    except KeyError:
+        return MISSING
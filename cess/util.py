@@ -1,12 +1,30 @@
 import random
+import numpy as np
+from collections import OrderedDict
 
 
-def random_choice(choices):
+def uniforms(n, rng=random):
+    """`n` floats in [0, 1), as an array, drawn at once:
+    as a batch from a `Stream` or a numpy generator, or otherwise
+    from the bits of one `getrandbits` call (as `random.random` does)"""
+    if n <= 0:
+        return np.empty(0)
+    if hasattr(rng, 'batch'):
+        return rng.batch(n)
+    if isinstance(rng, np.random.Generator):
+        return rng.random(n)
+    if not hasattr(rng, 'getrandbits'):
+        return np.array([rng.random() for _ in range(n)])
+    bits = rng.getrandbits(64 * n).to_bytes(8 * n, 'little')
+    return (np.frombuffer(bits, dtype='<u8') >> 11) * 2.0**-53
+
+
+def random_choice(choices, rng=random):
     """returns a random choice
     from a list of (choice, probability)"""
     # sort by probability
     choices = sorted(choices, key=lambda x:x[1])
-    roll = random.random()
+    roll = rng.random()
 
     acc_prob = 0
     for choice, prob in choices:
@@ -15,8 +33,122 @@ def random_choice(choices):
             return choice
 
 
-def shuffle(l):
-    random.shuffle(l)
+def random_choice_many(choices, k, rng=random):
+    """returns `k` random choices (with replacement)
+    from a list of (choice, probability)"""
+    if not choices or k <= 0:
+        return []
+    items, probs = zip(*choices)
+    cum = np.cumsum(probs)
+    if cum[-1] <= 0:
+        raise ValueError('probabilities must not all be zero')
+    rolls = uniforms(k, rng) * cum[-1]
+    idx = np.searchsorted(cum, rolls, side='right')
+    return [items[min(i, len(items) - 1)] for i in idx]
+
+
+class Sampler():
+    """weighted sampling over a set of choices which supports
+    cheap weight updates and removals (e.g. of sold-out suppliers).
+    weights are kept in a binary indexed (Fenwick) tree,
+    so draws and updates are O(log n). many draws at once
+    use a cumulative sum of the weights, which is kept until
+    the weights are updated"""
+
+    def __init__(self, choices, rng=random):
+        """`choices` is a list of (choice, weight);
+        weights need not sum to 1"""
+        self.rng = rng
+        self.choices = []
+        self.weights = []
+        self.index = {}
+        for choice, weight in choices:
+            self.index[choice] = len(self.choices)
+            self.choices.append(choice)
+            self.weights.append(max(weight, 0))
+        self.total = sum(self.weights)
+        self.count = sum(1 for w in self.weights if w > 0)
+        self._cum = None
+        self._build()
+
+    def _build(self):
+        n = len(self.weights)
+        self.tree = [0] + list(self.weights)
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                self.tree[j] += self.tree[i]
+        self.top = 1
+        while self.top * 2 <= n:
+            self.top *= 2
+
+    def __len__(self):
+        """number of choices which can be drawn"""
+        return self.count
+
+    def _find(self, roll):
+        """index of the choice where the cumulative weight exceeds `roll`"""
+        i, mask = 0, self.top
+        while mask:
+            j = i + mask
+            if j < len(self.tree) and self.tree[j] <= roll:
+                i = j
+                roll -= self.tree[j]
+            mask //= 2
+
+        # guard against float error accumulated from updates
+        i = min(i, len(self.weights) - 1)
+        while i > 0 and self.weights[i] <= 0:
+            i -= 1
+        return i
+
+    def draw(self):
+        """draw a single choice"""
+        if not self.count:
+            raise IndexError('no choices left to draw from')
+        return self.choices[self._find(self.rng.random() * self.total)]
+
+    def draw_many(self, k):
+        """draw `k` choices (with replacement)"""
+        if not self.count:
+            raise IndexError('no choices left to draw from')
+
+        rolls = uniforms(k, self.rng)
+
+        # a few draws are cheaper from the tree than rebuilding the cumulative sum
+        if self._cum is None and k * self.top.bit_length() < len(self.weights):
+            return [self.choices[self._find(r * self.total)] for r in rolls.tolist()]
+
+        if self._cum is None:
+            self._cum = np.cumsum(self.weights)
+        cum = self._cum
+        idx = np.searchsorted(cum, rolls * cum[-1], side='right')
+        return [self.choices[i] for i in np.minimum(idx, len(cum) - 1).tolist()]
+
+    def update(self, choice, weight):
+        """change the weight of a choice"""
+        i = self.index[choice]
+        weight = max(weight, 0)
+        delta = weight - self.weights[i]
+        if self.weights[i] > 0:
+            self.count -= 1
+        if weight > 0:
+            self.count += 1
+        self.weights[i] = weight
+        self._cum = None
+        self.total = self.total + delta if self.count else 0
+        j = i + 1
+        while j < len(self.tree):
+            self.tree[j] += delta
+            j += j & -j
+
+    def remove(self, choice):
+        """stop drawing a choice"""
+        self.update(choice, 0)
+
+
+def shuffle(l, rng=random):
+    rng.shuffle(l)
     return l
 
 
@@ -28,3 +160,42 @@ def ewma(p_mean, val, alpha=0.8):
 def hyperbolic_discount(value, days, k):
     discount = 1/(1+days*k)
     return discount * value
+
+
+class LRUCache():
+    """a bounded mapping which evicts
+    its least-recently used entries"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        try:
+            val = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data[key] = val
+        self.hits += 1
+        return val
+
+    def set(self, key, val):
+        self.data.pop(key, None)
+        self.data[key] = val
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.data)}
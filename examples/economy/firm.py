@@ -1,5 +1,4 @@
 import math
-import random
 import asyncio
 import numpy as np
 from scipy import optimize
@@ -8,6 +7,10 @@ from cess.agent.learn import QLearner
 
 
 class Firm(Agent):
+    # firms run an optimization every step,
+    # so are much more expensive to run than people
+    load = 20
+
     def __init__(self, labor_cost_per_good, material_cost_per_good, labor_per_equipment, labor_per_worker, supply_increment, profit_increment, wage_increment):
         self._super(Firm, self).__init__(state={
             'desired_supply': 1,
@@ -80,7 +83,7 @@ class Firm(Agent):
     def hire(self, applicants, wage):
         hired = []
         while self['worker_change'] > 0 and applicants:
-            worker = random.choice(applicants)
+            worker = self.rng.choice(applicants)
             employer = yield from worker.get('employer')
             if employer is not None:
                 yield from employer.call('fire', worker)
@@ -209,6 +212,7 @@ class Firm(Agent):
         self['leftover'] = self['supply']
 
         # adjust production
+        self.learner.rng = self.rng
         action = self.learner.choose_action(self.curren)
         action = self.actions[action]
         self['desired_supply'] = max(1, self['desired_supply'] + action.get('supply', 0))
@@ -237,7 +241,7 @@ class Firm(Agent):
 
         # fire workers if necessary
         while self['worker_change'] < 0:
-            worker = random.choice(self['workers'])
+            worker = self.rng.choice(self['workers'])
             yield from self.fire(worker)
             self['worker_change'] += 1
 
@@ -1,11 +1,11 @@
 import math
 import asyncio
 from cess import Simulation
-from cess.util import shuffle, random_choice
+from cess.util import shuffle, random_choice_many, Sampler
 
 
 class EconomySim(Simulation):
-    def __init__(self, people, raw_material_firms, consumer_good_firms, capital_equipment_firms):
+    def __init__(self, people, raw_material_firms, consumer_good_firms, capital_equipment_firms, seed=None):
         self.people = people
         self.raw_material_firms = raw_material_firms
         self.consumer_good_firms = consumer_good_firms
@@ -15,11 +15,11 @@ class EconomySim(Simulation):
             'mean_wage': 10,
             'mean_equip_price': 10
         }
-        super().__init__(people + self.firms)
+        super().__init__(people + self.firms, seed=seed)
 
     @asyncio.coroutine
     def step(self):
-        tasks = [firm.call('set_production_target', self.state) for firm in shuffle(self.firms)]
+        tasks = [firm.call('set_production_target', self.state) for firm in shuffle(self.firms, self.rng)]
         jobs = yield from asyncio.gather(*tasks)
         jobs = list(zip(jobs, self.firms))
         yield from self.labor_market(jobs)
@@ -63,13 +63,14 @@ class EconomySim(Simulation):
         job_seekers = [p for p, e in zip(self.people, employers) if e is None]
         while job_seekers and jobs:
             job_dist = self.job_distribution(jobs)
-            for p in shuffle(job_seekers):
-                (n_vacancies, wage), firm  = random_choice(job_dist)
+            job_seekers = shuffle(job_seekers, self.rng)
+            for p, ((n_vacancies, wage), firm) in zip(job_seekers,
+                                                     random_choice_many(job_dist, len(job_seekers), self.rng)):
                 applicants[firm].append(p)
 
             # firms select from their applicants
             _jobs = []
-            for job in shuffle(jobs):
+            for job in shuffle(jobs, self.rng):
                 # filter down to valid applicants
                 (n_vacancies, wage), firm = job
                 apps = [a for a in applicants[firm] if a in job_seekers]
@@ -91,21 +92,22 @@ class EconomySim(Simulation):
     def market(self, sellers, buyers, purchase_func):
         sold = []
         seller_dist = yield from self.firm_distribution(sellers)
+        suppliers = Sampler(seller_dist, self.rng)
 
-        while buyers and seller_dist:
-            for buyer in shuffle(buyers):
-                supplier = random_choice(seller_dist)
+        while buyers and suppliers:
+            for buyer in shuffle(buyers, self.rng):
+                supplier = suppliers.draw()
                 required, purchased = yield from buyer.call(purchase_func, supplier)
                 supply, price = yield from supplier.get('supply', 'price')
                 sold.append((purchased, price))
                 if required == 0:
                     buyers.remove(buyer)
 
-                # if supplier sold out, update firm distribution
+                # if supplier sold out, stop drawing it
                 if supply == 0:
-                    seller_dist = yield from self.firm_distribution(sellers)
+                    suppliers.remove(supplier)
 
-                if not seller_dist:
+                if not suppliers:
                     break
         return sold
 
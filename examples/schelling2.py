@@ -22,8 +22,8 @@ class SchellingAgent(Agent):
 
 
 class SchellingSim(Simulation):
-    def __init__(self, agents, width, height):
-        super().__init__(agents)
+    def __init__(self, agents, width, height, seed=None):
+        super().__init__(agents, seed=seed)
 
         if len(agents) > width * height:
             raise Exception('there must be enough space for all agents')
@@ -35,7 +35,7 @@ class SchellingSim(Simulation):
 
         # place agents
         positions = self.space.nodes()
-        random.shuffle(positions)
+        self.rng.shuffle(positions)
         for agent in self.agents:
             pos = positions.pop()
             self.sync(self.place(agent, pos))
@@ -75,7 +75,7 @@ class SchellingSim(Simulation):
         satisfied = yield from self.compute_satisfaction(agent)
         if not satisfied:
             vacancies = [pos for pos, data in self.space.node.items() if data['agent'] is None]
-            pos = random.choice(vacancies)
+            pos = self.rng.choice(vacancies)
             yield from self.place(agent, pos)
         return (yield from self.compute_satisfaction(agent))
 
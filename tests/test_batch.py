@@ -0,0 +1,91 @@
+import asyncio
+import unittest
+from cess.cluster.arbiter import Arbiter
+from cess.cluster.batch import Batcher
+from tests import async
+
+
+class FakeClient():
+    def __init__(self):
+        self.sent = []
+
+    @asyncio.coroutine
+    def send_recv(self, data):
+        self.sent.append(data)
+        results = []
+        for d in data['requests']:
+            if d['func'] == 'fail':
+                results.append({'status': 'failed', 'exception': ValueError(d['id'])})
+            else:
+                results.append({'status': 'ok', 'result': d['id'] * 2})
+        return {'status': 'ok', 'results': results}
+
+
+class FailingClient():
+    @asyncio.coroutine
+    def send_recv(self, data):
+        return {'status': 'failed', 'exception': RuntimeError('worker failed'), 'traceback': 'tb'}
+
+
+class DisconnectedClient():
+    @asyncio.coroutine
+    def send_recv(self, data):
+        raise ConnectionResetError('worker disconnected')
+
+
+class BatcherTests(unittest.TestCase):
+    @async
+    def test_coalesces_same_tick(self):
+        client = FakeClient()
+        batcher = Batcher(client)
+        results = yield from asyncio.gather(*[
+            batcher.submit({'id': i, 'func': 'get'}) for i in range(10)])
+        self.assertEqual(results, [i * 2 for i in range(10)])
+        self.assertEqual(len(client.sent), 1)
+        self.assertEqual(client.sent[0]['cmd'], 'call_agents_batch')
+
+    @async
+    def test_failures(self):
+        client = FakeClient()
+        batcher = Batcher(client)
+        ok = batcher.submit({'id': 1, 'func': 'get'})
+        failed = batcher.submit({'id': 2, 'func': 'fail'})
+        with self.assertRaises(ValueError):
+            yield from failed
+        result = yield from ok
+        self.assertEqual(result, 2)
+
+    @async
+    def test_arbiter_worker_failure(self):
+        arbiter = Arbiter()
+        arbiter.workers = {'a': FakeClient(), 'b': FailingClient()}
+        arbiter.agents = {1: 'a', 2: 'b', 3: 'b'}
+        resp = yield from arbiter.call_agents_batch({'requests': [
+            {'id': i, 'func': 'get'} for i in (1, 2, 3, 4)]})
+        results = resp['results']
+        self.assertEqual(results[0], {'status': 'ok', 'result': 2})
+
+        # every call in the failed worker's batch fails with its exception
+        for result in results[1:3]:
+            self.assertEqual(result['status'], 'failed')
+            self.assertIsInstance(result['exception'], RuntimeError)
+            self.assertEqual(result['traceback'], 'tb')
+        self.assertIsInstance(results[3]['exception'], KeyError)
+
+    @async
+    def test_arbiter_worker_disconnected(self):
+        arbiter = Arbiter()
+        arbiter.workers = {'a': FakeClient(), 'b': DisconnectedClient()}
+        arbiter.agents = {1: 'a', 2: 'b', 3: 'a'}
+        resp = yield from arbiter.call_agents_batch({'requests': [
+            {'id': i, 'func': 'get'} for i in (1, 2, 3)]})
+        results = resp['results']
+
+        # only the calls routed to the unreachable worker fail
+        self.assertEqual(results[0], {'status': 'ok', 'result': 2})
+        self.assertEqual(results[2], {'status': 'ok', 'result': 6})
+        self.assertEqual(results[1]['status'], 'failed')
+        self.assertIsInstance(results[1]['exception'], ConnectionResetError)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from cess import BSPSimulation
+from cess.agent import Agent
+
+
+class GossipAgent(Agent):
+    def __init__(self, val):
+        self._super(GossipAgent, self).__init__(state={'val': val, 'heard': [], 'steps': 0})
+        self.neighbors = []
+
+    def step(self, inbox):
+        self['heard'] = [msg for _, msg in inbox]
+        self['steps'] += 1
+        for n in self.neighbors:
+            self.send(n, self['val'])
+        self.write(self.neighbors[0], last=self['val'])
+
+
+def ring(n):
+    agents = [GossipAgent(i) for i in range(n)]
+    for i, agent in enumerate(agents):
+        agent.neighbors = [agents[(i+1) % n].id, agents[(i-1) % n].id]
+    return agents
+
+
+class BSPTests(unittest.TestCase):
+    def test_local(self):
+        n = 6
+        sim = BSPSimulation(ring(n))
+        sim.run(1)
+
+        # mail is only delivered at the next step
+        self.assertTrue(all(a['heard'] == [] for a in sim.agents))
+        sim.run(1)
+        for i, agent in enumerate(sim.agents):
+            self.assertEqual(sorted(agent['heard']), sorted([(i+1) % n, (i-1) % n]))
+            self.assertEqual(agent['last'], (i-1) % n)
+
+    def test_distributed(self):
+        n = 6
+        local = BSPSimulation(ring(n))
+        local.run(3)
+
+        sim = BSPSimulation(ring(n))
+        sim.run(3, workers=2)
+        for a, b in zip(local.agents, sim.agents):
+            self.assertEqual(b['steps'], 3)
+
+            # inboxes are in the same order, however agents are distributed
+            self.assertEqual(a['heard'], b['heard'])
+            self.assertEqual(a['last'], b['last'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import asyncio
+import unittest
+from cess.cluster.client import Pool, Client, PipelinedConnection
+from cess.cluster.server import Server
+from tests import async
+
+
+class FakeConnection():
+    def __init__(self):
+        self.closed = False
+        self.last_used = asyncio.get_event_loop().time()
+
+    def healthy(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class DelayServer(Server):
+    def __init__(self):
+        super().__init__()
+        self.handlers = {'delay': self.delay}
+
+    @asyncio.coroutine
+    def delay(self, data):
+        yield from asyncio.sleep(data['delay'])
+        return {'val': data['val']}
+
+
+class PoolTests(unittest.TestCase):
+    @asyncio.coroutine
+    def _connect(self):
+        return FakeConnection()
+
+    @async
+    def test_bounded(self):
+        pool = Pool(self._connect, max_size=2)
+        a = yield from pool.acquire()
+        b = yield from pool.acquire()
+        self.assertEqual(pool.stats()['in_use'], 2)
+
+        # pool is full, so this has to wait for a release
+        waiting = asyncio.Task(pool.acquire())
+        yield from asyncio.sleep(0)
+        self.assertFalse(waiting.done())
+
+        pool.release(a)
+        c = yield from waiting
+        self.assertIs(c, a)
+
+        stats = pool.stats()
+        self.assertEqual(stats['connects'], 2)
+        self.assertEqual(stats['waits'], 1)
+        pool.release(b)
+        pool.release(c)
+        self.assertEqual(pool.stats()['idle'], 2)
+
+    @async
+    def test_evicts_dead_and_idle(self):
+        pool = Pool(self._connect, max_size=2, idle_timeout=60)
+        a = yield from pool.acquire()
+        b = yield from pool.acquire()
+        pool.release(a)
+        pool.release(b)
+
+        a.closed = True
+        b.last_used -= 120
+        c = yield from pool.acquire()
+        self.assertNotIn(c, (a, b))
+        self.assertEqual(pool.stats()['evictions'], 2)
+
+    @async
+    def test_discard(self):
+        pool = Pool(self._connect, max_size=1)
+        a = yield from pool.acquire()
+        pool.release(a, discard=True)
+        self.assertTrue(a.closed)
+        b = yield from pool.acquire()
+        self.assertIsNot(a, b)
+
+    @async
+    def test_connect_failure_wakes_waiter(self):
+        connecting = asyncio.Future()
+
+        @asyncio.coroutine
+        def connect():
+            if not connecting.done():
+                connecting.set_result(None)
+                yield from asyncio.sleep(0.01)
+                raise ConnectionRefusedError
+            return FakeConnection()
+
+        pool = Pool(connect, max_size=1)
+        failing = asyncio.Task(pool.acquire())
+        yield from connecting
+
+        # the pool is full while connecting, so this waits
+        waiting = asyncio.Task(pool.acquire())
+        yield from asyncio.sleep(0)
+        self.assertFalse(waiting.done())
+
+        with self.assertRaises(ConnectionRefusedError):
+            yield from failing
+        conn = yield from asyncio.wait_for(waiting, 1)
+        self.assertIsInstance(conn, FakeConnection)
+        self.assertEqual(pool.stats()['waits'], 1)
+
+
+class PipelineTests(unittest.TestCase):
+    @async
+    def test_pipelined_requests(self):
+        server = DelayServer()
+        yield from server.start('127.0.0.1', 8986)
+        client = Client('127.0.0.1', 8986, pipeline=True, shared=False)
+        try:
+            # later requests finish first, so responses arrive out of order
+            n = 5
+            resps = yield from asyncio.gather(*[
+                client.send_recv({'cmd': 'delay', 'val': i, 'delay': (n-i) * 0.01})
+                for i in range(n)])
+            self.assertEqual([r['val'] for r in resps], list(range(n)))
+
+            # all over one connection
+            conn = client.pool.idle[0]
+            self.assertIsInstance(conn, PipelinedConnection)
+            self.assertEqual(conn.uses, n)
+            self.assertEqual(client.stats()['connects'], 1)
+            self.assertFalse(conn.pending)
+        finally:
+            client.close()
+            yield from server.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,24 +1,27 @@
+import random
 import unittest
+import numpy as np
 from cess.agent import learn
 
 
+states_actions = {
+    1: [0,1],
+    2: [0,1],
+    3: [-1, -2]
+}
+rewards = {
+    1: 1,
+    2: 0,
+    3: 10
+}
+
+
+def succ(state, action):
+    return state + action
+
+
 class LearningTests(unittest.TestCase):
     def test_qlearning(self):
-        # coding states and actions as integers
-        states_actions = {
-            1: [0,1],
-            2: [0,1],
-            3: [-1, -2]
-        }
-        rewards = {
-            1: 1,
-            2: 0,
-            3: 10
-        }
-
-        def succ(state, action):
-            return state + action
-
         learner = learn.QLearner(states_actions, rewards, explore=0.2)
 
         # all values should be initialized to 0
@@ -36,5 +39,75 @@ class LearningTests(unittest.TestCase):
             for a, v in actions.items():
                 self.assertNotEqual(v, 0)
 
+    def test_update(self):
+        learner = learn.QLearner(states_actions, rewards, discount=0.5, learning_rate=0.5)
+        self.assertEqual(learner.choose_action(1), 0)
+        learner.Q[1][1] = 2.
+        self.assertEqual(learner.choose_action(1), 1)
+
+        # Q(s, a) += lr * (r + discount * max Q(s') - Q(s, a))
+        self.assertEqual(learner.Q[1][0], 0.5 * (1 + 0.5 * 2))
+        learner.choose_action(2)
+        self.assertEqual(learner.Q[1][1], 2 + 0.5 * (0 + 0.5 * 0 - 2))
+
+        learner = learn.QLearner(states_actions, rewards, dtype=np.float32)
+        self.assertEqual(learner.q.dtype, np.float32)
+
+    def test_pool(self):
+        n = 50
+        pool = learn.QLearnerPool(n, states_actions, rewards, explore=0.2, rng=random.Random(0))
+        learners = [learn.QLearner(states_actions, rewards) for _ in range(n)]
+        states = [1 + i % 3 for i in range(n)]
+        for _ in range(100):
+            actions = pool.choose_actions(states)
+            for i, learner in enumerate(learners):
+                # replay the pool's actions on independent learners
+                learner._learn(states[i])
+                learner.prev = (states[i], actions[i])
+            states = [succ(s, a) for s, a in zip(states, actions)]
+
+        # the same Q-values as learning separately
+        for i, learner in enumerate(learners):
+            self.assertTrue(np.allclose(pool.Q[i], learner.q))
+            self.assertEqual(dict(pool.learner_Q(i)[3]), dict(learner.Q[3]))
+        self.assertEqual(pool.best_actions([3] * n),
+                         [learner._best_action(3) for learner in learners])
+
+    def test_replay(self):
+        # replaying only the last transition is plain Q-learning
+        learner = learn.QLearner(states_actions, rewards, explore=0.2, rng=random.Random(0))
+        replay = learn.ReplayQLearner(states_actions, rewards, memory=1, batch_size=1,
+                                      explore=0.2, rng=random.Random(0))
+        state = 1
+        for _ in range(50):
+            replay.prev = learner.prev
+            action = learner.choose_action(state)
+            replay._learn(state)
+            state = succ(state, action)
+        self.assertTrue(np.allclose(learner.q, replay.q))
+
+        replay = learn.ReplayQLearner(states_actions, rewards, memory=8, explore=0.2)
+        state = 1
+        for _ in range(20):
+            state = succ(state, replay.choose_action(state))
+        self.assertEqual(replay.size, 8)
+        self.assertTrue(all(t['state'] in range(3) for t in replay.transitions))
+
+    def test_qlambda(self):
+        chain = {1: [1], 2: [1], 3: [1], 4: [0]}
+        reward = {1: 0, 2: 0, 3: 0, 4: 10}
+
+        # with no traces, only the last transition learns
+        learner = learn.QLambdaLearner(chain, reward, trace_decay=0.)
+        for state in [1, 2, 3, 4]:
+            learner.choose_action(state)
+        self.assertEqual([learner.Q[s][1] for s in [1, 2, 3]], [0, 0, 5])
+
+        # otherwise, the reward propagates back along the path
+        learner = learn.QLambdaLearner(chain, reward, trace_decay=1.)
+        for state in [1, 2, 3, 4]:
+            learner.choose_action(state)
+        self.assertEqual([learner.Q[s][1] for s in [1, 2, 3]], [1.25, 2.5, 5])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,159 @@
+import asyncio
+import unittest
+from cess import Simulation
+from cess.agent import AgentProxy
+from cess.cluster import proxy_agents
+from cess.cluster.local import LocalCluster
+from tests import TestAgent
+
+
+class NeighborAgent(TestAgent):
+    def sum_neighbors(self, neighbors):
+        total = 0
+        for n in neighbors:
+            total += (yield from n.get('val'))
+        self['total'] = total
+        return total
+
+
+class NeighborSim(Simulation):
+    def __init__(self, agents):
+        super().__init__(agents)
+        n = len(agents)
+        self.neighbors = [[AgentProxy(agents[(i+1) % n]), AgentProxy(agents[(i-1) % n])] for i in range(n)]
+        self.results = None
+
+    @asyncio.coroutine
+    def step(self):
+        self.results = yield from asyncio.gather(*[
+            agent.call('sum_neighbors', neighbors)
+            for agent, neighbors in zip(self.agents, self.neighbors)])
+
+
+class RandomAgent(TestAgent):
+    def roll(self):
+        self['rolls'] = self.get_rolls() + [self.rng.random()]
+
+    def get_rolls(self):
+        return self._state.get('rolls', [])
+
+
+class RandomSim(Simulation):
+    @asyncio.coroutine
+    def step(self):
+        yield from asyncio.gather(*[agent.call('roll') for agent in self.agents])
+
+
+class LocalClusterTests(unittest.TestCase):
+    def test_run_workers(self):
+        n = 20
+        agents = [NeighborAgent(state={'val': i}) for i in range(n)]
+        ids = [a.id for a in agents]
+        sim = NeighborSim(agents)
+        sim.run(2, workers=3)
+
+        expected = [((i+1) % n) + ((i-1) % n) for i in range(n)]
+        self.assertEqual(sim.results, expected)
+
+        # agents are retrieved from the worker processes afterwards
+        self.assertEqual([a.id for a in sim.agents], ids)
+        self.assertEqual([a['total'] for a in sim.agents], expected)
+
+    def test_seeded_runs(self):
+        def run(workers):
+            agents = [RandomAgent() for _ in range(10)]
+            sim = RandomSim(agents, seed=42)
+            sim.run(3, workers=workers)
+            return [a['rolls'] for a in sim.agents]
+
+        # the same regardless of how agents are distributed
+        rolls = run(None)
+        self.assertEqual(run(2), rolls)
+        self.assertEqual(run(3), rolls)
+        self.assertEqual(len(set(r for rs in rolls for r in rs)), 30)
+
+    def test_rebalance(self):
+        n = 8
+        agents = [NeighborAgent(state={'val': i}) for i in range(n)]
+        slow_ids = set(a.id for a in agents[:4])
+
+        # put all the slow agents on one worker
+        groups = {id: 'slow' for id in slow_ids}
+        sim = NeighborSim(agents)
+        for agent in agents:
+            proxy_agents(agent)
+        cluster = LocalCluster(2)
+        cluster.populate(agents, groups=groups)
+        sim.agents = [AgentProxy(a) for a in agents]
+        for proxy in sim.agents:
+            proxy.worker = cluster
+
+        # the slow agents take 10x as long to run as the rest
+        collect_stats = cluster.collect_stats
+        @asyncio.coroutine
+        def stats():
+            _, remote_calls = yield from collect_stats()
+            return {a.id: 0.01 if a.id in slow_ids else 0.001 for a in agents}, remote_calls
+        cluster.collect_stats = stats
+
+        loop = asyncio.get_event_loop()
+        try:
+            loop.run_until_complete(sim.step())
+            slow = cluster.agents[agents[0].id]
+            placements = dict(cluster.agents)
+
+            report = loop.run_until_complete(cluster.rebalance(dry_run=True))
+            self.assertTrue(report['moves'])
+            for id, frm, _, _ in report['moves']:
+                self.assertIn(id, slow_ids)
+                self.assertEqual(frm, slow)
+            self.assertEqual(cluster.agents, placements)
+
+            loop.run_until_complete(sim.step())
+            report = loop.run_until_complete(cluster.rebalance())
+            self.assertTrue(report['moves'])
+            self.assertTrue(report['expected_imbalance'] < report['imbalance'])
+            self.assertNotEqual(cluster.agents, placements)
+
+            # calls still reach migrated agents
+            loop.run_until_complete(sim.step())
+            expected = [((i+1) % n) + ((i-1) % n) for i in range(n)]
+            self.assertEqual(sim.results, expected)
+        finally:
+            cluster.stop()
+
+    def test_repartition(self):
+        n = 8
+        agents = [NeighborAgent(state={'val': i}) for i in range(n)]
+
+        # interleave neighbors across workers, so every call is remote
+        groups = {a.id: i % 2 for i, a in enumerate(agents)}
+        sim = NeighborSim(agents)
+        for agent in agents:
+            proxy_agents(agent)
+        cluster = LocalCluster(2)
+        cluster.populate(agents, groups=groups)
+        sim.agents = [AgentProxy(a) for a in agents]
+        for proxy in sim.agents:
+            proxy.worker = cluster
+
+        loop = asyncio.get_event_loop()
+        try:
+            loop.run_until_complete(sim.step())
+            report = loop.run_until_complete(cluster.repartition())
+            self.assertEqual(report['cut'], 2*n)
+            self.assertTrue(report['expected_cut'] <= n)
+
+            # neighbors are now mostly on the same worker
+            placements = [cluster.agents[a.id] for a in agents]
+            changes = sum(placements[i] != placements[i-1] for i in range(n))
+            self.assertTrue(changes <= n/2)
+
+            loop.run_until_complete(sim.step())
+            expected = [((i+1) % n) + ((i-1) % n) for i in range(n)]
+            self.assertEqual(sim.results, expected)
+        finally:
+            cluster.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+import multiprocessing
+from cess.cli import n_workers
+from cess.cluster.arbiter import Arbiter
+from cess.cluster.client import Client
+from tests import async
+
+
+class NodeTests(unittest.TestCase):
+    def test_n_workers(self):
+        cpus = multiprocessing.cpu_count()
+        self.assertEqual(n_workers(0), cpus)
+        self.assertEqual(n_workers(1), 1)
+        self.assertEqual(n_workers(cpus + 1), cpus)
+        self.assertEqual(n_workers(-1), max(1, cpus - 1))
+        self.assertEqual(n_workers(-cpus), 1)
+
+    @async
+    def test_heartbeat(self):
+        arbiter = Arbiter()
+        arbiter.workers = {'a': Client('127.0.0.1', 8999)}
+        arbiter.ncores = {'a': 2}
+        arbiter.agents = {'x': 'a', 'y': 'a'}
+
+        yield from arbiter.heartbeat({'node': 'n', 'workers': {'a': True}})
+        self.assertIn('n', arbiter.nodes)
+        self.assertIn('a', arbiter.workers)
+
+        # exited workers are deregistered, along with their agents
+        yield from arbiter.heartbeat({'node': 'n', 'workers': {'a': False, 'b': True}})
+        self.assertEqual(arbiter.workers, {})
+        self.assertEqual(arbiter.ncores, {})
+        self.assertEqual(arbiter.agents, {})
+
+if __name__ == '__main__':
+    unittest.main()
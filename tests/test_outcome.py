@@ -1,5 +1,7 @@
 import unittest
-from cess.agent import outcome
+from enum import Enum
+from cess.agent import outcome, Action
+from cess.agent.state import State
 
 
 class OutcomeTests(unittest.TestCase):
@@ -30,6 +32,14 @@ class OutcomeTests(unittest.TestCase):
         exp_state = outcome.expected_state(state, updates, dist)
         self.assertEqual(exp_state, {'cash': 1500})
 
+    def test_expected_state_overlay(self):
+        state = State({'cash': 0, 'food': 3})
+        updates = [{'cash': 1000}, {'cash': 2000}]
+        dist = [0.5, 0.5]
+        exp_state = outcome.expected_state(state, updates, dist)
+        self.assertIsInstance(exp_state, State)
+        self.assertEqual(exp_state, {'cash': 1500, 'food': 3})
+
     def test_states(self):
         state = {'cash': 100}
         updates = [{'cash': 1000}, {'cash': 2000}]
@@ -40,6 +50,50 @@ class OutcomeTests(unittest.TestCase):
             [({'cash': 1100}, 0.8), ({'cash': 2100}, 0.2)]
         )
 
+    def test_missing_mass(self):
+        state = {'cash': 0}
+        updates = [{'cash': 1000}]
+        dist = [0.5]
+        for _ in range(3):
+            self.assertEqual(outcome.expected_state(state, updates, dist), {'cash': 500})
+            self.assertEqual(list(outcome.update_dist(state, updates, dist)),
+                             [({'cash': 1000}, 0.5), ({}, 0.5)])
+
+        # the caller's lists aren't modified
+        self.assertEqual(updates, [{'cash': 1000}])
+        self.assertEqual(dist, [0.5])
+
+    def test_outcome_table(self):
+        class Mood(Enum):
+            happy = 0
+            sad = 1
+
+        state = {'cash': 10, 'rate': 0.5, 'mood': Mood.sad, 'food': 2}
+        updates = [{'cash': 1.5, 'mood': lambda s: Mood.happy},
+                   {'cash': -3, 'rate': lambda s: s['rate'] * 2},
+                   {'food': 1}]
+        table = outcome.OutcomeTable(updates, [0.6, 0.2, 0.1])
+        expected = {
+            # ints are truncated in each outcome, as with `update_state`
+            'cash': 0.6*11 + 0.2*7 + 0.2*10,
+            'rate': 0.8*0.5 + 0.2*1.0,
+            'mood': Mood.happy,
+            'food': 0.9*2 + 0.1*3
+        }
+        exp_state = table.expected_state(state)
+        self.assertEqual(exp_state.keys(), expected.keys())
+        for k, v in expected.items():
+            self.assertAlmostEqual(exp_state[k], v)
+
+        # only the probabilities are computed for each state
+        action = Action('spend', {}, ([{'cash': -2}], lambda s: [0.5 if s['cash'] > 5 else 1.]))
+        self.assertEqual(action.expected_state({'cash': 10}), {'cash': 9})
+        self.assertEqual(action.expected_state({'cash': 4}), {'cash': 2})
+        table = action._table
+        action.expected_state({'cash': 1})
+        self.assertIs(action._table, table)
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,97 @@
+import unittest
+import networkx as nx
+from cess.agent import Agent
+from cess.cluster.partition import partition, graph_partition, as_edges, cut
+
+
+class HeavyAgent(Agent):
+    load = 10
+
+
+class PartitionTests(unittest.TestCase):
+    def test_balances_costs(self):
+        agents = [HeavyAgent() for _ in range(2)] + [Agent() for _ in range(20)]
+        parts = partition(agents, {'a': 1, 'b': 1})
+        self.assertEqual(sorted(len(p) for p in parts.values()), [11, 11])
+        for part in parts.values():
+            self.assertEqual(sum(a.load for a in part), 20)
+
+    def test_capacities(self):
+        agents = [Agent() for _ in range(30)]
+        parts = partition(agents, {'a': 1, 'b': 2})
+        self.assertEqual(len(parts['a']), 10)
+        self.assertEqual(len(parts['b']), 20)
+
+        # agents keep their original order
+        self.assertEqual(parts['b'], [a for a in agents if a in parts['b']])
+
+    def test_measured_costs(self):
+        agents = [Agent() for _ in range(4)]
+        costs = {agents[0].id: 3}
+        parts = partition(agents, {'a': 1, 'b': 1}, costs=costs)
+        self.assertIn(parts['a'], [[agents[0]], agents[1:]])
+
+    def test_affinity_groups(self):
+        agents = [Agent() for _ in range(8)]
+        groups = {a.id: i % 2 for i, a in enumerate(agents[:6])}
+        parts = partition(agents, {'a': 1, 'b': 1, 'c': 1}, groups=groups)
+        for part in parts.values():
+            keys = set(groups.get(a.id) for a in part) - {None}
+            self.assertTrue(len(keys) <= 1)
+        placed = [a for part in parts.values() for a in part]
+        self.assertEqual(sorted(a.id for a in placed), sorted(a.id for a in agents))
+
+    def test_graph_partition(self):
+        # a 10x10 grid
+        n = 10
+        weights = {(i, j): 1 for i in range(n) for j in range(n)}
+        edges = {}
+        for i, j in weights:
+            if i + 1 < n:
+                edges[(i, j), (i+1, j)] = 1
+            if j + 1 < n:
+                edges[(i, j), (i, j+1)] = 1
+        assign = graph_partition(weights, {'a': 1, 'b': 1}, edges)
+        self.assertEqual(sorted(assign), sorted(weights))
+        self.assertTrue(45 <= list(assign.values()).count('a') <= 55)
+
+        # roughly a straight cut through the grid
+        self.assertTrue(cut(assign, edges) <= 2*n)
+
+    def test_graph_partition_refines(self):
+        # two cliques joined by one edge, initially interleaved
+        weights = {i: 1 for i in range(8)}
+        edges = {(u, v): 1 for u in range(4) for v in range(u+1, 4)}
+        edges.update({(u, v): 1 for u in range(4, 8) for v in range(u+1, 8)})
+        edges[3, 4] = 1
+        initial = {i: 'ab'[i % 2] for i in weights}
+        assign = graph_partition(weights, {'a': 1, 'b': 1}, edges, initial=initial)
+        self.assertEqual(cut(assign, edges), 1)
+
+    def test_partition_edges(self):
+        agents = [Agent() for _ in range(12)]
+        edges = as_edges([(a.id, b.id, 1) for a, b in zip(agents, agents[1:])])
+        parts = partition(agents, {'a': 1, 'b': 1, 'c': 1}, edges=edges)
+        self.assertEqual([len(p) for p in parts.values()], [4, 4, 4])
+        assign = {a.id: w for w, part in parts.items() for a in part}
+        self.assertEqual(cut(assign, edges), 2)
+
+    def test_partition_grid(self):
+        # agents placed on a grid, as node attributes
+        grid = nx.grid_2d_graph(4, 4)
+        agents = [Agent() for _ in range(16)]
+        for agent, pos in zip(agents, grid.nodes()):
+            grid.nodes[pos]['agent'] = agent
+
+        edges = as_edges(grid, agent_attr='agent')
+        self.assertEqual(len(edges), 24)
+        parts = partition(agents, {'a': 1, 'b': 1}, edges=edges)
+        assign = {a.id: w for w, part in parts.items() for a in part}
+        self.assertEqual(cut(assign, edges), 4)
+
+        # the grid's positions aren't agents
+        with self.assertRaises(ValueError):
+            partition(agents, {'a': 1, 'b': 1}, edges=as_edges(grid))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ import asyncio
 import unittest
 import operator
 from cess.agent import PlanningAgent, Action, Goal, Prereq
+from cess.agent.state import State
 
 
 class ActionTests(unittest.TestCase):
@@ -73,5 +74,63 @@ class PlanningAgentTests(unittest.TestCase):
         # returned plan should not contain unsatisfiable actions
         self.assertEqual(plan, expected_plan)
 
+    def test_subplan(self):
+        utility_funcs = {
+            'cash': lambda x: x
+        }
+        action = Action('work', {}, ([{'cash': 100}, {'cash': 50}], [0.5, 0.5]))
+        goal = Goal('money', {'cash': Prereq(operator.ge, 200)}, ([{'cash': 1000}], [1.]))
+        agent = PlanningAgent({'cash':0}, [action], [goal], utility_funcs)
+
+        path = agent.subplan({'cash': 0}, goal)
+        self.assertEqual([a for a, _ in path], [None, action, action, action])
+        self.assertTrue(goal.satisfied(path[-1][1][0]))
+
+    def test_planning_cache(self):
+        utility_funcs = {
+            'cash': lambda x: x
+        }
+        action = Action('work', {}, ([{'cash': 100}, {'cash': 50}], [0.5, 0.5]))
+        goal = Goal('money', {'cash': Prereq(operator.ge, 200)}, ([{'cash': 1000}], [1.]))
+        agent = PlanningAgent({'cash':0}, [action], [goal], utility_funcs)
+
+        succs = agent.successors({'cash': 0}, agent.goals)
+        stats = agent.cache_stats()
+        self.assertEqual(stats['expected_state']['misses'], 1)
+
+        # the same state again should be served from the cache
+        self.assertEqual(agent.successors({'cash': 0}, agent.goals), succs)
+        stats = agent.cache_stats()
+        self.assertEqual(stats['expected_state']['hits'], 1)
+        self.assertEqual(stats['goals_utility']['hits'], 1)
+
+        # states are keyed by their contents, as `State`s or dicts
+        agent.successors(State({'cash': 0}).set('cash', 0), agent.goals)
+        self.assertEqual(agent.cache_stats()['expected_state']['hits'], 2)
+
+        # changing actions invalidates the cache
+        agent.actions = [action]
+        self.assertEqual(agent.cache_stats()['expected_state']['size'], 0)
+
+    def test_planning_prereqs(self):
+        utility_funcs = {
+            'cash': lambda x: x
+        }
+        work = Action('work', {}, ([{'cash': 100}], [1.]))
+        hire = Action('hire help', {'cash': Prereq(operator.ge, 200)}, ([{'cash': 1000}], [1.]))
+        rest = Action('rest', {'energy': Prereq(operator.lt, 5)}, ([{'energy': 10}], [1.]))
+        agent = PlanningAgent({'cash': 0, 'energy': 0}, [work, hire, rest], set(), utility_funcs)
+
+        # successors' actions are rechecked from their parent's,
+        # and the same as checking them on their own
+        state = State({'cash': 100, 'energy': 0})
+        for act, node in agent.successors(state, set()):
+            self.assertEqual(agent._satisfied_actions(node[0]),
+                             [a.satisfied(node[0]) for a in agent.actions])
+            for a in agent.actions:
+                self.assertEqual(agent._valid_func((a, node), (act, node)), a.satisfied(node[0]))
+        self.assertGreater(agent.cache_stats()['prereqs']['hits'], 0)
+
+
 if __name__ == '__main__':
     unittest.main()
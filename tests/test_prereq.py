@@ -1,6 +1,9 @@
+import random
 import unittest
 import operator
-from cess.agent.prereq import Prereq, distance_to_prereqs
+from cess.agent import Action
+from cess.agent.prereq import Prereq, distance_to_prereqs, compile_prereq, compile_prereqs, \
+    check, satisfied_batch, PrereqIndex
 
 
 class PrereqTests(unittest.TestCase):
@@ -71,5 +74,62 @@ class PrereqTests(unittest.TestCase):
         state = {'sup': 6}
         self.assertTrue(distance_to_prereqs(state, prereqs) > 0.0)
 
+    def test_intervals(self):
+        prereq = (Prereq(operator.lt, 5) | Prereq(operator.gt, 10)) & Prereq(operator.le, 12)
+        self.assertEqual(prereq.intervals(), [(None, False, 5, False), (10, False, 12, True)])
+        self.assertEqual((Prereq(operator.gt, 5) & Prereq(operator.lt, 5)).intervals(), [])
+        self.assertIsNone((Prereq(operator.ne, 5) & Prereq(operator.lt, 5)).intervals())
+
+        # plain callables aren't made of intervals
+        odd = lambda v: v % 2 == 1
+        self.assertIsNone((Prereq(operator.gt, 5) & odd).intervals())
+        self.assertIsNone((Prereq(operator.gt, 5) | odd).intervals())
+        test, intervals = compile_prereq(Prereq(operator.gt, 5) & odd)
+        self.assertIsNone(intervals)
+        self.assertTrue(test(7))
+        self.assertFalse(test(8))
+
+    def test_compiled(self):
+        rng = random.Random(0)
+        comparators = [operator.lt, operator.le, operator.gt, operator.ge, operator.eq, operator.ne]
+
+        def make(depth):
+            if depth == 0 or rng.random() < 0.3:
+                return Prereq(rng.choice(comparators), rng.randint(0, 10))
+            if rng.random() < 0.5:
+                return make(depth - 1) & make(depth - 1)
+            return make(depth - 1) | make(depth - 1)
+
+        # compiled prereqs are satisfied by the same values
+        for _ in range(200):
+            prereq = make(3)
+            test, _ = compile_prereq(prereq)
+            for val in [None, -1, 0, 2.5, 5, 7, 10, 11]:
+                self.assertEqual(bool(test(val)), bool(prereq(val)))
+
+            prereqs = {'a': prereq, 'b': make(2)}
+            program = compile_prereqs(prereqs)
+            states = [{'a': rng.randint(-1, 11), 'b': rng.choice([None, rng.random() * 12])}
+                      for _ in range(20)] + [{'a': 1}]
+            expected = [all(k in s and p(s[k]) for k, p in prereqs.items()) for s in states]
+            self.assertEqual([check(program, s) for s in states], expected)
+            self.assertEqual(list(satisfied_batch(program, states)), expected)
+
+    def test_index(self):
+        work = Action('work', {'energy': Prereq(operator.ge, 10)}, None)
+        shop = Action('shop', {'cash': Prereq(operator.gt, 0),
+                               'energy': Prereq(operator.ge, 2)}, None)
+        rest = Action('rest', {}, None)
+        index = PrereqIndex([work, shop, rest])
+        self.assertEqual(index.index, {'energy': [0, 1], 'cash': [1]})
+
+        state = {'energy': 20, 'cash': 0}
+        satisfied = index.check(state)
+        self.assertEqual(satisfied, [True, False, True])
+
+        state['cash'] = 5
+        self.assertEqual(index.recheck(state, ['cash'], satisfied), [True, True, True])
+        self.assertEqual(index.satisfied({'energy': 5, 'cash': 5}), [shop, rest])
+
 if __name__ == '__main__':
     unittest.main()
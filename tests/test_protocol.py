@@ -0,0 +1,78 @@
+import struct
+import asyncio
+import unittest
+from hashlib import md5
+from cess.cluster import protocol
+from tests import async
+
+
+class ProtocolTests(unittest.TestCase):
+    def _encode(self, msg):
+        codec_id, payload = protocol.dumps(msg)
+        return protocol.frame(codec_id, payload) + payload
+
+    def test_codec_selection(self):
+        plain = {'cmd': 'call_agent', 'id': 'abc', 'args': (1, 2.5, None), 'kwargs': {}}
+        codec_id, _ = protocol.dumps(plain)
+        self.assertEqual(protocol.codecs[codec_id].name, 'pickle')
+
+        closure = {'cmd': 'call_agents', 'args': [lambda x: x]}
+        codec_id, payload = protocol.dumps(closure)
+        self.assertEqual(protocol.codecs[codec_id].name, 'dill')
+        self.assertEqual(protocol.loads(codec_id, payload)['args'][0](5), 5)
+
+        # restricted to negotiated codecs
+        codec_id, _ = protocol.dumps(plain, ['dill'])
+        self.assertEqual(protocol.codecs[codec_id].name, 'dill')
+        with self.assertRaises(protocol.ProtocolError):
+            protocol.dumps(closure, ['pickle'])
+
+    def test_codec_stats(self):
+        before = protocol.codec_stats()['pickle'].get('sent', 0)
+        protocol.dumps({'cmd': 'foo'})
+        after = protocol.codec_stats()['pickle']['sent']
+        self.assertEqual(after, before + 1)
+
+    def test_decoder_chunked(self):
+        msgs = [{'cmd': 'call_agent', 'id': 'abc', 'args': [1, 2]}, list(range(1000))]
+        data = b''.join(self._encode(m) for m in msgs)
+
+        decoder = protocol.Decoder()
+        results = []
+        for i in range(0, len(data), 7):
+            results.extend(msg for _, msg in decoder.feed(data[i:i+7]))
+        self.assertEqual(results, msgs)
+
+    def test_bad_version(self):
+        decoder = protocol.Decoder()
+        data = protocol.header.pack(protocol.VERSION + 1, 1, 0, 0)
+        with self.assertRaises(protocol.ProtocolError):
+            list(decoder.feed(data))
+
+        # a frame from a peer with an older header layout
+        decoder = protocol.Decoder()
+        data = struct.pack('!BI', 1, 0) + struct.pack('!BI', 1, 0)
+        with self.assertRaises(protocol.ProtocolError):
+            list(decoder.feed(data))
+
+    @async
+    def test_read(self):
+        # payloads which contain the old sentinel bytes,
+        # and which are larger than a single chunk
+        sentinel = md5(b'SENTINEL').hexdigest().encode()
+        msgs = [{'data': sentinel}, b'x' * (protocol.CHUNK_SIZE * 3)]
+
+        reader = asyncio.StreamReader()
+        for m in msgs:
+            reader.feed_data(self._encode(m))
+        reader.feed_eof()
+
+        for m in msgs:
+            result = yield from protocol.read(reader)
+            self.assertEqual(result, m)
+
+        with self.assertRaises(EOFError):
+            yield from protocol.read(reader)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from cess.cluster.rebalance import Rebalancer, imbalance
+
+
+class RebalancerTests(unittest.TestCase):
+    def test_balances_load(self):
+        placements = {'a': 0, 'b': 0, 'c': 0, 'd': 1}
+        costs = {'a': 1., 'b': 1., 'c': 1., 'd': 1.}
+        report = Rebalancer().plan(placements, {0: 1, 1: 1}, costs, [])
+        self.assertEqual(report['imbalance'], 0.5)
+        self.assertEqual(report['expected_imbalance'], 0)
+        self.assertEqual(len(report['moves']), 1)
+        _, frm, to, reason = report['moves'][0]
+        self.assertEqual((frm, to, reason), (0, 1, 'load'))
+
+    def test_within_threshold(self):
+        placements = {'a': 0, 'b': 1}
+        costs = {'a': 1.05, 'b': 1.}
+        report = Rebalancer(threshold=0.1).plan(placements, {0: 1, 1: 1}, costs, [])
+        self.assertEqual(report['moves'], [])
+
+    def test_locality(self):
+        placements = {'a': 0, 'b': 1, 'c': 1, 'd': 0}
+        costs = {'a': 1., 'b': 1., 'c': 1., 'd': 1.}
+        remote_calls = [('a', 1, 20), ('c', 0, 20), ('d', 1, 5)]
+        report = Rebalancer(min_calls=10).plan(placements, {0: 1, 1: 1}, costs, remote_calls)
+        moves = {id: (frm, to) for id, frm, to, _ in report['moves']}
+        self.assertEqual(moves, {'a': (0, 1), 'c': (1, 0)})
+
+    def test_imbalance(self):
+        self.assertEqual(imbalance({0: 2., 1: 2.}, {0: 1, 1: 1}), 0)
+        self.assertEqual(imbalance({0: 4., 1: 2.}, {0: 2, 1: 1}), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import asyncio
+import unittest
+from collections import Counter
+from cess.agent import AgentProxy
+from cess.cluster.arbiter import Arbiter
+from cess.cluster.worker import Worker
+from cess.cluster.batch import Batcher
+from cess.cluster.routing import Router
+from tests import TestAgent, async
+
+
+class FakeClient():
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    @asyncio.coroutine
+    def send_recv(self, data):
+        self.sent.append(data)
+        return {'status': 'ok', 'results': [
+            {'status': 'ok', 'result': d['id']} for d in data['requests']]}
+
+
+class RouterTests(unittest.TestCase):
+    def test_update(self):
+        router = Router(FakeClient(), local_id='a')
+        router.update(agents={'x': 'b', 'y': 'c'}, workers={'b': ('127.0.0.1', 1), 'c': ('127.0.0.1', 2)})
+        self.assertEqual(router.agents, {'x': 'b', 'y': 'c'})
+        self.assertEqual(router.addresses['b'], ('127.0.0.1', 1))
+
+        # a worker's cached connection is closed and dropped when its address changes
+        b, c = Batcher(FakeClient()), Batcher(FakeClient())
+        router.peers.update({'b': b, 'c': c})
+        router.update(workers={'b': ('127.0.0.1', 3), 'c': ['127.0.0.1', 2]})
+        self.assertNotIn('b', router.peers)
+        self.assertIn('c', router.peers)
+        self.assertTrue(b.client.closed)
+        self.assertFalse(c.client.closed)
+
+        router.update(invalidate=['x', 'z'])
+        self.assertEqual(router.agents, {'y': 'c'})
+
+    @async
+    def test_lookup(self):
+        fallback, peer = FakeClient(), FakeClient()
+        router = Router(fallback, local_id='a')
+        router.update(agents={'x': 'b', 'y': 'a'}, workers={'b': ('127.0.0.1', 1)})
+        router.peers['b'] = Batcher(peer)
+
+        # known remote agents are called directly, others through the fallback
+        self.assertEqual((yield from router.call_agent({'id': 'x'})), 'x')
+        self.assertEqual((yield from router.call_agent({'id': 'z'})), 'z')
+        self.assertEqual([d['requests'][0]['id'] for d in peer.sent], ['x'])
+        self.assertEqual([d['requests'][0]['id'] for d in fallback.sent], ['z'])
+
+        sent = peer.sent[0]['requests'][0]
+        self.assertTrue(sent['routed'])
+        self.assertEqual(sent['source'], 'a')
+
+
+class DirectCallTests(unittest.TestCase):
+    """an arbiter and workers in one process, over TCP"""
+
+    @async
+    def test_direct_calls(self):
+        worker_proxy = AgentProxy.worker
+        arbiter = Arbiter()
+        workers = [Worker() for _ in range(3)]
+
+        # count calls which go through the arbiter
+        arbiter_calls = Counter()
+        def counted(cmd, handler):
+            @asyncio.coroutine
+            def handle(data):
+                arbiter_calls[cmd] += len(data.get('requests', [data]))
+                return (yield from handler(data))
+            return handle
+        for cmd in ('call_agent', 'call_agents_batch'):
+            arbiter.handlers[cmd] = counted(cmd, arbiter.handlers[cmd])
+
+        yield from arbiter.start('127.0.0.1', 8980)
+        try:
+            for i, worker in enumerate(workers):
+                yield from worker.start('127.0.0.1', 8980, port=8981 + i)
+            agents = [TestAgent() for _ in range(6)]
+            yield from arbiter.populate({'agents': agents})
+            by_id = {w.id: w for w in workers}
+
+            # call an agent on another worker, from a worker
+            caller = workers[0]
+            target = next(id for id, w in arbiter.agents.items() if w != caller.id)
+            host = by_id[arbiter.agents[target]]
+            result = yield from caller.call_agent({'id': target, 'func': 'multiply', 'args': [3]})
+            self.assertEqual(result, 6)
+            self.assertEqual(host.remote_calls[target, caller.id], 1)
+            self.assertEqual(sum(arbiter_calls.values()), 0)
+
+            # migrating the agent publishes its new route
+            other = next(w for w in workers if w not in (caller, host))
+            yield from arbiter.migrate([(target, host.id, other.id)])
+            self.assertEqual(caller.router.agents[target], other.id)
+
+            # a stale route is redirected through the arbiter, and dropped
+            caller.router.update(agents={target: host.id})
+            result = yield from caller.call_agent({'id': target, 'func': 'multiply', 'args': [4]})
+            self.assertEqual(result, 8)
+            self.assertEqual(sum(arbiter_calls.values()), 1)
+            self.assertNotIn(target, caller.router.agents)
+            self.assertEqual(other.remote_calls[target, caller.id], 1)
+        finally:
+            for worker in workers:
+                for peer in worker.router.peers.values():
+                    peer.client.close()
+                worker.arbiter.close()
+                yield from worker.stop()
+            for client in arbiter.workers.values():
+                client.close()
+            yield from arbiter.stop()
+            AgentProxy.worker = worker_proxy
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import asyncio
+import unittest
+import numpy as np
+from cess.cluster import shm
+from cess.cluster.client import Client
+from cess.cluster.server import Server
+from tests import async
+
+
+class EchoServer(Server):
+    def __init__(self):
+        super().__init__()
+        self.handlers = {'echo': self.echo, 'fail': self.fail}
+
+    @asyncio.coroutine
+    def echo(self, data):
+        return data
+
+    @asyncio.coroutine
+    def fail(self, data):
+        raise RuntimeError('handler failed')
+
+
+@unittest.skipUnless(shm.available(), 'shared memory not supported')
+class SharedMemoryTests(unittest.TestCase):
+    def test_ring_buffer_wraps(self):
+        ring = shm.RingBuffer.create(capacity=16)
+        reader = shm.RingBuffer.attach(ring.name)
+        try:
+            out = bytearray(16)
+            view = memoryview(out)
+            for i in range(10):
+                data = bytes(range(i, i + 10))
+                self.assertEqual(ring.write(memoryview(data)), 10)
+                self.assertEqual(ring.write(memoryview(data)), 6)
+
+                # the reader only reads up to the head it's sent
+                self.assertEqual(reader.read_into(view), 0)
+                reader.head = ring.head
+                self.assertEqual(reader.read_into(view), 16)
+                self.assertEqual(out, data + data[:6])
+
+                # and the writer only reuses space up to the tail it's sent
+                self.assertEqual(ring.write(memoryview(data)), 0)
+                ring.tail = reader.tail
+            self.assertEqual(reader.readable(), 0)
+        finally:
+            view.release()
+            reader.close()
+            ring.close()
+
+    @async
+    def test_same_host_upgrade(self):
+        server = EchoServer()
+        yield from server.start('127.0.0.1', 8987)
+        client = Client('127.0.0.1', 8987, shared=True)
+        try:
+            resp = yield from client.send_recv({'cmd': 'echo', 'val': 1})
+            self.assertEqual(resp['val'], 1)
+            conn = client.pool.idle[0]
+            self.assertIsInstance(conn.reader, shm.Channel)
+
+            # payloads larger than the ring buffers are streamed through them
+            arr = np.arange(shm.DEFAULT_CAPACITY//2, dtype=np.float64)
+            resp = yield from client.send_recv({'cmd': 'echo', 'arr': arr})
+            self.assertTrue(np.array_equal(resp['arr'], arr))
+        finally:
+            client.close()
+            yield from server.stop()
+
+    @async
+    def test_many_messages(self):
+        # the peer is told about every message, so none are held up
+        server = EchoServer()
+        yield from server.start('127.0.0.1', 8984)
+        client = Client('127.0.0.1', 8984, shared=True)
+        try:
+            for i in range(200):
+                resp = yield from asyncio.wait_for(client.send_recv({'cmd': 'echo', 'val': i}), 1)
+                self.assertEqual(resp['val'], i)
+        finally:
+            client.close()
+            yield from server.stop()
+
+    @async
+    def test_released_on_failure(self):
+        server = EchoServer()
+        yield from server.start('127.0.0.1', 8989)
+        client = Client('127.0.0.1', 8989, shared=True)
+        try:
+            yield from client.send_recv({'cmd': 'echo', 'val': 1})
+            self.assertTrue(shm._created)
+
+            # the server's handling of the client fails,
+            # and its shared memory is released
+            with self.assertRaises((ConnectionError, EOFError)):
+                yield from client.send_recv({'cmd': 'fail'})
+            if server.clients:
+                yield from asyncio.wait(list(server.clients))
+            self.assertFalse(shm._created)
+        finally:
+            client.close()
+            yield from server.stop()
+
+    @async
+    def test_opt_in(self):
+        # shared memory is off by default
+        server = EchoServer()
+        yield from server.start('127.0.0.1', 8988)
+        client = Client('127.0.0.1', 8988)
+        try:
+            resp = yield from client.send_recv({'cmd': 'echo', 'val': 1})
+            self.assertEqual(resp['val'], 1)
+            self.assertNotIsInstance(client.pool.idle[0].reader, shm.Channel)
+        finally:
+            client.close()
+            yield from server.stop()
+
+if __name__ == '__main__':
+    unittest.main()
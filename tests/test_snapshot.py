@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+from cess import Simulation, snapshot
+from cess.agent import Agent, AgentProxy
+from tests import async
+
+
+class Firm(Agent):
+    snapshot_keys = ('price',)
+
+    def __init__(self, price):
+        self._super(Firm, self).__init__(state={'price': price, 'supply': 0})
+
+    def update(self, competitor):
+        price = yield from competitor.get('price')
+        self['price'] = price + 1
+        self['supply'] += 1
+
+
+class Market(Simulation):
+    def __init__(self, agents, snapshot=True):
+        super().__init__(agents, snapshot=snapshot)
+        n = len(agents)
+        self.competitors = [AgentProxy(agents[(i+1) % n]) for i in range(n)]
+
+    @asyncio.coroutine
+    def step(self):
+        yield from asyncio.gather(*[
+            agent.call('update', competitor)
+            for agent, competitor in zip(self.agents, self.competitors)])
+
+
+class SnapshotTests(unittest.TestCase):
+    def tearDown(self):
+        snapshot.clear()
+
+    def test_capture(self):
+        firm = Firm(10)
+        snap = snapshot.capture([firm, Agent(state={'price': 5})])
+        self.assertEqual(snap, {firm.id: {'price': 10}})
+
+    @async
+    def test_get(self):
+        firm = Firm(10)
+        snapshot.publish(snapshot.capture([firm]))
+        firm['price'] = 20
+
+        # writes go to the live state, reads of snapshot keys come from the snapshot
+        self.assertEqual(firm['price'], 20)
+        self.assertEqual((yield from firm.get('price')), 10)
+        self.assertEqual((yield from firm.get('supply')), 0)
+
+        # served without calling the agent's worker
+        proxy = AgentProxy(firm)
+        self.assertEqual((yield from proxy.get('price')), 10)
+
+        snapshot.clear()
+        self.assertEqual((yield from firm.get('price')), 20)
+
+    def test_local(self):
+        sim = Market([Firm(i) for i in range(4)])
+        sim.run(2)
+
+        # every firm reads its competitor's price as of the start of the step
+        self.assertEqual([a['price'] for a in sim.agents], [4, 5, 2, 3])
+        self.assertEqual([a['supply'] for a in sim.agents], [2, 2, 2, 2])
+        self.assertIsNone(snapshot.current())
+
+    def test_distributed(self):
+        local = Market([Firm(i) for i in range(8)])
+        local.run(3)
+
+        sim = Market([Firm(i) for i in range(8)])
+        sim.run(3, workers=3)
+        self.assertEqual([a['price'] for a in sim.agents],
+                         [a['price'] for a in local.agents])
+        self.assertIsNone(snapshot.current())
+
+
+if __name__ == '__main__':
+    unittest.main()
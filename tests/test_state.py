@@ -25,6 +25,61 @@ class TestStateUpdates(unittest.TestCase):
         end = update_state(end, updates)
         self.assertEqual(end,expected2 )  # no change
         
+    def test_state_hash(self):
+        parent = {'money': 10, 'time': 10}
+        self.assertEqual(state_hash(parent), state_hash({'time': 10, 'money': 10}))
+
+        # incremental hashes should match hashing from scratch
+        phash = state_hash(parent)
+        for child in [{'money': 20, 'time': 10},
+                      {'money': 10},
+                      {'money': 10, 'time': 10, 'food': 2}]:
+            self.assertEqual(state_hash(child, parent, phash), state_hash(child))
+        self.assertNotEqual(state_hash({'money': 20, 'time': 10}), phash)
+
+    def test_state(self):
+        start = {'money': 10, 'time': 10, 'food': 2}
+        state = State(start)
+        updates = {'money': 10, 'time': lambda x: x['time'] + x['money']}
+
+        # the same as updating a dict, without changing the original
+        end = update_state(state, updates)
+        self.assertIsInstance(end, State)
+        self.assertEqual(end, update_state(start, updates))
+        self.assertEqual(end.to_dict(), {'money': 20, 'time': 30, 'food': 2})
+        self.assertEqual(state, start)
+        with self.assertRaises(TypeError):
+            end['money'] = 0
+
+        # hashes are updated incrementally, and match hashing from scratch
+        hash(state)
+        end = update_state(state, updates)
+        self.assertEqual(end._hash, state_hash(end.to_dict()))
+        self.assertEqual(hash(end), hash(State(end.to_dict())))
+        self.assertNotEqual(hash(end), hash(state))
+        self.assertEqual(len(set([end, State(end.to_dict()), state])), 2)
+
+        # updates only copy the changes
+        self.assertIs(end._base, state._base)
+        self.assertEqual(end.set('food', 3)['food'], 3)
+        self.assertEqual(end['food'], 2)
+
+        # states sharing a base can tell which keys differ
+        self.assertEqual(sorted(end.changed_from(state)), ['money', 'time'])
+        self.assertEqual(sorted(state.changed_from(end)), ['money', 'time'])
+        self.assertEqual(end.set('money', 20).changed_from(end), [])
+        self.assertIsNone(end.changed_from(State(end.to_dict())))
+
+    def test_attenuate_state(self):
+        ranges = {'money': (0, 15), 'time': (None, 5)}
+        state = State({'money': 20, 'time': 3})
+        self.assertEqual(attenuate_state(state, ranges), {'money': 15, 'time': 3})
+        self.assertEqual(state['money'], 20)
+
+        start = {'money': 20, 'time': 3}
+        self.assertIs(attenuate_state(start, ranges), start)
+        self.assertEqual(start, {'money': 15, 'time': 3})
+
 
 if __name__ == '__main__':    
     unittest.main()
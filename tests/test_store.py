@@ -0,0 +1,114 @@
+import pickle
+import asyncio
+import unittest
+import numpy as np
+from cess import Simulation
+from cess.agent import Agent, AgentStore
+from tests import async
+
+
+class Employee(Agent):
+    def raise_wage(self):
+        self['wage'] += 100
+
+
+class WageSim(Simulation):
+    @asyncio.coroutine
+    def step(self):
+        yield from asyncio.gather(*[a.call('raise_wage') for a in self.agents])
+
+
+class StoreTests(unittest.TestCase):
+    def setUp(self):
+        self.store = AgentStore(capacity=2)
+        self.agents = [Agent(state={'wage': i, 'employer': None}, store=self.store) for i in range(5)]
+
+    def test_item_access(self):
+        agent = self.agents[2]
+        self.assertEqual(agent['wage'], 2)
+        self.assertEqual(agent['employer'], None)
+
+        agent['wage'] = 10
+        self.assertEqual(agent['wage'], 10)
+        self.assertEqual(self.store.column('wage').tolist(), [0, 1, 10, 3, 4])
+
+        # type changes upcast the column
+        agent['wage'] = 10.5
+        self.assertEqual(agent['wage'], 10.5)
+        self.assertEqual(self.agents[1]['wage'], 1)
+
+        # objects are stored as-is
+        agent['employer'] = [1, 2]
+        agent['employer'].append(3)
+        self.assertEqual(agent['employer'], [1, 2, 3])
+
+        with self.assertRaises(KeyError):
+            agent['missing']
+
+    @async
+    def test_get_set(self):
+        agent = self.agents[3]
+        yield from agent.set(wage=20, cash=5)
+        wage, cash = yield from agent.get('wage', 'cash')
+        self.assertEqual(wage, 20)
+        self.assertEqual(cash, 5)
+
+        # only this agent has cash
+        self.assertEqual(self.store.reduce('cash', np.sum), 5)
+
+    def test_vectorized(self):
+        self.store.write('wage', np.arange(5) * 2)
+        self.assertEqual(self.agents[4]['wage'], 8)
+        self.assertEqual(self.store.reduce('wage'), 4)
+
+        ids = [self.agents[0].id, self.agents[1].id]
+        self.store.write('wage', [100, 200], ids=ids)
+        self.assertEqual(self.store.read('wage', ids).tolist(), [100, 200])
+
+    def test_remove(self):
+        removed = self.agents[1]
+        state = self.store.remove(removed.id)
+        self.assertEqual(state, {'wage': 1, 'employer': None})
+        self.assertEqual(len(self.store), 4)
+        self.assertEqual(self.agents[4]['wage'], 4)
+        self.assertEqual(sorted(self.store.column('wage').tolist()), [0, 2, 3, 4])
+
+    def test_remove_detaches(self):
+        # the last row is moved into the removed one
+        removed, moved = self.agents[0], self.agents[4]
+        self.store.remove(removed.id)
+
+        # the removed agent's view no longer reads or writes the moved agent's row
+        with self.assertRaises(ValueError):
+            removed['wage']
+        with self.assertRaises(ValueError):
+            removed['wage'] = 99
+        self.assertEqual(moved['wage'], 4)
+        moved['wage'] = 40
+        self.assertEqual(self.store.column('wage').tolist(), [40, 1, 2, 3])
+
+    def test_pickle_detaches(self):
+        agent = pickle.loads(pickle.dumps(self.agents[0]))
+        self.assertEqual(agent._state, {'wage': 0, 'employer': None})
+        self.assertIsInstance(agent._state, dict)
+
+    def test_simulation(self):
+        sim = Simulation(self.agents + [Agent(state={'wage': 100})])
+        self.assertEqual(sim.reduce('wage'), 2)
+        self.assertEqual(sim.reduce('wage', type=Agent), 2)
+        sim.write('wage', 1)
+        self.assertEqual(sim.read('wage').tolist(), [1] * 5)
+
+    def test_multiprocess_run(self):
+        store = AgentStore()
+        agents = [Employee(state={'wage': i}, store=store) for i in range(4)]
+        sim = WageSim(agents)
+        sim.run(1, workers=2)
+
+        # agents are put back into their store when they're collected
+        self.assertEqual([a['wage'] for a in sim.agents], [100, 101, 102, 103])
+        self.assertEqual(sim.read('wage').tolist(), [100, 101, 102, 103])
+        self.assertIs(sim.agents[0]._state.store, store)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+from cess.cluster import transport, shm
+from cess.cluster.client import Client
+from tests.test_shm import EchoServer
+from tests import async
+
+
+class TransportTests(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(transport.parse('localhost:8888'), ('localhost', 8888))
+        self.assertEqual(transport.parse('unix:/tmp/cess.sock'), ('unix', '/tmp/cess.sock'))
+
+    @async
+    def test_unix_socket(self):
+        path = os.path.join(tempfile.mkdtemp(), 'cess.sock')
+        server = EchoServer()
+        yield from server.start('unix', path)
+        try:
+            for shared in (False, True):
+                client = Client('unix', path, shared=shared)
+                resp = yield from client.send_recv({'cmd': 'echo', 'val': 1})
+                self.assertEqual(resp['val'], 1)
+                conn = client.pool.idle[0]
+                self.assertEqual(isinstance(conn.reader, shm.Channel), shared and shm.available())
+                client.close()
+        finally:
+            yield from server.stop()
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import random
+import unittest
+import numpy as np
+from collections import Counter
+from cess.rng import Stream
+from cess.util import Sampler, random_choice_many, uniforms, LRUCache
+
+
+class SamplerTests(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(0)
+
+    def test_draw(self):
+        sampler = Sampler([('a', 1.), ('b', 3.), ('c', 0.)], rng=self.rng)
+        self.assertEqual(len(sampler), 2)
+        counts = Counter(sampler.draw() for _ in range(4000))
+        self.assertEqual(counts['c'], 0)
+        self.assertAlmostEqual(counts['b']/4000, 0.75, delta=0.05)
+
+    def test_draw_many(self):
+        sampler = Sampler([('a', 1.), ('b', 3.), ('c', 0.)], rng=self.rng)
+        counts = Counter(sampler.draw_many(4000))
+        self.assertEqual(counts['c'], 0)
+        self.assertAlmostEqual(counts['b']/4000, 0.75, delta=0.05)
+
+        # updates are reflected in later draws, whether
+        # they're from the tree or the cumulative sum
+        sampler.remove('b')
+        self.assertEqual(set(sampler.draw_many(4000)), {'a'})
+        sampler.update('c', 1.)
+        self.assertEqual(set(sampler.draw_many(1)) | set(sampler.draw_many(4000)), {'a', 'c'})
+
+    def test_update_and_remove(self):
+        sampler = Sampler([(i, 1.) for i in range(10)], rng=self.rng)
+        for i in range(9):
+            sampler.remove(i)
+        self.assertEqual(len(sampler), 1)
+        self.assertEqual(set(sampler.draw() for _ in range(100)), {9})
+
+        sampler.update(3, 2.)
+        self.assertEqual(set(sampler.draw() for _ in range(100)), {3, 9})
+
+        sampler.remove(3)
+        sampler.remove(9)
+        self.assertFalse(sampler)
+        self.assertRaises(IndexError, sampler.draw)
+
+    def test_random_choice_many(self):
+        choices = random_choice_many([('a', 0.25), ('b', 0.75)], 4000, rng=self.rng)
+        self.assertEqual(len(choices), 4000)
+        self.assertAlmostEqual(choices.count('b')/4000, 0.75, delta=0.05)
+        self.assertEqual(random_choice_many([], 10), [])
+        with self.assertRaises(ValueError):
+            random_choice_many([('a', 0), ('b', 0)], 10)
+
+
+class UniformsTests(unittest.TestCase):
+    def test_uniforms(self):
+        # a stream's numbers come from its batch
+        self.assertTrue(np.array_equal(uniforms(10, Stream(0, 1)), Stream(0, 1).batch(10)))
+
+        # others are drawn at once, reproducibly
+        rolls = uniforms(4000, random.Random(0))
+        self.assertTrue(np.array_equal(rolls, uniforms(4000, random.Random(0))))
+        self.assertTrue(((rolls >= 0) & (rolls < 1)).all())
+        self.assertAlmostEqual(rolls.mean(), 0.5, delta=0.05)
+        self.assertEqual(len(uniforms(0)), 0)
+
+
+class LRUCacheTests(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+
+        # 'b' was least recently used
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'size': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -40,5 +40,34 @@ class UtilityTests(unittest.TestCase):
 
         self.assertTrue(util1 > util2)
 
+    def test_utility_model(self):
+        ufuncs_ = {
+            'cash': lambda x: x,
+            'sup': lambda x: 1 if x > 10 else 0
+        }
+        model = utility.UtilityModel(ufuncs_)
+        self.assertTrue(model.vectorized['cash'])
+        self.assertFalse(model.vectorized['sup'])
+
+        state = {'cash': 0, 'sup': 0}
+        states = [{'cash': 1000, 'sup': 20}, {'cash': 500}, {'sup': 5}]
+        utils = model.change_utilities(state, states)
+        for util, to_state in zip(utils, states):
+            self.assertEqual(util, utility.change_utility(ufuncs_, state, to_state))
+
+        utils = model.state_utilities(states)
+        for util, to_state in zip(utils, states):
+            self.assertEqual(util, utility.state_utility(ufuncs_, to_state))
+
+    def test_utility_model_expected_utility(self):
+        model = utility.UtilityModel(ufuncs)
+        state = {'cash': 0}
+        outcomes = outcome_dist(state, [{'cash': 1000}, {'cash': 2000}], [0.5, 0.5])
+
+        # outcomes may be a generator, which may be empty
+        self.assertEqual(model.expected_utility(state, outcomes), 1500)
+        self.assertEqual(model.expected_utility(state, (o for o in [])), 0)
+
+
 if __name__ == '__main__':
     unittest.main()